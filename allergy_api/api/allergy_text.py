@@ -0,0 +1,96 @@
+import re
+
+import matcher
+import versioned
+
+# Free-text allergy lists, as EHRs send them: "PCN - hives; sulfa; latex
+# gloves". The text is split into fragments at semicolons, commas, pipes and
+# line breaks, and each fragment is scanned by one Aho-Corasick automaton
+# (matcher.py) compiled from every name and synonym of the allergies and
+# ingredients (PCN, sulfa, ASA). An ingredient stands for the allergies that cover it:
+# those linked to it exactly, and class allergies whose class tree holds one
+# of its classes, so "amoxicillin" resolves to the penicillin allergy. Of
+# overlapping matches the longest wins. Words around a match, like the
+# reaction in "PCN - hives", are ignored, and a fragment with no match at all
+# is returned as unmatched. The automaton is rebuilt when the knowledge base
+# version changes.
+
+SEPARATORS = re.compile(r'[;,|\r\n]+')
+
+# Fragments saying there is nothing to resolve
+NO_ALLERGIES = ('nka', 'nkda', 'no known allergies', 'no known drug allergies', 'none')
+
+
+class AllergyTextParser:
+    """Free-text allergy lists resolved to allergy ids, rebuilt when the knowledge base version changes"""
+
+    def __init__(self, connect, version_fn, check_interval=60.0):
+        self.connect = connect
+        self._index = versioned.VersionedCache(self._load, version_fn, check_interval)
+
+    def _load(self):
+        conn = self.connect()
+        names = dict(conn.execute('SELECT id, name FROM allergies').fetchall())
+        allergy_names = conn.execute('''
+            SELECT id, name FROM allergies
+            UNION ALL SELECT entity_id, name FROM synonyms WHERE entity_type = 'allergy'
+        ''').fetchall()
+        # The allergies each ingredient name stands for: exact links, and class allergies covering one of its classes
+        covers = conn.execute('''
+            WITH covers AS (
+                SELECT ingredient_id, allergy_id FROM allergy_ingredients WHERE relationship = 'exact'
+                UNION
+                SELECT ic.ingredient_id, ac.allergy_id
+                FROM ingredient_classes ic
+                JOIN drug_classes m ON m.id = ic.class_id
+                JOIN allergy_classes ac
+                JOIN drug_classes c ON c.id = ac.class_id
+                WHERE m.tree_left BETWEEN c.tree_left AND c.tree_right
+            ),
+            ingredient_names AS (
+                SELECT id, name FROM ingredients
+                UNION ALL SELECT entity_id, name FROM synonyms WHERE entity_type = 'ingredient'
+            )
+            SELECT n.name, covers.allergy_id
+            FROM ingredient_names n
+            JOIN covers ON covers.ingredient_id = n.id
+        ''').fetchall()
+        conn.close()
+
+        phrases = [(name, allergy_id) for allergy_id, name in allergy_names]
+        for name, allergy_id in covers:
+            phrases.append((name, allergy_id))
+        for phrase in NO_ALLERGIES:
+            phrases.append((phrase, None))
+        return matcher.Automaton(phrases), names
+
+    def parse(self, text):
+        """(resolved, unmatched): each resolved allergy with the text that named it, and fragments naming none"""
+        automaton, names = self._index.get()
+        resolved = {}
+        unmatched = []
+        for fragment in SEPARATORS.split(text):
+            fragment = fragment.strip()
+            if not fragment:
+                continue
+            # Longest first, then leftmost; a phrase inside a longer match is dropped
+            taken = []
+            matches = sorted(automaton.scan(fragment), key=lambda m: (m[0] - m[1], m[0]))
+            for start, end, value in matches:
+                if any(start < e and s < end and (s, e) != (start, end) for s, e, _ in taken):
+                    continue
+                taken.append((start, end, value))
+            if not taken:
+                unmatched.append(fragment)
+            for start, end, allergy_id in sorted(taken, key=lambda m: m[:2]):
+                if allergy_id is not None and allergy_id not in resolved:
+                    resolved[allergy_id] = {'id': allergy_id, 'name': names[allergy_id],
+                                            'text': fragment[start:end]}
+        return list(resolved.values()), unmatched
+
+    def load(self):
+        """Build the index now rather than on first use"""
+        self._index.get()
+
+    def clear(self):
+        self._index.clear()
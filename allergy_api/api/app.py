@@ -1,232 +1,301 @@
+import base64
+import json
+import math
 import sqlite3
 import os
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, current_app, request, jsonify
 from flask_cors import CORS
+from werkzeug.local import LocalProxy
 import re
 
-app = Flask(__name__)
-CORS(app)
+import auth
+import compression
+import instrumentation
+import metrics
+import profiling
+import query_audit
+import ratelimit
+import sampler
+import serialization
+import storage
+import structured_logging
+from instrumentation import timed
+
+# The knowledge base shipped with the API, found from this file rather than the working directory
+DEFAULT_DATABASE = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                 '..', '..', 'database', 'allergy_api.db'))
+
+# The routes; create_app registers them on an app
+api = Blueprint('api', __name__)
+
+def config_from_env():
+    """App configuration from the ALLERGY_API_* environment variables"""
+    config = {}
+
+    # SQLite knowledge base; a relative path is taken from the working directory at startup
+    config['DATABASE'] = os.environ.get('ALLERGY_API_DATABASE', DEFAULT_DATABASE)
+
+    # Where the routes read the knowledge base: sqlite (queries per request) or memory (tables read once)
+    config['STORAGE'] = os.environ.get('ALLERGY_API_STORAGE', 'sqlite')
+
+    # Cross-reactivity paths are followed up to this many hops
+    config['CROSS_REACTIVITY_MAX_DEPTH'] = int(os.environ.get('ALLERGY_API_CROSS_REACTIVITY_MAX_DEPTH', '3'))
+
+    # Opt-in per-request Server-Timing header and SQL accounting
+    config['SERVER_TIMING'] = os.environ.get('ALLERGY_API_SERVER_TIMING') == '1'
+    config['SERVER_TIMING_METADATA'] = os.environ.get('ALLERGY_API_SERVER_TIMING_METADATA') == '1'
+
+    # Prometheus-compatible /metrics; METRICS_DIR aggregates across gunicorn workers
+    config['METRICS'] = os.environ.get('ALLERGY_API_METRICS', '1') == '1'
+    config['METRICS_DIR'] = os.environ.get('ALLERGY_API_METRICS_DIR')
+    config['METRICS_FLUSH_INTERVAL'] = float(os.environ.get('ALLERGY_API_METRICS_FLUSH_INTERVAL', '5'))
+
+    # Debug-mode SQL auditor: per-statement timings, query plans and a slow-query log
+    config['QUERY_AUDIT'] = os.environ.get('ALLERGY_API_QUERY_AUDIT') == '1'
+    config['QUERY_AUDIT_SLOW_MS'] = float(os.environ.get('ALLERGY_API_QUERY_AUDIT_SLOW_MS', '50'))
+    config['QUERY_AUDIT_LOG'] = os.environ.get('ALLERGY_API_QUERY_AUDIT_LOG', 'slow_queries.log')
+
+    # Structured, non-blocking logging; ALLERGY_API_ACCESS_LOG=1 adds a record per request
+    config['ACCESS_LOG'] = os.environ.get('ALLERGY_API_ACCESS_LOG') == '1'
+
+    # On-demand single-request profiling; off unless enabled and a token is configured
+    config['PROFILING'] = os.environ.get('ALLERGY_API_PROFILING') == '1'
+    config['PROFILING_TOKEN'] = os.environ.get('ALLERGY_API_PROFILING_TOKEN')
+    config['PROFILING_DIR'] = os.environ.get('ALLERGY_API_PROFILING_DIR')
+    config['PROFILING_MAX_PER_MINUTE'] = int(os.environ.get('ALLERGY_API_PROFILING_MAX_PER_MINUTE', '6'))
+
+    # Continuous stack sampler writing per-route collapsed stacks for flamegraphs
+    config['SAMPLER'] = os.environ.get('ALLERGY_API_SAMPLER') == '1'
+    config['SAMPLER_INTERVAL_MS'] = float(os.environ.get('ALLERGY_API_SAMPLER_INTERVAL_MS', '10'))
+    config['SAMPLER_DIR'] = os.environ.get('ALLERGY_API_SAMPLER_DIR', 'profiles')
+    config['SAMPLER_FLUSH_SECONDS'] = float(os.environ.get('ALLERGY_API_SAMPLER_FLUSH_SECONDS', '60'))
+    config['SAMPLER_KEEP_FILES'] = int(os.environ.get('ALLERGY_API_SAMPLER_KEEP_FILES', '60'))
+    config['SAMPLER_MAX_OVERHEAD'] = float(os.environ.get('ALLERGY_API_SAMPLER_MAX_OVERHEAD', '0.01'))
+
+    # API keys required on /v1/*; verified keys are cached for AUTH_CACHE_TTL seconds
+    config['AUTH'] = os.environ.get('ALLERGY_API_AUTH') == '1'
+    config['AUTH_CACHE_TTL'] = float(os.environ.get('ALLERGY_API_AUTH_CACHE_TTL', '30'))
+
+    # orjson when installed (JSON_ENCODER=stdlib to disable); responses are byte-identical either way
+    config['JSON_ENCODER'] = os.environ.get('ALLERGY_API_JSON_ENCODER', 'auto')
+    config['JSON_FRAGMENTS'] = os.environ.get('ALLERGY_API_JSON_FRAGMENTS', '1') == '1'
+
+    # application/msgpack request bodies and Accept-negotiated responses on /v1/*; needs the msgpack package
+    config['MSGPACK'] = os.environ.get('ALLERGY_API_MSGPACK', '1') == '1'
+
+    # Accept-Encoding negotiated compression; br and zstd need the brotli/zstandard packages
+    config['COMPRESSION'] = os.environ.get('ALLERGY_API_COMPRESSION', '1') == '1'
+    config['COMPRESSION_MIN_SIZE'] = int(os.environ.get('ALLERGY_API_COMPRESSION_MIN_SIZE', '1024'))
+    config['COMPRESSION_ENCODINGS'] = os.environ.get('ALLERGY_API_COMPRESSION_ENCODINGS', 'zstd,br,gzip')
+
+    # Per-API-key token buckets; RATE_LIMIT_STORE shares them across workers via SQLite
+    config['RATE_LIMIT'] = os.environ.get('ALLERGY_API_RATE_LIMIT') == '1'
+    config['RATE_LIMIT_TIERS'] = os.environ.get('ALLERGY_API_RATE_LIMIT_TIERS')
+    config['RATE_LIMIT_DEFAULT_TIER'] = os.environ.get('ALLERGY_API_RATE_LIMIT_DEFAULT_TIER', 'anonymous')
+    config['RATE_LIMIT_KEYS'] = os.environ.get('ALLERGY_API_RATE_LIMIT_KEYS')
+    config['RATE_LIMIT_STORE'] = os.environ.get('ALLERGY_API_RATE_LIMIT_STORE')
+    return config
 
 # Database connection
-def get_db_connection():
-    conn = sqlite3.connect('../../database/allergy_api.db')
+def connect_database(database, factory=sqlite3.Connection):
+    conn = sqlite3.connect(database, factory=factory)
     conn.row_factory = sqlite3.Row
     return conn
 
+def get_db_connection():
+    """A connection to the knowledge base of the current app"""
+    return current_app.extensions['allergy_api'].connect()
+
 # Helper functions
-def normalize_name(name):
-    """Normalize a name by converting to lowercase and removing special characters"""
-    return re.sub(r'[^a-z0-9]', '', name.lower())
+def knowledge_base_version(connect):
+    """Version of the knowledge base connect opens: the change counter its triggers maintain"""
+    conn = connect()
+    row = conn.execute('SELECT version FROM knowledge_base_version').fetchone()
+    conn.close()
+    return {'version': str(row['version']) if row else 'unknown'}
+
+class KnowledgeBase:
+    """An app's knowledge base: its database, the storage backend reading it and the fragments serialized from it"""
+
+    def __init__(self, database, backend='sqlite', max_depth=3, fragments=True):
+        self.database = database
+        self.store = storage.BACKENDS[backend](self.connect, self.version, max_depth)
+        # Per-drug response parts that do not depend on the patient, serialized once
+        self.fragments = serialization.FragmentCache(self.version)
+        self.fragments.enabled = fragments
+        # State of the optional features, set by their init_app from the app's config
+        self.connection_class = sqlite3.Connection
+        self.auditor = None
+        self.api_keys = None
+        self.rate_limiter = None
+        self.sampler = None
+
+    def connect(self):
+        return connect_database(self.database, self.connection_class)
+
+    def version(self):
+        return knowledge_base_version(self.connect)
+
+def get_knowledge_base_version():
+    """Version of the current app's knowledge base"""
+    return current_app.extensions['allergy_api'].version()
+
+# The storage backend and fragment cache of the app handling the request
+store = LocalProxy(lambda: current_app.extensions['allergy_api'].store)
+fragments = LocalProxy(lambda: current_app.extensions['allergy_api'].fragments)
+
+# Top-level fields ?fields= can select; batch fields apply to each result, except metadata
+CHECK_FIELDS = ('drug', 'contraindications', 'warnings', 'safe', 'metadata')
+BATCH_FIELDS = ('drug', 'contraindications', 'warnings', 'safe', 'metadata')
+
+# Page size of the related lists in /v1/allergy
+ALLERGY_PAGE_LIMIT = 100
+ALLERGY_PAGE_MAX = 1000
+
+# Label full-text search: page size, and the kinds of label text indexed
+LABEL_SEARCH_LIMIT = 20
+LABEL_SEARCH_MAX = 100
+LABEL_KINDS = ('warning', 'contraindication')
+
+# Catalog search: page size, entity types and match kinds, best match first
+CATALOG_SEARCH_LIMIT = 10
+CATALOG_SEARCH_MAX = 100
+CATALOG_TYPES = ('drug', 'generic', 'brand', 'ingredient')
+CATALOG_MATCHES = ('exact', 'prefix', 'token')
 
 def find_drug_by_identifier(identifier, identifier_type='name'):
     """Find a drug by name, rxcui, or ndc"""
-    conn = get_db_connection()
-    
+    if identifier_type == 'ndc':
+        return store.drugs_by_ndcs([identifier]).get(identifier)
     if identifier_type == 'rxcui':
-        drug = conn.execute('SELECT * FROM drugs WHERE rxcui = ?', (identifier,)).fetchone()
-    elif identifier_type == 'ndc':
-        drug = conn.execute('SELECT * FROM drugs WHERE ndc = ?', (identifier,)).fetchone()
-    else:  # default to name
-        drug = conn.execute('SELECT * FROM drugs WHERE name = ? OR generic_name = ?', 
-                           (identifier, identifier)).fetchone()
-        
-        # If not found by exact match, try normalized name
-        if drug is None:
-            normalized = normalize_name(identifier)
-            drug = conn.execute('''
-                SELECT * FROM drugs 
-                WHERE normalize_name(name) = ? OR normalize_name(generic_name) = ?
-            ''', (normalized, normalized)).fetchone()
-            
-            # If still not found, try brand names
-            if drug is None:
-                brand = conn.execute('''
-                    SELECT d.* FROM drugs d
-                    JOIN brand_names b ON d.id = b.drug_id
-                    WHERE normalize_name(b.name) = ?
-                ''', (normalized,)).fetchone()
-                if brand:
-                    drug = brand
-    
-    conn.close()
-    return dict(drug) if drug else None
-
-def get_drug_ingredients(drug_id):
-    """Get all ingredients for a drug"""
-    conn = get_db_connection()
-    ingredients = conn.execute('''
-        SELECT i.*, di.is_active 
-        FROM ingredients i
-        JOIN drug_ingredients di ON i.id = di.ingredient_id
-        WHERE di.drug_id = ?
-    ''', (drug_id,)).fetchall()
-    conn.close()
-    return [dict(i) for i in ingredients]
-
-def get_drug_contraindications(drug_id):
-    """Get all contraindications for a drug"""
-    conn = get_db_connection()
-    contraindications = conn.execute('''
-        SELECT dc.*, c.name as condition_name, c.normalized_name as condition_normalized_name
-        FROM drug_contraindications dc
-        JOIN conditions c ON dc.condition_id = c.id
-        WHERE dc.drug_id = ?
-    ''', (drug_id,)).fetchall()
-    conn.close()
-    return [dict(c) for c in contraindications]
+        return store.drugs_by_rxcuis([identifier]).get(identifier)
+    return store.drugs_by_names([identifier]).get(identifier)
 
-def get_drug_warnings(drug_id):
-    """Get all warnings for a drug"""
-    conn = get_db_connection()
-    warnings = conn.execute('SELECT * FROM drug_warnings WHERE drug_id = ?', (drug_id,)).fetchall()
-    conn.close()
-    return [dict(w) for w in warnings]
+def format_check_drug(drug, include_inactive=True):
+    """The drug block of a /v1/check response"""
+    return {
+        'name': drug['name'],
+        'rxcui': drug['rxcui'],
+        'ndc': drug['ndc'],
+        'ingredients': [
+            {
+                'name': i['name'],
+                'type': 'active' if i['is_active'] else 'inactive',
+                'rxcui': i['rxcui']
+            } for i in store.drug_ingredients(drug['id'])
+            if include_inactive or i['is_active']
+        ]
+    }
 
-def find_allergies_by_names(allergy_names):
-    """Find allergies by their names"""
-    if not allergy_names:
-        return []
-        
-    conn = get_db_connection()
-    placeholders = ', '.join(['?'] * len(allergy_names))
-    allergies = conn.execute(f'''
-        SELECT * FROM allergies 
-        WHERE name IN ({placeholders}) OR normalized_name IN ({placeholders})
-    ''', allergy_names + allergy_names).fetchall()
-    conn.close()
-    return [dict(a) for a in allergies]
+def format_check_warnings(drug_id, include_evidence):
+    """The warnings of a /v1/check response"""
+    return [
+        {
+            'type': w['type'],
+            'name': w['type'].capitalize(),
+            'severity': 'medium',
+            'description': w['text'],
+            'evidence': {
+                'source': w['source'],
+                'text': w['text']
+            } if include_evidence else None,
+            'recommendation': 'Follow warning instructions'
+        } for w in store.drug_warnings(drug_id)
+    ]
 
-def find_conditions_by_names(condition_names):
-    """Find conditions by their names"""
-    if not condition_names:
-        return []
-        
-    conn = get_db_connection()
-    placeholders = ', '.join(['?'] * len(condition_names))
-    conditions = conn.execute(f'''
-        SELECT * FROM conditions 
-        WHERE name IN ({placeholders}) OR normalized_name IN ({placeholders})
-    ''', condition_names + condition_names).fetchall()
-    conn.close()
-    return [dict(c) for c in conditions]
+def format_batch_warnings(drug_id):
+    """The warnings of a /v1/batch/check result"""
+    return [
+        {
+            'type': w['type'],
+            'name': w['type'].capitalize(),
+            'severity': 'medium',
+            'description': w['text']
+        } for w in store.drug_warnings(drug_id)
+    ]
 
-def check_allergy_contraindications(drug_id, allergy_ids, include_cross_reactivity=True):
-    """Check if a drug is contraindicated for given allergies"""
-    if not allergy_ids:
-        return []
-        
-    conn = get_db_connection()
-    
-    # Get all ingredients for the drug
-    drug_ingredients = conn.execute('''
-        SELECT i.id, i.name, di.is_active
-        FROM ingredients i
-        JOIN drug_ingredients di ON i.id = di.ingredient_id
-        WHERE di.drug_id = ?
-    ''', (drug_id,)).fetchall()
-    
-    contraindications = []
-    
-    # Check direct ingredient matches
-    for allergy_id in allergy_ids:
-        # Get ingredients related to this allergy
-        allergy_ingredients = conn.execute('''
-            SELECT i.id, i.name, ai.relationship, ai.evidence_level, a.name as allergy_name
-            FROM ingredients i
-            JOIN allergy_ingredients ai ON i.id = ai.ingredient_id
-            JOIN allergies a ON ai.allergy_id = a.id
-            WHERE ai.allergy_id = ?
-        ''', (allergy_id,)).fetchall()
-        
-        # Check if any drug ingredient matches allergy ingredients
-        for drug_ing in drug_ingredients:
-            for allergy_ing in allergy_ingredients:
-                if drug_ing['id'] == allergy_ing['id']:
-                    contraindications.append({
-                        'type': 'allergy',
-                        'name': allergy_ing['allergy_name'],
-                        'severity': 'high' if drug_ing['is_active'] else 'medium',
-                        'description': f"Contains {allergy_ing['name']} which is related to {allergy_ing['allergy_name']} allergy",
-                        'evidence': {
-                            'source': 'custom',
-                            'text': f"Direct match with {allergy_ing['relationship']} relationship, {allergy_ing['evidence_level']} evidence"
-                        },
-                        'recommendation': 'Avoid this medication'
-                    })
-    
-    # Check cross-reactivity if enabled
-    if include_cross_reactivity:
-        for drug_ing in drug_ingredients:
-            cross_reactions = conn.execute('''
-                SELECT cr.*, i.name as target_name, 
-                       (SELECT name FROM allergies WHERE id = 
-                           (SELECT allergy_id FROM allergy_ingredients WHERE ingredient_id = cr.source_id LIMIT 1)
-                       ) as source_allergy
-                FROM cross_reactivity cr
-                JOIN ingredients i ON cr.target_id = i.id
-                WHERE cr.target_id = ?
-            ''', (drug_ing['id'],)).fetchall()
-            
-            for reaction in cross_reactions:
-                # Check if the source of cross-reactivity is in our allergy list
-                source_allergy = conn.execute('''
-                    SELECT a.* FROM allergies a
-                    JOIN allergy_ingredients ai ON a.id = ai.allergy_id
-                    WHERE ai.ingredient_id = ? AND a.id IN ({})
-                '''.format(','.join(['?'] * len(allergy_ids))), 
-                [reaction['source_id']] + allergy_ids).fetchone()
-                
-                if source_allergy:
-                    contraindications.append({
-                        'type': 'allergy',
-                        'name': source_allergy['name'],
-                        'severity': 'medium' if reaction['evidence_level'] == 'high' else 'low',
-                        'description': f"Contains {reaction['target_name']} which may cross-react with {source_allergy['name']} allergy",
-                        'evidence': {
-                            'source': 'custom',
-                            'text': reaction['description']
-                        },
-                        'recommendation': 'Use with caution' if reaction['evidence_level'] == 'low' else 'Consider alternative medication'
-                    })
-    
-    conn.close()
-    return contraindications
+def parse_allergy_text(patient):
+    """The allergies named in patient.allergy_text and the fragments naming none, or None without one"""
+    text = patient.get('allergy_text')
+    if text is None:
+        return None
+    resolved, unmatched = store.parse_allergy_text(text)
+    return {'resolved': resolved, 'unmatched': unmatched}
 
-def check_condition_contraindications(drug_id, condition_ids):
-    """Check if a drug is contraindicated for given conditions"""
-    if not condition_ids:
-        return []
-        
-    conn = get_db_connection()
-    
-    placeholders = ', '.join(['?'] * len(condition_ids))
-    contraindications = conn.execute(f'''
-        SELECT dc.*, c.name as condition_name
-        FROM drug_contraindications dc
-        JOIN conditions c ON dc.condition_id = c.id
-        WHERE dc.drug_id = ? AND dc.condition_id IN ({placeholders})
-    ''', [drug_id] + condition_ids).fetchall()
-    
-    conn.close()
-    
-    result = []
-    for c in contraindications:
-        result.append({
-            'type': 'condition',
-            'name': c['condition_name'],
-            'severity': c['evidence_level'],
-            'description': c['description'],
-            'evidence': {
-                'source': c['source'],
-                'text': c['description']
-            },
-            'recommendation': 'Avoid this medication' if c['evidence_level'] == 'high' else 'Use with caution'
-        })
-    
-    return result
+def invalid_allergy_text(data):
+    """An error response if patient.allergy_text is not a string"""
+    text = (data.get('patient') or {}).get('allergy_text')
+    if text is not None and not isinstance(text, str):
+        return jsonify({
+            'error': 'Invalid request',
+            'message': 'patient.allergy_text must be a string'
+        }), 400
+    return None
+
+def parse_fields(allowed):
+    """The set of response fields requested with ?fields=, or None if any are unknown"""
+    spec = request.args.get('fields')
+    if not spec:
+        return set(allowed)
+    fields = {f.strip() for f in spec.split(',') if f.strip()}
+    return fields if fields <= set(allowed) else None
+
+def invalid_fields(allowed):
+    return jsonify({
+        'error': 'Invalid request',
+        'message': f"fields must be a comma-separated list of: {', '.join(allowed)}"
+    }), 400
+
+def encode_cursor(positions):
+    """An opaque cursor for the keyset positions of a paginated response"""
+    return base64.urlsafe_b64encode(json.dumps(positions, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, count):
+    """The count keyset positions in cursor, or None if it is not a valid cursor"""
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        return None
+    if not isinstance(positions, list) or len(positions) != count:
+        return None
+    if not all(p is None or type(p) in (int, float) for p in positions):
+        return None
+    # Positions are bound as SQLite parameters: 64-bit integers and finite reals
+    if any(type(p) is int and not -2 ** 63 <= p < 2 ** 63 for p in positions):
+        return None
+    if any(type(p) is float and not math.isfinite(p) for p in positions):
+        return None
+    return positions
+
+def parse_limit(default, maximum):
+    """The limit query parameter, or None if it is not an integer from 1 to maximum"""
+    limit = request.args.get('limit', str(default))
+    if not limit.isdigit() or not 1 <= int(limit) <= maximum:
+        return None
+    return int(limit)
+
+def invalid_limit(maximum):
+    return jsonify({
+        'error': 'Invalid request',
+        'message': f'limit must be an integer between 1 and {maximum}'
+    }), 400
+
+def search_key(text):
+    """Catalog search key: lowercased, - / , ( ) as word breaks, single spaces"""
+    return ' '.join(re.sub(r'[-/,()]', ' ', text.lower()).split())
+
+def fts_query(text):
+    """An FTS5 query matching all words of text as plain terms; a trailing * makes a word a prefix"""
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ('*' if prefix else ''))
+    return ' '.join(terms)
 
 # API Endpoints
-@app.route('/v1/check', methods=['POST'])
+@api.route('/v1/check', methods=['POST'])
 def check_drug():
     data = request.json
     
@@ -237,20 +306,38 @@ def check_drug():
             'message': 'Request must include drug name'
         }), 400
     
+    fields = parse_fields(CHECK_FIELDS)
+    if fields is None:
+        return invalid_fields(CHECK_FIELDS)
+    invalid = invalid_allergy_text(data)
+    if invalid:
+        return invalid
+    
+    # Get options
+    options = data.get('options', {})
+    # bools, as they are part of fragment cache keys
+    include_inactive = bool(options.get('include_inactive_ingredients', True))
+    include_cross_reactivity = options.get('include_cross_reactivity', True)
+    include_evidence = bool(options.get('include_evidence', True))
+    verdict_only = options.get('verdict_only', False)
+    # Only the verdict and the contraindications depend on the patient
+    needs_check = verdict_only or 'safe' in fields or 'contraindications' in fields
+    
     # Get drug information
     drug_name = data['drug']['name']
     rxcui = data['drug'].get('rxcui')
     ndc = data['drug'].get('ndc')
     
     # Find drug in database
-    drug = None
-    if rxcui:
-        drug = find_drug_by_identifier(rxcui, 'rxcui')
-    elif ndc:
-        drug = find_drug_by_identifier(ndc, 'ndc')
-    
-    if not drug:
-        drug = find_drug_by_identifier(drug_name)
+    with timed('resolve'):
+        drug = None
+        if rxcui:
+            drug = find_drug_by_identifier(rxcui, 'rxcui')
+        elif ndc:
+            drug = find_drug_by_identifier(ndc, 'ndc')
+        
+        if not drug:
+            drug = find_drug_by_identifier(drug_name)
     
     if not drug:
         return jsonify({
@@ -259,92 +346,104 @@ def check_drug():
         }), 404
     
     # Get patient allergies and conditions
-    allergies = []
-    conditions = []
-    
-    if 'patient' in data:
-        if 'allergies' in data['patient']:
-            allergy_names = [a['name'] for a in data['patient']['allergies']]
-            allergies = find_allergies_by_names(allergy_names)
-        
-        if 'conditions' in data['patient']:
-            condition_names = [c['name'] for c in data['patient']['conditions']]
-            conditions = find_conditions_by_names(condition_names)
-    
-    # Get options
-    options = data.get('options', {})
-    include_inactive = options.get('include_inactive_ingredients', True)
-    include_cross_reactivity = options.get('include_cross_reactivity', True)
-    include_evidence = options.get('include_evidence', True)
+    allergy_ids = []
+    condition_ids = []
+    parsed_allergies = None
+    
+    if needs_check:
+        with timed('patient'):
+            if 'patient' in data:
+                if 'allergies' in data['patient']:
+                    allergy_names = [a['name'] for a in data['patient']['allergies']]
+                    allergy_ids = store.allergy_ids(allergy_names)
+                
+                parsed_allergies = parse_allergy_text(data['patient'])
+                if parsed_allergies:
+                    allergy_ids += [a['id'] for a in parsed_allergies['resolved'] if a['id'] not in allergy_ids]
+                
+                if 'conditions' in data['patient']:
+                    condition_names = [c['name'] for c in data['patient']['conditions']]
+                    condition_ids = store.condition_ids(condition_names)
+    
+    metadata = instrumentation.debug_metadata({
+        'sources_checked': ['custom'],
+        'timestamp': 'ISO datetime',
+        'version': '1.0'
+    })
+    
+    # Verdict only: the highest severity from one query, nothing else
+    if verdict_only:
+        with timed('verdict'):
+            severity = store.verdict(
+                drug['id'],
+                allergy_ids,
+                condition_ids,
+                include_cross_reactivity
+            )
+        response = {'safe': severity != 'high', 'max_severity': severity, 'metadata': metadata}
+        if parsed_allergies:
+            response['parsed_allergies'] = parsed_allergies
+        with timed('serialize'):
+            return jsonify(response)
+    
+    response = {}
     
     # Get drug ingredients
-    ingredients = get_drug_ingredients(drug['id'])
+    if 'drug' in fields:
+        with timed('ingredients'):
+            response['drug'] = fragments.get(('check_drug', drug['id'], include_inactive),
+                                             lambda: format_check_drug(drug, include_inactive))
     
     # Check contraindications
-    allergy_contraindications = check_allergy_contraindications(
-        drug['id'], 
-        [a['id'] for a in allergies],
-        include_cross_reactivity
-    )
-    
-    condition_contraindications = check_condition_contraindications(
-        drug['id'],
-        [c['id'] for c in conditions]
-    )
+    if needs_check and 'contraindications' in fields:
+        with timed('allergies'):
+            allergy_contraindications = store.allergy_contraindications(
+                drug['id'], 
+                allergy_ids,
+                include_cross_reactivity,
+                include_evidence
+            )
+        
+        with timed('conditions'):
+            condition_contraindications = store.condition_contraindications(
+                drug['id'],
+                condition_ids,
+                include_evidence
+            )
+        
+        all_contraindications = allergy_contraindications + condition_contraindications
+        response['contraindications'] = all_contraindications
+        
+        # Determine if drug is safe
+        if 'safe' in fields:
+            response['safe'] = not any(c['severity'] == 'high' for c in all_contraindications)
+    elif needs_check:
+        # Only the verdict is wanted: the highest severity from one query
+        with timed('verdict'):
+            severity = store.verdict(drug['id'], allergy_ids, condition_ids, include_cross_reactivity)
+        response['safe'] = severity != 'high'
     
-    all_contraindications = allergy_contraindications + condition_contraindications
+    if parsed_allergies:
+        response['parsed_allergies'] = parsed_allergies
     
     # Get warnings
-    warnings = get_drug_warnings(drug['id'])
-    formatted_warnings = []
-    
-    for w in warnings:
-        formatted_warnings.append({
-            'type': w['type'],
-            'name': w['type'].capitalize(),
-            'severity': 'medium',
-            'description': w['text'],
-            'evidence': {
-                'source': w['source'],
-                'text': w['text']
-            } if include_evidence else None,
-            'recommendation': 'Follow warning instructions'
-        })
-    
-    # Determine if drug is safe
-    is_safe = not any(c['severity'] == 'high' for c in all_contraindications)
+    if 'warnings' in fields:
+        with timed('warnings'):
+            response['warnings'] = fragments.get(('check_warnings', drug['id'], include_evidence),
+                                                 lambda: format_check_warnings(drug['id'], include_evidence))
     
-    # Format response
-    response = {
-        'drug': {
-            'name': drug['name'],
-            'rxcui': drug['rxcui'],
-            'ndc': drug['ndc'],
-            'ingredients': [
-                {
-                    'name': i['name'],
-                    'type': 'active' if i['is_active'] else 'inactive',
-                    'rxcui': i['rxcui']
-                } for i in ingredients
-            ]
-        },
-        'contraindications': all_contraindications,
-        'warnings': formatted_warnings,
-        'safe': is_safe,
-        'metadata': {
-            'sources_checked': ['custom'],
-            'timestamp': 'ISO datetime',
-            'version': '1.0'
-        }
-    }
+    if 'metadata' in fields:
+        response['metadata'] = metadata
     
-    return jsonify(response)
+    with timed('serialize'):
+        return jsonify(response)
 
-@app.route('/v1/drug/<identifier>', methods=['GET'])
+@api.route('/v1/drug/<identifier>', methods=['GET'])
 def get_drug(identifier):
     identifier_type = request.args.get('identifier_type', 'name')
     
-    drug = find_drug_by_identifier(identifier, identifier_type)
+    with timed('resolve'):
+        drug = find_drug_by_identifier(identifier, identifier_type)
     
     if not drug:
         return jsonify({
@@ -352,20 +451,22 @@ def get_drug(identifier):
             'message': f'Could not find drug with {identifier_type}: {identifier}'
         }), 404
     
-    ingredients = get_drug_ingredients(drug['id'])
-    contraindications = get_drug_contraindications(drug['id'])
-    warnings = get_drug_warnings(drug['id'])
+    with timed('ingredients'):
+        ingredients = store.drug_ingredients(drug['id'])
+    with timed('conditions'):
+        contraindications = store.drug_contraindications(drug['id'])
+    with timed('warnings'):
+        warnings = store.drug_warnings(drug['id'])
     
-    conn = get_db_connection()
-    brand_names = conn.execute('SELECT name FROM brand_names WHERE drug_id = ?', (drug['id'],)).fetchall()
-    conn.close()
+    with timed('brand_names'):
+        brand_names = store.brand_names(drug['id'])
     
     response = {
         'drug': {
             'name': drug['name'],
             'rxcui': drug['rxcui'],
             'ndc': drug['ndc'],
-            'brand_names': [b['name'] for b in brand_names],
+            'brand_names': brand_names,
             'generic_name': drug['generic_name'],
             'ingredients': [
                 {
@@ -391,73 +492,66 @@ def get_drug(identifier):
                 'source': w['source']
             } for w in warnings
         ],
-        'metadata': {
+        'metadata': instrumentation.debug_metadata({
             'sources_checked': ['custom'],
             'timestamp': 'ISO datetime',
             'version': '1.0'
-        }
+        })
     }
     
-    return jsonify(response)
+    with timed('serialize'):
+        return jsonify(response)
 
-@app.route('/v1/allergy/<name>', methods=['GET'])
+@api.route('/v1/allergy/<name>', methods=['GET'])
 def get_allergy(name):
-    conn = get_db_connection()
+    # Pagination: one cursor holds the position in each of the three lists
+    limit = parse_limit(ALLERGY_PAGE_LIMIT, ALLERGY_PAGE_MAX)
+    if limit is None:
+        return invalid_limit(ALLERGY_PAGE_MAX)
+    
+    cursor = request.args.get('cursor')
+    positions = decode_cursor(cursor, 3) if cursor else [0, 0, 0]
+    if positions is None:
+        return jsonify({
+            'error': 'Invalid request',
+            'message': 'cursor must be a next_cursor returned by this endpoint'
+        }), 400
     
-    # Find allergy
-    allergy = conn.execute('SELECT * FROM allergies WHERE name = ? OR normalized_name = ?', 
-                          (name, normalize_name(name))).fetchone()
+    # Find allergy, with its drug classes (class allergies cover every ingredient under them)
+    with timed('resolve'):
+        allergy_ids = store.names.lookup(name, 'allergy')
+        allergy = store.allergy(allergy_ids[0]) if allergy_ids else None
     
     if not allergy:
-        conn.close()
         return jsonify({
             'error': 'Allergy not found',
             'message': f'Could not find allergy with name: {name}'
         }), 404
     
-    allergy = dict(allergy)
-    
     # Get related ingredients
-    related_ingredients = conn.execute('''
-        SELECT i.*, ai.relationship
-        FROM ingredients i
-        JOIN allergy_ingredients ai ON i.id = ai.ingredient_id
-        WHERE ai.allergy_id = ?
-    ''', (allergy['id'],)).fetchall()
+    with timed('ingredients'):
+        related_ingredients, ingredients_next = store.related_ingredients(allergy['id'], positions[0], limit)
     
     # Get cross-reactivity
-    cross_reactivity = conn.execute('''
-        SELECT cr.*, i1.name as source_name, i2.name as target_name
-        FROM cross_reactivity cr
-        JOIN ingredients i1 ON cr.source_id = i1.id
-        JOIN ingredients i2 ON cr.target_id = i2.id
-        WHERE cr.source_id IN (
-            SELECT ingredient_id FROM allergy_ingredients WHERE allergy_id = ?
-        )
-    ''', (allergy['id'],)).fetchall()
+    with timed('cross_reactivity'):
+        cross_reactivity, cross_reactivity_next = store.related_cross_reactivity(allergy['id'], positions[2], limit)
     
     # Get related drugs
-    related_drugs = conn.execute('''
-        SELECT d.*, 
-               CASE 
-                   WHEN ai.relationship = 'exact' THEN 'contains'
-                   WHEN ai.relationship = 'cross_reactive' THEN 'may_contain'
-                   ELSE ai.relationship
-               END as relationship
-        FROM drugs d
-        JOIN drug_ingredients di ON d.id = di.drug_id
-        JOIN allergy_ingredients ai ON di.ingredient_id = ai.ingredient_id
-        WHERE ai.allergy_id = ?
-    ''', (allergy['id'],)).fetchall()
+    with timed('related_drugs'):
+        related_drugs, drugs_next = store.related_drugs(allergy['id'], positions[1], limit)
     
-    conn.close()
+    with timed('totals'):
+        totals = store.allergy_totals(allergy['id'])
+    
+    next_positions = [ingredients_next, drugs_next, cross_reactivity_next]
     
     # Format response
     response = {
         'allergy': {
             'name': allergy['name'],
             'normalized_name': allergy['normalized_name'],
-            'type': allergy['type']
+            'type': allergy['type'],
+            'classes': allergy['classes']
         },
         'related_ingredients': [
             {
@@ -481,16 +575,160 @@ def get_allergy(name):
                 'description': cr['description']
             } for cr in cross_reactivity
         ],
-        'metadata': {
+        'pagination': {
+            'limit': limit,
+            'next_cursor': encode_cursor(next_positions) if any(p is not None for p in next_positions) else None,
+            'totals': {
+                'related_ingredients': totals['ingredient_count'],
+                'related_drugs': totals['drug_count'],
+                'cross_reactivity': totals['cross_reactivity_count']
+            } if totals else None
+        },
+        'metadata': instrumentation.debug_metadata({
+            'sources_checked': ['custom'],
+            'timestamp': 'ISO datetime',
+            'version': '1.0'
+        })
+    }
+    
+    with timed('serialize'):
+        return jsonify(response)
+
+@api.route('/v1/search/labels', methods=['GET'])
+def search_labels():
+    q = request.args.get('q', '')
+    query = fts_query(q)
+    if not query:
+        return jsonify({
+            'error': 'Invalid request',
+            'message': 'q must contain at least one word'
+        }), 400
+    
+    kind = request.args.get('type')
+    if kind is not None and kind not in LABEL_KINDS:
+        return jsonify({
+            'error': 'Invalid request',
+            'message': f"type must be one of: {', '.join(LABEL_KINDS)}"
+        }), 400
+    
+    limit = parse_limit(LABEL_SEARCH_LIMIT, LABEL_SEARCH_MAX)
+    if limit is None:
+        return invalid_limit(LABEL_SEARCH_MAX)
+    
+    # Keyset pagination on (rank, rowid): the cursor holds the last of both
+    cursor = request.args.get('cursor')
+    after = decode_cursor(cursor, 2) if cursor else None
+    if cursor and (after is None or None in after):
+        return jsonify({
+            'error': 'Invalid request',
+            'message': 'cursor must be a next_cursor returned by this endpoint'
+        }), 400
+    
+    with timed('search'):
+        try:
+            matches = store.search_labels(query, kind, after, limit)
+        except ValueError:
+            return jsonify({
+                'error': 'Invalid request',
+                'message': 'q could not be parsed as a search query'
+            }), 400
+    
+    next_cursor = None
+    if len(matches) > limit:
+        matches = matches[:limit]
+        next_cursor = encode_cursor([matches[-1]['rank'], matches[-1]['id']])
+    
+    # Format response
+    response = {
+        'query': q,
+        'results': [
+            {
+                'type': m['kind'],
+                'drug': {
+                    'name': m['drug_name'],
+                    'rxcui': m['rxcui']
+                },
+                'condition': m['condition_name'] if m['kind'] == 'contraindication' else None,
+                'snippet': m['snippet'],
+                'score': -m['rank']
+            } for m in matches
+        ],
+        'pagination': {
+            'limit': limit,
+            'next_cursor': next_cursor
+        },
+        'metadata': instrumentation.debug_metadata({
+            'sources_checked': ['custom'],
+            'timestamp': 'ISO datetime',
+            'version': '1.0'
+        })
+    }
+    
+    with timed('serialize'):
+        return jsonify(response)
+
+@api.route('/v1/search', methods=['GET'])
+def search_catalog():
+    q = request.args.get('q', '')
+    key = search_key(q)
+    if not key:
+        return jsonify({
+            'error': 'Invalid request',
+            'message': 'q must contain at least one word'
+        }), 400
+    
+    entity_type = request.args.get('type')
+    if entity_type is not None and entity_type not in CATALOG_TYPES:
+        return jsonify({
+            'error': 'Invalid request',
+            'message': f"type must be one of: {', '.join(CATALOG_TYPES)}"
+        }), 400
+    
+    limit = parse_limit(CATALOG_SEARCH_LIMIT, CATALOG_SEARCH_MAX)
+    if limit is None:
+        return invalid_limit(CATALOG_SEARCH_MAX)
+    
+    with timed('search'):
+        hits = store.catalog_matches(key, entity_type, limit)
+    
+    # Matching entities per type, whatever the type filter
+    with timed('facets'):
+        facets = store.catalog_facets(key)
+    
+    # An entity matching more than once keeps its best match
+    results = []
+    seen = set()
+    for hit in hits:
+        if (hit['entity_type'], hit['entity_id']) in seen:
+            continue
+        seen.add((hit['entity_type'], hit['entity_id']))
+        results.append({
+            'type': hit['entity_type'],
+            'name': hit['name'],
+            'match': CATALOG_MATCHES[hit['match']],
+            'drug': {
+                'id': hit['drug_id'],
+                'name': hit['drug_name'],
+                'rxcui': hit['rxcui']
+            } if hit['drug_id'] is not None else None
+        })
+    
+    # Format response
+    response = {
+        'query': q,
+        'results': results[:limit],
+        'facets': {t: facets.get(t, 0) for t in CATALOG_TYPES},
+        'metadata': instrumentation.debug_metadata({
             'sources_checked': ['custom'],
             'timestamp': 'ISO datetime',
             'version': '1.0'
-        }
+        })
     }
     
-    return jsonify(response)
+    with timed('serialize'):
+        return jsonify(response)
 
-@app.route('/v1/batch/check', methods=['POST'])
+@api.route('/v1/batch/check', methods=['POST'])
 def batch_check():
     data = request.json
     
@@ -501,26 +739,53 @@ def batch_check():
             'message': 'Request must include a list of drugs'
         }), 400
     
-    # Get patient allergies and conditions
-    allergies = []
-    conditions = []
-    
-    if 'patient' in data:
-        if 'allergies' in data['patient']:
-            allergy_names = [a['name'] for a in data['patient']['allergies']]
-            allergies = find_allergies_by_names(allergy_names)
-        
-        if 'conditions' in data['patient']:
-            condition_names = [c['name'] for c in data['patient']['conditions']]
-            conditions = find_conditions_by_names(condition_names)
+    fields = parse_fields(BATCH_FIELDS)
+    if fields is None:
+        return invalid_fields(BATCH_FIELDS)
+    invalid = invalid_allergy_text(data)
+    if invalid:
+        return invalid
     
     # Get options
     options = data.get('options', {})
-    include_inactive = options.get('include_inactive_ingredients', True)
     include_cross_reactivity = options.get('include_cross_reactivity', True)
-    include_evidence = options.get('include_evidence', True)
+    include_evidence = bool(options.get('include_evidence', True))
+    verdict_only = options.get('verdict_only', False)
+    # Only the verdict and the contraindications depend on the patient
+    needs_check = verdict_only or 'safe' in fields or 'contraindications' in fields
+    
+    # Get patient allergies and conditions
+    allergy_ids = []
+    condition_ids = []
+    parsed_allergies = None
+    
+    if needs_check:
+        with timed('patient'):
+            if 'patient' in data:
+                if 'allergies' in data['patient']:
+                    allergy_names = [a['name'] for a in data['patient']['allergies']]
+                    allergy_ids = store.allergy_ids(allergy_names)
+                
+                parsed_allergies = parse_allergy_text(data['patient'])
+                if parsed_allergies:
+                    allergy_ids += [a['id'] for a in parsed_allergies['resolved'] if a['id'] not in allergy_ids]
+                
+                if 'conditions' in data['patient']:
+                    condition_names = [c['name'] for c in data['patient']['conditions']]
+                    condition_ids = store.condition_ids(condition_names)
     
     results = []
+    metrics.observe_batch_size(len(data['drugs']))
+    
+    # Resolve the RxCUIs, NDCs and names of the whole batch at once
+    with timed('resolve'):
+        rxcui_drugs = store.drugs_by_rxcuis([
+            d['rxcui'] for d in data['drugs'] if isinstance(d.get('rxcui'), (str, int))
+        ])
+        ndc_drugs = store.drugs_by_ndcs([
+            d['ndc'] for d in data['drugs'] if isinstance(d.get('ndc'), str) and not d.get('rxcui')
+        ])
+        name_drugs = store.drugs_by_names([d['name'] for d in data['drugs'] if isinstance(d.get('name'), str)])
     
     # Process each drug
     for drug_data in data['drugs']:
@@ -533,14 +798,15 @@ def batch_check():
             continue
         
         # Find drug in database
-        drug = None
-        if rxcui:
-            drug = find_drug_by_identifier(rxcui, 'rxcui')
-        elif ndc:
-            drug = find_drug_by_identifier(ndc, 'ndc')
-        
-        if not drug and drug_name:
-            drug = find_drug_by_identifier(drug_name)
+        with timed('resolve'):
+            drug = None
+            if rxcui:
+                drug = rxcui_drugs.get(rxcui) if isinstance(rxcui, (str, int)) else None
+            elif ndc:
+                drug = ndc_drugs.get(ndc)
+            
+            if not drug and drug_name:
+                drug = name_drugs.get(drug_name) if isinstance(drug_name, str) else None
         
         if not drug:
             results.append({
@@ -553,58 +819,109 @@ def batch_check():
             })
             continue
         
-        # Check contraindications
-        allergy_contraindications = check_allergy_contraindications(
-            drug['id'], 
-            [a['id'] for a in allergies],
-            include_cross_reactivity
-        )
-        
-        condition_contraindications = check_condition_contraindications(
-            drug['id'],
-            [c['id'] for c in conditions]
-        )
+        result = {}
+        drug_block = fragments.get(('batch_drug', drug['id']), lambda: {
+            'name': drug['name'],
+            'rxcui': drug['rxcui'],
+            'ndc': drug['ndc']
+        })
         
-        all_contraindications = allergy_contraindications + condition_contraindications
+        # Verdict only: the drug and its highest severity from one query
+        if verdict_only:
+            with timed('verdict'):
+                severity = store.verdict(drug['id'], allergy_ids, condition_ids, include_cross_reactivity)
+            results.append({'drug': drug_block, 'safe': severity != 'high', 'max_severity': severity})
+            continue
         
-        # Get warnings
-        warnings = get_drug_warnings(drug['id'])
-        formatted_warnings = []
+        if 'drug' in fields:
+            result['drug'] = drug_block
         
-        for w in warnings:
-            formatted_warnings.append({
-                'type': w['type'],
-                'name': w['type'].capitalize(),
-                'severity': 'medium',
-                'description': w['text']
-            })
+        # Check contraindications
+        if needs_check and 'contraindications' in fields:
+            with timed('allergies'):
+                allergy_contraindications = store.allergy_contraindications(
+                    drug['id'], 
+                    allergy_ids,
+                    include_cross_reactivity,
+                    include_evidence
+                )
+            
+            with timed('conditions'):
+                condition_contraindications = store.condition_contraindications(
+                    drug['id'],
+                    condition_ids,
+                    include_evidence
+                )
+            
+            all_contraindications = allergy_contraindications + condition_contraindications
+            result['contraindications'] = all_contraindications
+            
+            # Determine if drug is safe
+            if 'safe' in fields:
+                result['safe'] = not any(c['severity'] == 'high' for c in all_contraindications)
+        elif needs_check:
+            # Only the verdict is wanted: the highest severity from one query
+            with timed('verdict'):
+                severity = store.verdict(drug['id'], allergy_ids, condition_ids, include_cross_reactivity)
+            result['safe'] = severity != 'high'
         
-        # Determine if drug is safe
-        is_safe = not any(c['severity'] == 'high' for c in all_contraindications)
+        # Get warnings
+        if 'warnings' in fields:
+            with timed('warnings'):
+                result['warnings'] = fragments.get(('batch_warnings', drug['id']),
+                                                   lambda: format_batch_warnings(drug['id']))
         
         # Add to results
-        results.append({
-            'drug': {
-                'name': drug['name'],
-                'rxcui': drug['rxcui'],
-                'ndc': drug['ndc']
-            },
-            'contraindications': all_contraindications,
-            'warnings': formatted_warnings,
-            'safe': is_safe
-        })
+        results.append(result)
     
     # Format response
-    response = {
-        'results': results,
-        'metadata': {
+    response = {'results': results}
+    if parsed_allergies:
+        response['parsed_allergies'] = parsed_allergies
+    if 'metadata' in fields:
+        response['metadata'] = instrumentation.debug_metadata({
             'sources_checked': ['custom'],
             'timestamp': 'ISO datetime',
             'version': '1.0'
-        }
-    }
+        })
     
-    return jsonify(response)
+    with timed('serialize'):
+        return jsonify(response)
+
+def create_app(config=None):
+    """The API app, configured from the environment and then from config"""
+    app = Flask(__name__)
+    CORS(app)
+    app.config.update(config_from_env())
+    app.config.update(config or {})
+    app.config['DATABASE'] = os.path.abspath(app.config['DATABASE'])
+
+    # Everything the routes read, kept on the app so apps with other settings do not share it
+    knowledge_base = app.extensions['allergy_api'] = KnowledgeBase(
+        app.config['DATABASE'], app.config['STORAGE'], app.config['CROSS_REACTIVITY_MAX_DEPTH'],
+        app.config['JSON_FRAGMENTS'])
+    metrics.set_info('allergy_api_knowledge_base_info', 'Version of the loaded knowledge base.',
+                     knowledge_base.version)
+
+    query_audit.init_app(app)
+    instrumentation.init_app(app)
+    metrics.init_app(app)
+    structured_logging.init_app(app)
+    sampler.init_app(app)
+    auth.init_app(app)
+    ratelimit.init_app(app)
+    serialization.init_app(app)
+    compression.init_app(app)
+
+    app.register_blueprint(api)
+    # Wraps the view functions registered above when profiling is enabled
+    profiling.init_app(app)
+    return app
+
+def preload(app):
+    """Build app's in-memory indexes and backend tables now, e.g. in a gunicorn master so forked workers share them"""
+    app.extensions['allergy_api'].store.load()
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    structured_logging.configure_from_env()
+    create_app().run(debug=True, host='0.0.0.0', port=5000)
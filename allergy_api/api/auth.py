@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import os
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, jsonify, request
+
+import metrics
+
+# API-key authentication for /v1/*. Keys are presented in X-API-Key (or as an
+# Authorization: Bearer token) and stored in the api_keys table only as a
+# SHA-256 hash; keys are long random strings, so a fast hash is sufficient.
+# Verified keys are cached in-process for AUTH_CACHE_TTL seconds, so a
+# request normally costs a hash and one dictionary lookup; a revoked key
+# therefore stops working in every worker within that TTL. Unknown keys are
+# cached for a shorter time so a client retrying a bad key does not reach the
+# database on every call. Both caches are LRUs keyed on the hash, so raw keys
+# are not kept in memory, and unknown keys have their own smaller one, so a
+# stream of bad keys cannot evict the valid ones. Each app with AUTH set has
+# its own KeyCache, kept with its knowledge base. Run this module as a script
+# to create, list and revoke keys.
+
+KEY_PREFIX = 'ak_'
+
+# The knowledge base shipped with the API, found from this file rather than the working directory
+DEFAULT_DATABASE = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                 '..', '..', 'database', 'allergy_api.db'))
+
+MAX_ENTRIES = 10000
+MAX_NEGATIVE_ENTRIES = 1000
+
+
+class ApiKey:
+    __slots__ = ('id', 'name', 'tier')
+
+    def __init__(self, id, name, tier):
+        self.id = id
+        self.name = name
+        self.tier = tier
+
+
+def hash_key(raw_key):
+    return hashlib.sha256(raw_key.encode()).hexdigest()
+
+
+class KeyCache:
+    """Verifies keys against the api_keys table connect() opens, caching the results"""
+
+    def __init__(self, connect, ttl=30.0, negative_ttl=5.0):
+        self.connect = connect
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = MAX_ENTRIES
+        self.max_negative_entries = MAX_NEGATIVE_ENTRIES
+        # {key hash: (expiry, ApiKey)} and {key hash: expiry}, least recently used first
+        self.keys = OrderedDict()
+        self.unknown = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key_hash):
+        conn = self.connect()
+        try:
+            row = conn.execute(
+                'SELECT id, name, tier FROM api_keys WHERE key_hash = ? AND revoked_at IS NULL',
+                (key_hash,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return ApiKey(*row) if row else None
+
+    def _cached(self, key_hash, now):
+        """(True, ApiKey or None) for a cached key, (False, None) on a miss"""
+        with self._lock:
+            entry = self.keys.get(key_hash)
+            if entry is not None and entry[0] > now:
+                self.keys.move_to_end(key_hash)
+                return True, entry[1]
+            expiry = self.unknown.get(key_hash)
+            if expiry is not None and expiry > now:
+                self.unknown.move_to_end(key_hash)
+                return True, None
+        return False, None
+
+    def _remember(self, cache, max_entries, key_hash, entry):
+        with self._lock:
+            cache[key_hash] = entry
+            cache.move_to_end(key_hash)
+            while len(cache) > max_entries:
+                cache.popitem(last=False)
+
+    def verify(self, raw_key):
+        """The ApiKey for raw_key, or None if it is unknown or revoked"""
+        key_hash = hash_key(raw_key)
+        now = time.monotonic()
+        hit, key = self._cached(key_hash, now)
+        metrics.record_cache('api_key', hit)
+        if hit:
+            return key
+        key = self.lookup(key_hash)
+        if key is not None:
+            self._remember(self.keys, self.max_entries, key_hash, (now + self.ttl, key))
+        else:
+            self._remember(self.unknown, self.max_negative_entries, key_hash, now + self.negative_ttl)
+        return key
+
+    def clear(self):
+        with self._lock:
+            self.keys.clear()
+            self.unknown.clear()
+
+
+def _presented_key():
+    key = request.headers.get('X-API-Key')
+    if key:
+        return key
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        return authorization[7:].strip()
+    return None
+
+
+def _before_request():
+    if not request.path.startswith('/v1/') or request.method == 'OPTIONS':
+        return None
+    raw_key = _presented_key()
+    key = current_app.extensions['allergy_api'].api_keys.verify(raw_key) if raw_key else None
+    if key is None:
+        response = jsonify({
+            'error': 'Unauthorized',
+            'message': 'A valid API key is required in the X-API-Key header'
+        })
+        response.status_code = 401
+        response.headers['WWW-Authenticate'] = 'Bearer'
+        return response
+    g.api_key = key
+    return None
+
+
+def init_app(app):
+    """Require an API key on /v1/* if AUTH is set in app's config"""
+    if not app.config.get('AUTH'):
+        return
+    knowledge_base = app.extensions['allergy_api']
+    ttl = float(app.config.get('AUTH_CACHE_TTL', 30.0))
+    negative_ttl = min(ttl, float(app.config.get('AUTH_NEGATIVE_CACHE_TTL', 5.0)))
+    knowledge_base.api_keys = KeyCache(knowledge_base.connect, ttl, negative_ttl)
+    app.before_request(_before_request)
+
+
+# Key management CLI
+def create_key(conn, name, tier='standard'):
+    """Store a new key and return it; the raw key is not recoverable afterwards"""
+    raw_key = KEY_PREFIX + secrets.token_urlsafe(32)
+    conn.execute(
+        'INSERT INTO api_keys (name, key_prefix, key_hash, tier) VALUES (?, ?, ?, ?)',
+        (name, raw_key[:10], hash_key(raw_key), tier)
+    )
+    conn.commit()
+    return raw_key
+
+
+def revoke_key(conn, key_id):
+    cursor = conn.execute(
+        "UPDATE api_keys SET revoked_at = datetime('now','localtime'), updated_at = datetime('now','localtime') "
+        'WHERE id = ? AND revoked_at IS NULL',
+        (key_id,)
+    )
+    conn.commit()
+    return cursor.rowcount > 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage API keys')
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help='SQLite database path')
+    commands = parser.add_subparsers(dest='command', required=True)
+    create = commands.add_parser('create', help='create a key and print it once')
+    create.add_argument('name', help='who the key is for')
+    create.add_argument('--tier', default='standard', help='rate limit tier')
+    revoke = commands.add_parser('revoke', help='revoke a key by id')
+    revoke.add_argument('id', type=int)
+    commands.add_parser('list', help='list keys')
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.database)
+    if args.command == 'create':
+        print(create_key(conn, args.name, args.tier))
+    elif args.command == 'revoke':
+        if not revoke_key(conn, args.id):
+            print(f'No active key with id {args.id}', file=sys.stderr)
+            sys.exit(1)
+    else:
+        for row in conn.execute('SELECT id, name, key_prefix, tier, created_at, revoked_at FROM api_keys ORDER BY id'):
+            status = f'revoked {row[5]}' if row[5] else 'active'
+            print(f'{row[0]:5d}  {row[2]}...  {row[3]:<10} {row[1]:<30} created {row[4]}  {status}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import zlib
+
+from flask import current_app, jsonify, request
+
+from instrumentation import timed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Response compression negotiated from Accept-Encoding. gzip is always
+# available; brotli ("br") and zstd are used when their packages are
+# installed. Buffered responses smaller than COMPRESSION_MIN_SIZE go out
+# as-is, since compressing them costs more than it saves. Streamed
+# responses are compressed chunk by chunk, with each chunk flushed so the
+# client still receives data as it is produced. A client that refuses the
+# identity coding (identity;q=0, or *;q=0 without identity) gets even small
+# responses compressed, and 406 if it accepts none of the available codings.
+
+# Levels chosen for dynamic content: close to the best ratio for a fraction of the CPU
+LEVELS = {'gzip': 6, 'br': 4, 'zstd': 3}
+COMPRESSIBLE_TYPES = ('application/json', 'text/', 'application/msgpack', 'application/x-msgpack')
+
+DEFAULT_PREFERENCE = ('zstd', 'br', 'gzip')
+
+
+class GzipStream:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def chunk(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliStream:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def chunk(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdStream:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def chunk(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+def _gzip(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _brotli(data, level):
+    return brotli.compress(data, quality=level)
+
+
+def _zstd(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+# name -> (one-shot compress, streaming compressor class)
+ENCODINGS = {'gzip': (_gzip, GzipStream)}
+if brotli is not None:
+    ENCODINGS['br'] = (_brotli, BrotliStream)
+if zstandard is not None:
+    ENCODINGS['zstd'] = (_zstd, ZstdStream)
+
+
+def negotiate(accept_encodings, preference=DEFAULT_PREFERENCE):
+    """The best encoding the client accepts, by q-value then server preference"""
+    best, best_q = None, 0
+    for name in preference:
+        if name not in ENCODINGS:
+            continue
+        q = accept_encodings[name]
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def identity_acceptable(accept_encodings):
+    """Whether the client takes a response without content coding; it does unless told otherwise"""
+    if not any(name in ('identity', '*') for name, _ in accept_encodings):
+        return True
+    return accept_encodings['identity'] > 0
+
+
+def compress(data, encoding, level=None):
+    return ENCODINGS[encoding][0](data, LEVELS[encoding] if level is None else level)
+
+
+def _stream(chunks, stream):
+    for data in chunks:
+        if isinstance(data, str):
+            data = data.encode()
+        if data:
+            yield stream.chunk(data)
+    yield stream.finish()
+
+
+def _compressible(response):
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if 'Content-Encoding' in response.headers or response.direct_passthrough:
+        return False
+    return response.mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def preference(spec):
+    """Parse COMPRESSION_ENCODINGS, e.g. 'zstd,br,gzip', into encoding names in order"""
+    return tuple(name.strip() for name in spec.split(','))
+
+
+def _after_request(response):
+    if not _compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    config = current_app.config
+    identity = identity_acceptable(request.accept_encodings)
+    if identity and not response.is_streamed and (response.content_length or 0) < config.get('COMPRESSION_MIN_SIZE', 1024):
+        return response
+    available = preference(config.get('COMPRESSION_ENCODINGS', 'zstd,br,gzip'))
+    encoding = negotiate(request.accept_encodings, available)
+    if encoding is None:
+        return response if identity else _not_acceptable(available)
+
+    if response.is_streamed:
+        stream = ENCODINGS[encoding][1](LEVELS[encoding])
+        response.response = _stream(response.response, stream)
+        response.headers.pop('Content-Length', None)
+    else:
+        with timed('compress'):
+            response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _not_acceptable(available):
+    response = jsonify({
+        'error': 'Not acceptable',
+        'message': f"Accept-Encoding allows none of: {', '.join(n for n in available if n in ENCODINGS)}"
+    })
+    response.status_code = 406
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    """Compress responses if COMPRESSION is set in app's config"""
+    if app.config.get('COMPRESSION'):
+        app.after_request(_after_request)
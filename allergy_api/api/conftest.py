@@ -0,0 +1,4 @@
+# test_api.py exercises a running server over HTTP with requests; run it by
+# hand against `python app.py`. The other test_*.py files use the Flask test
+# client and run under pytest.
+collect_ignore = ['test_api.py']
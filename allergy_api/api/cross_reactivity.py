@@ -0,0 +1,133 @@
+from array import array
+
+import versioned
+
+# Cross-reactivity as a weighted graph over ingredients. The cross_reactivity
+# rows are edges from an allergen ingredient to an ingredient that may react
+# with it, weighted by evidence level. At load time the graph is packed into
+# CSR adjacency arrays and, for every allergy, the paths of up to max_depth
+# hops from its ingredients are followed once. What is kept is the best path
+# to each reachable ingredient, so a check is one dict lookup per allergy and
+# drug ingredient. A path's evidence is its weakest edge, lowered one level
+# for each hop past the first; among equally strong paths the shortest wins,
+# then the one with the lowest ingredient ids. Ingredients that belong to the
+# allergy itself are left out: those are direct matches, not cross-reactions.
+# The index is rebuilt when the knowledge base version changes.
+
+LEVELS = (None, 'low', 'medium', 'high')
+RANKS = {'low': 1, 'medium': 2, 'high': 3}
+
+
+class Reaction:
+    """The best cross-reactivity path from an allergy to one ingredient"""
+
+    __slots__ = ('evidence_level', 'path', 'names', 'descriptions')
+
+    def __init__(self, evidence_level, path, names, descriptions):
+        self.evidence_level = evidence_level
+        self.path = path
+        self.names = names
+        self.descriptions = descriptions
+
+
+class Graph:
+    """Cross-reactivity edges in CSR form, ingredients numbered densely by id"""
+
+    def __init__(self, edges):
+        self.ids = array('q', sorted({s for s, _, _ in edges} | {t for _, t, _ in edges}))
+        self.index = {ingredient_id: n for n, ingredient_id in enumerate(self.ids)}
+        # the edges of node n are targets[offsets[n]:offsets[n + 1]], with their ranks
+        self.offsets = array('l', [0] * (len(self.ids) + 1))
+        self.targets = array('l', [0] * len(edges))
+        self.ranks = array('b', [0] * len(edges))
+        for source, _, _ in edges:
+            self.offsets[self.index[source] + 1] += 1
+        for n in range(len(self.ids)):
+            self.offsets[n + 1] += self.offsets[n]
+        fill = array('l', self.offsets[:-1])
+        for source, target, rank in sorted(edges):
+            n = self.index[source]
+            self.targets[fill[n]] = self.index[target]
+            self.ranks[fill[n]] = rank
+            fill[n] += 1
+
+    def closure(self, source_id, max_depth):
+        """{ingredient id: (rank, path of ingredient ids)} for the best paths from source_id"""
+        start = self.index.get(source_id)
+        if start is None:
+            return {}
+        best = {}
+        # paths of exactly depth hops, the best one per node
+        frontier = {start: (RANKS['high'] + 1, (start,))}
+        for depth in range(1, max_depth + 1):
+            reached = {}
+            for node, (rank, path) in frontier.items():
+                for e in range(self.offsets[node], self.offsets[node + 1]):
+                    target = self.targets[e]
+                    if target in path:
+                        continue
+                    candidate = (min(rank, self.ranks[e]), path + (target,))
+                    if target not in reached or _better(candidate, reached[target]):
+                        reached[target] = candidate
+            for node, (rank, path) in reached.items():
+                combined = (max(rank - (depth - 1), 1), path)
+                if node not in best or _better(combined, best[node]):
+                    best[node] = combined
+            frontier = reached
+        return {self.ids[node]: (rank, tuple(self.ids[n] for n in path)) for node, (rank, path) in best.items()}
+
+
+def _better(a, b):
+    """Whether path a beats path b: higher rank, then fewer hops, then lower ids"""
+    return (-a[0], len(a[1]), a[1]) < (-b[0], len(b[1]), b[1])
+
+
+class CrossReactivityIndex:
+    """Per-allergy best cross-reactivity paths, rebuilt when the knowledge base version changes"""
+
+    def __init__(self, connect, version_fn, max_depth=3, check_interval=60.0):
+        self.connect = connect
+        self.max_depth = max_depth
+        self._reactions = versioned.VersionedCache(self._load, version_fn, check_interval)
+
+    def _load(self):
+        conn = self.connect()
+        names = dict(conn.execute('SELECT id, name FROM ingredients').fetchall())
+        edges = conn.execute('SELECT source_id, target_id, evidence_level, description FROM cross_reactivity').fetchall()
+        members = conn.execute('SELECT allergy_id, ingredient_id FROM allergy_members').fetchall()
+        conn.close()
+
+        descriptions = {(s, t): description for s, t, _, description in edges}
+        graph = Graph([(s, t, RANKS.get(level, 1)) for s, t, level, _ in edges])
+        allergy_ingredients = {}
+        for allergy_id, ingredient_id in members:
+            allergy_ingredients.setdefault(allergy_id, set()).add(ingredient_id)
+
+        reactions = {}
+        for allergy_id, own in allergy_ingredients.items():
+            best = {}
+            for source_id in sorted(own):
+                for target_id, candidate in graph.closure(source_id, self.max_depth).items():
+                    if target_id in own:
+                        continue
+                    if target_id not in best or _better(candidate, best[target_id]):
+                        best[target_id] = candidate
+            for target_id, (rank, path) in best.items():
+                reactions[allergy_id, target_id] = Reaction(
+                    LEVELS[rank],
+                    path,
+                    [names.get(i) for i in path],
+                    [descriptions[s, t] for s, t in zip(path, path[1:])]
+                )
+        return reactions
+
+    def lookup(self, allergy_id, ingredient_id):
+        """The Reaction linking an allergy to an ingredient, or None"""
+        return self._reactions.get().get((allergy_id, ingredient_id))
+
+    def load(self):
+        """Build the index now rather than on first use"""
+        self._reactions.get()
+
+    def clear(self):
+        self._reactions.clear()
@@ -0,0 +1,42 @@
+import versioned
+
+# RxCUI crosswalk. In RxNorm one product has many RxCUIs: its clinical drug
+# (SCD), branded drug (SBD), packs (GPCK, BPCK) and ingredients (IN, PIN,
+# MIN). The rxcui_crosswalk rows map each of them, with its term type, to our
+# drugs and ingredients, and this index holds the drug side of that mapping
+# in a hash map so that resolving an RxCUI is one dict lookup. An RxCUI mapped to several
+# drugs, such as an SCD shared by equivalent products, resolves to the lowest
+# drug id. The index is rebuilt when the knowledge base version changes.
+
+
+class RxcuiCrosswalk:
+    """RxCUI to drug ids, rebuilt when the knowledge base version changes"""
+
+    def __init__(self, connect, version_fn, check_interval=60.0):
+        self.connect = connect
+        self._index = versioned.VersionedCache(self._load, version_fn, check_interval)
+
+    def _load(self):
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT rxcui, drug_id FROM rxcui_crosswalk
+            WHERE drug_id IS NOT NULL
+            ORDER BY rxcui, drug_id
+        ''').fetchall()
+        conn.close()
+
+        drugs = {}
+        for rxcui, drug_id in rows:
+            drugs.setdefault(rxcui, drug_id)
+        return drugs
+
+    def drug(self, rxcui):
+        """The id of the drug an RxCUI resolves to, or None"""
+        return self._index.get().get(str(rxcui).strip())
+
+    def load(self):
+        """Build the index now rather than on first use"""
+        self._index.get()
+
+    def clear(self):
+        self._index.clear()
@@ -0,0 +1,66 @@
+import gc
+import multiprocessing
+import os
+import time
+
+# Gunicorn settings for the API, read from ALLERGY_API_* environment
+# variables. gunicorn picks this file up when started from this directory;
+# elsewhere pass it with -c. The app is built by create_app() and logging is
+# set up when the master starts. The app is loaded once in the master and the
+# knowledge base indexes are built there before any worker is forked, so the
+# workers share those pages copy-on-write instead of each building its own.
+# The collector is kept off in the master and everything it allocated is
+# frozen before each fork, so a collection in a worker never writes to the
+# shared objects. Nothing that must not cross a fork is opened in the master:
+# database helpers open a connection per call, the rate-limit store reopens
+# its connection when it sees a new pid, and the metrics flusher, stack
+# sampler and log writer threads are started again in each worker. Workers
+# are recycled after ALLERGY_API_MAX_REQUESTS requests (plus jitter, so they
+# do not all restart at once), finishing the requests they have in hand.
+
+wsgi_app = 'app:create_app()'
+pythonpath = os.path.dirname(os.path.abspath(__file__))
+
+bind = os.environ.get('ALLERGY_API_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('ALLERGY_API_WORKERS', str(multiprocessing.cpu_count() * 2 + 1)))
+threads = int(os.environ.get('ALLERGY_API_THREADS', '1'))
+timeout = int(os.environ.get('ALLERGY_API_TIMEOUT', '30'))
+graceful_timeout = int(os.environ.get('ALLERGY_API_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('ALLERGY_API_KEEPALIVE', '5'))
+
+# 0 turns recycling off
+max_requests = int(os.environ.get('ALLERGY_API_MAX_REQUESTS', '10000'))
+max_requests_jitter = int(os.environ.get('ALLERGY_API_MAX_REQUESTS_JITTER', '1000'))
+
+preload_app = os.environ.get('ALLERGY_API_PRELOAD', '1') == '1'
+
+if preload_app:
+    # Collections in the master would only free holes in pages the workers share
+    gc.disable()
+
+
+def on_starting(server):
+    import structured_logging
+    structured_logging.configure_from_env()
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    import app
+    start = time.perf_counter()
+    app.preload(server.app.wsgi())
+    server.log.info('Knowledge base indexes built in %.0f ms', (time.perf_counter() - start) * 1000)
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
+
+
+def worker_exit(server, worker):
+    server.log.info('Worker %s exiting after %s requests', worker.pid, worker.nr)
@@ -0,0 +1,251 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context
+
+# Instrumentation comes in two levels. Counting, turned on by /metrics or the
+# Server-Timing header, keeps a RequestTiming per request and counts its
+# connections and SQL statements: connections are opened as CountedConnection,
+# which counts its statements with SQLite's trace callback, one call per
+# statement and nothing per row. Timing, turned on by the Server-Timing header
+# only, also times each stage, statement and fetch through InstrumentedCursor.
+# With both off every hook below is a no-op and the database layer uses the
+# plain sqlite3 connection class. The levels are per app: each app's
+# connection class and request hooks follow its own config.
+
+# Process-wide connection accounting (only maintained while enabled), updated
+# from every request thread
+connection_stats = {'opened': 0, 'closed': 0}
+_stats_lock = threading.Lock()
+
+
+class RequestTiming:
+    """Per-request stage timings and SQL accounting"""
+
+    __slots__ = ('started', 'timed', 'stages', 'sql_queries', 'sql_rows', 'sql_time', 'db_connections')
+
+    def __init__(self, timed=False):
+        self.started = time.perf_counter()
+        # whether stages are timed, as well as SQL counted
+        self.timed = timed
+        self.stages = {}
+        self.sql_queries = 0
+        self.sql_rows = 0
+        self.sql_time = 0.0
+        self.db_connections = 0
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count_statement(self, statement):
+        self.sql_queries += 1
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {
+            'stages_ms': {name: round(s * 1000, 3) for name, s in self.stages.items()},
+            'sql_queries': self.sql_queries,
+            'sql_rows': self.sql_rows,
+            'sql_ms': round(self.sql_time * 1000, 3),
+            'db_connections': self.db_connections,
+            'total_ms': round(self.total() * 1000, 3)
+        }
+
+    def header_value(self):
+        parts = [f'{name};dur={s * 1000:.3f}' for name, s in self.stages.items()]
+        parts.append(f'sql;dur={self.sql_time * 1000:.3f};'
+                     f'desc="queries={self.sql_queries} rows={self.sql_rows} connections={self.db_connections}"')
+        parts.append(f'total;dur={self.total() * 1000:.3f}')
+        return ', '.join(parts)
+
+
+def current_timing():
+    """Return the RequestTiming for the active request, or None"""
+    if not has_request_context():
+        return None
+    return g.get('request_timing')
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def timed(name):
+    """Context manager timing a named stage of the current request"""
+    timing = current_timing()
+    if timing is None or not timing.timed:
+        return _NULL_STAGE
+    return _stage(timing, name)
+
+
+@contextmanager
+def _stage(timing, name):
+    start = time.perf_counter()
+    try:
+        yield timing
+    finally:
+        timing.add_stage(name, time.perf_counter() - start)
+
+
+def debug_metadata(metadata):
+    """Attach the timing debug block to a response metadata dict when enabled"""
+    timing = current_timing()
+    if timing is not None and timing.timed and current_app.config.get('SERVER_TIMING_METADATA'):
+        metadata['debug'] = timing.as_dict()
+    return metadata
+
+
+# SQL accounting
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that counts statements, rows fetched and time spent in SQLite,
+    and feeds the connection's query auditor if it has one"""
+
+    _audit = None
+
+    def execute(self, sql, parameters=()):
+        timing = current_timing()
+        auditor = self.connection.auditor
+        if timing is None and auditor is None:
+            return super().execute(sql, parameters)
+        if self._audit is not None:
+            self._finish_audit()
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - start
+            if timing is not None:
+                timing.sql_queries += 1
+                timing.sql_time += elapsed
+            if auditor is not None:
+                self._audit = auditor.begin(self.connection, sql, parameters, elapsed)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(0 if row is None else 1, start, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(len(rows), start, not rows)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(len(rows), start, True)
+        return rows
+
+    def close(self):
+        self._finish_audit()
+        super().close()
+
+    def __del__(self):
+        self._finish_audit()
+
+    def _fetched(self, n, start, exhausted):
+        timing = current_timing()
+        if timing is not None:
+            timing.sql_rows += n
+        audit = self._audit
+        if audit is not None:
+            audit.add(n, time.perf_counter() - start)
+            if exhausted:
+                self._finish_audit()
+
+    def _finish_audit(self):
+        audit = self._audit
+        if audit is not None:
+            self._audit = None
+            audit.finish()
+
+
+def _count_connection(event):
+    with _stats_lock:
+        connection_stats[event] += 1
+
+
+def open_connections():
+    """Connections opened and not yet closed, while enabled"""
+    with _stats_lock:
+        return connection_stats['opened'] - connection_stats['closed']
+
+
+class CountedConnection(sqlite3.Connection):
+    """Connection counted open and closed, whose statements count against the current request"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _count_connection('opened')
+        timing = current_timing()
+        if timing is not None:
+            timing.db_connections += 1
+            self._count_statements(timing)
+
+    def _count_statements(self, timing):
+        self.set_trace_callback(timing.count_statement)
+
+    def close(self):
+        _count_connection('closed')
+        super().close()
+
+
+class InstrumentedConnection(CountedConnection):
+    """Connection whose execute() goes through InstrumentedCursor"""
+
+    # the query_audit.Auditor its statements are reported to, if any
+    auditor = None
+
+    def _count_statements(self, timing):
+        # InstrumentedCursor counts and times them
+        pass
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+
+def connection_factory(config, auditor=None):
+    """Connection class to pass to sqlite3.connect() for an app with this config and query auditor"""
+    if auditor is not None:
+        return type('AuditedConnection', (InstrumentedConnection,), {'auditor': auditor})
+    if config.get('SERVER_TIMING'):
+        return InstrumentedConnection
+    return CountedConnection if config.get('METRICS') else sqlite3.Connection
+
+
+# Flask wiring
+def _before_request():
+    g.request_timing = RequestTiming(bool(current_app.config.get('SERVER_TIMING')))
+
+
+def _after_request(response):
+    timing = g.get('request_timing')
+    if timing is not None:
+        response.headers['Server-Timing'] = timing.header_value()
+    return response
+
+
+def init_app(app):
+    """Enable instrumentation if SERVER_TIMING or METRICS is set in app's config; call after query_audit.init_app"""
+    knowledge_base = app.extensions['allergy_api']
+    knowledge_base.connection_class = connection_factory(app.config, knowledge_base.auditor)
+    if app.config.get('SERVER_TIMING') or app.config.get('METRICS'):
+        app.before_request(_before_request)
+    if app.config.get('SERVER_TIMING'):
+        app.after_request(_after_request)
@@ -0,0 +1,129 @@
+import unicodedata
+from collections import deque
+
+import synonyms
+
+# Multi-phrase matching with an Aho-Corasick automaton. The phrases are
+# compiled once into a trie whose nodes also carry a failure link: the node
+# of the longest proper suffix of their path that is also in the trie. A scan
+# reads the text one character at a time and follows a trie edge, or failure
+# links until one exists, so it finds every occurrence of every phrase in a
+# single pass whose cost depends on the text, not on how many phrases there
+# are. Phrases and text are compared by the lookup keys of synonyms.py, as
+# name lookups compare them: casefolded, accents dropped, any run of
+# punctuation or spaces one word break, so "acetylsalicylic-acid" and
+# "Pénicilline" match "Acetylsalicylic acid" and "penicilline". The text is
+# scanned in that form and matches are reported as offsets into the original.
+# Only whole words count: a match must not start or end inside a word, so
+# "asthma" is not found in "asthmatic".
+
+
+def _key(text):
+    """synonyms.normalize(text), without its per-character work when text is ASCII"""
+    if text.isascii():
+        return ' '.join(synonyms.WORDS.findall(text.lower()))
+    return synonyms.normalize(text)
+
+
+def _offsets(text):
+    """({key offset: text offset} where the words of _key(text) start, and the same where they end)"""
+    starts = {}
+    ends = {}
+    position = 0
+    if text.isascii():
+        # An ASCII key has one character per character of the words of text
+        for word in synonyms.WORDS.finditer(text):
+            starts[position] = word.start()
+            position += word.end() - word.start()
+            ends[position] = word.end()
+            position += 1
+        return starts, ends
+    word_break = False
+    for offset, char in enumerate(text):
+        for c in unicodedata.normalize('NFKD', char.casefold()):
+            if unicodedata.combining(c):
+                continue
+            if not c.isalnum():
+                word_break = True
+                continue
+            if word_break and position:
+                position += 1
+            word_break = False
+            starts[position] = offset
+            position += 1
+            ends[position] = offset + 1
+    return starts, ends
+
+
+class Automaton:
+    """Every whole-word occurrence of a fixed set of phrases, found in one pass"""
+
+    def __init__(self, phrases):
+        # phrases: (phrase, value) pairs; a phrase may carry several values
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for phrase, value in phrases:
+            key = synonyms.normalize(phrase)
+            if not key:
+                continue
+            state = 0
+            for char in key:
+                following = self._goto[state].get(char)
+                if following is None:
+                    following = len(self._goto)
+                    self._goto[state][char] = following
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = following
+            if (len(key), value) not in self._out[state]:
+                self._out[state] += ((len(key), value),)
+
+        # Breadth first, so a node's failure target is final before its children need it
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, following in self._goto[state].items():
+                pending.append(following)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[following] = target
+                self._out[following] += self._out[target]
+
+    def __len__(self):
+        return len(self._goto)
+
+    def _matches(self, key):
+        """(start, end, value) of every whole-word match in a key, in order of their end"""
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        length = len(key)
+        matches = []
+        state = 0
+        for position, char in enumerate(key, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            # Words in a key are separated by single spaces
+            if out[state] and (position == length or key[position] == ' '):
+                for size, value in out[state]:
+                    start = position - size
+                    if start == 0 or key[start - 1] == ' ':
+                        matches.append((start, position, value))
+        return matches
+
+    def scan(self, text):
+        """(start, end, value) of every whole-word match, in order of their end, as offsets into text"""
+        matches = self._matches(_key(text))
+        if not matches:
+            return matches
+        starts, ends = _offsets(text)
+        return [(starts[start], ends[end], value) for start, end, value in matches]
+
+    def values(self, text):
+        """The values of all phrases found in a text"""
+        return {value for _, _, value in self._matches(_key(text))}
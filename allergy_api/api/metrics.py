@@ -0,0 +1,412 @@
+import atexit
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, current_app, g, request
+
+import instrumentation
+
+# Prometheus text exposition for the API, with no client library or sidecar.
+# Hot-path updates go to a per-thread shard dict, so recording a sample never
+# takes a lock; shards are merged when /metrics is scraped. Under gunicorn each
+# worker periodically writes its merged snapshot to METRICS_DIR and the worker
+# answering the scrape sums every snapshot it finds there. The registry belongs
+# to the process; METRICS_DIR is read from the config of the app serving the
+# request.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+SQL_QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Registry:
+    """Holds metric definitions and the per-thread sample shards"""
+
+    def __init__(self):
+        self.metrics = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = {}
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(self, name, help_text, labelnames))
+
+    def histogram(self, name, help_text, buckets, labelnames=()):
+        return self._register(Histogram(self, name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, fn, aggregate='sum'):
+        return self._register(Gauge(self, name, help_text, fn, aggregate))
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+            return shard
+
+    def samples(self):
+        """Merge every thread's shard into one {(name, labels): value} dict"""
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    _merge_into(self._retired, shard)
+            self._shards = live
+            merged = {}
+            _merge_into(merged, self._retired)
+            for _, shard in live:
+                _merge_into(merged, shard)
+        return merged
+
+    def gauge_values(self):
+        values = {}
+        for metric in self.metrics.values():
+            if isinstance(metric, Gauge):
+                for labels, value in metric.fn().items():
+                    values[(metric.name, tuple(labels))] = value
+        return values
+
+
+def _merge_into(target, source):
+    # list() snapshots the items in one C-level call, so a concurrent writer
+    # in another thread cannot change the dict size under us
+    for key, value in list(source.items()):
+        if isinstance(value, list):
+            current = target.get(key)
+            if current is None:
+                target[key] = list(value)
+            else:
+                for i, v in enumerate(value):
+                    current[i] += v
+        else:
+            target[key] = target.get(key, 0) + value
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, registry, name, help_text, labelnames):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+
+    def inc(self, *labelvalues, amount=1):
+        shard = self.registry.shard()
+        key = (self.name, labelvalues)
+        shard[key] = shard.get(key, 0) + amount
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, labelnames, buckets):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labelvalues):
+        shard = self.registry.shard()
+        key = (self.name, labelvalues)
+        entry = shard.get(key)
+        if entry is None:
+            # one slot per bucket, one for +Inf, then the running sum
+            entry = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+
+class Gauge:
+    """Gauge evaluated at scrape time; fn returns {labels tuple: value}"""
+
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help_text, fn, aggregate):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.aggregate = aggregate
+
+
+registry = Registry()
+
+REQUESTS = registry.counter(
+    'allergy_api_requests_total', 'HTTP requests handled.', ('route', 'method', 'status'))
+REQUEST_DURATION = registry.histogram(
+    'allergy_api_request_duration_seconds', 'Request latency by route.', LATENCY_BUCKETS, ('route',))
+BATCH_SIZE = registry.histogram(
+    'allergy_api_batch_size', 'Drugs per /v1/batch/check request.', BATCH_SIZE_BUCKETS)
+SQL_QUERIES = registry.histogram(
+    'allergy_api_sql_queries_per_request', 'SQL statements executed per request.', SQL_QUERY_BUCKETS, ('route',))
+DB_CONNECTIONS = registry.counter(
+    'allergy_api_db_connections_opened_total', 'SQLite connections opened while serving requests.', ('route',))
+CACHE_LOOKUPS = registry.counter(
+    'allergy_api_cache_lookups_total', 'In-process cache lookups.', ('cache', 'result'))
+
+
+def _open_connections():
+    return {(): instrumentation.open_connections()}
+
+
+registry.gauge('allergy_api_db_connections_open', 'SQLite connections currently open.', _open_connections)
+
+
+def record_cache(cache, hit):
+    """Count a lookup against a named in-process cache"""
+    CACHE_LOOKUPS.inc(cache, 'hit' if hit else 'miss')
+
+
+def observe_batch_size(size):
+    BATCH_SIZE.observe(size)
+
+
+def set_info(name, help_text, fn):
+    """Register an info-style gauge; fn returns a dict of label values"""
+    registry.gauge(name, help_text, lambda: {tuple(sorted(fn().items())): 1}, aggregate='max')
+
+
+# Multi-process aggregation
+# {directory: pid} of the flusher threads started
+_flushers = {}
+_flushers_lock = threading.Lock()
+
+
+def _snapshot():
+    return {
+        'pid': os.getpid(),
+        'samples': [[name, list(labels), value] for (name, labels), value in registry.samples().items()],
+        'gauges': [[name, list(labels), value] for (name, labels), value in registry.gauge_values().items()]
+    }
+
+
+def _snapshot_path(directory, pid):
+    return os.path.join(directory, f'worker_{pid}.json')
+
+
+def flush(directory):
+    """Write this worker's snapshot to directory atomically"""
+    if not directory:
+        return
+    path = _snapshot_path(directory, os.getpid())
+    tmp = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(_snapshot(), f)
+    os.replace(tmp, path)
+
+
+def _flush_loop(directory, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush(directory)
+        except OSError:
+            pass
+
+
+def _ensure_flusher(directory, interval):
+    # started lazily so each forked worker gets its own thread
+    if _flushers.get(directory) == os.getpid():
+        return
+    with _flushers_lock:
+        if _flushers.get(directory) == os.getpid():
+            return
+        _flushers[directory] = os.getpid()
+    threading.Thread(target=_flush_loop, args=(directory, interval), name='metrics-flush', daemon=True).start()
+    atexit.register(flush, directory)
+
+
+def _pid_alive(pid):
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _samples_from(snapshot):
+    return {(name, tuple(labels)): value for name, labels, value in snapshot['samples']}
+
+
+def _compact(directory):
+    """Fold snapshots of exited workers into archive.json so max-requests
+    recycling does not leave one file per dead worker behind"""
+    archive_path = os.path.join(directory, 'archive.json')
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead = []
+        for path in glob.glob(os.path.join(directory, 'worker_*.json')):
+            snapshot = _read_snapshot(path)
+            if snapshot is not None and not _pid_alive(snapshot['pid']):
+                dead.append((path, snapshot))
+        if not dead:
+            return
+        archive = _read_snapshot(archive_path)
+        merged = _samples_from(archive) if archive else {}
+        for _, snapshot in dead:
+            _merge_into(merged, _samples_from(snapshot))
+        tmp = f'{archive_path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'pid': 0, 'gauges': [],
+                       'samples': [[name, list(labels), value] for (name, labels), value in merged.items()]}, f)
+        os.replace(tmp, archive_path)
+        for path, _ in dead:
+            os.remove(path)
+
+
+def _collect(directory):
+    """Return (samples, gauges) summed across every worker snapshot in directory, or of this worker without one"""
+    if not directory:
+        return registry.samples(), registry.gauge_values()
+
+    flush(directory)
+    _compact(directory)
+    samples, gauges = {}, {}
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        snapshot = _read_snapshot(path)
+        if snapshot is None:
+            continue
+        _merge_into(samples, _samples_from(snapshot))
+        # counters from exited workers still count; their gauges do not
+        if not _pid_alive(snapshot['pid']):
+            continue
+        for name, labels, value in snapshot['gauges']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            metric = registry.metrics.get(name)
+            if metric is not None and metric.aggregate == 'max':
+                gauges[key] = max(gauges.get(key, value), value)
+            else:
+                gauges[key] = gauges.get(key, 0) + value
+    return samples, gauges
+
+
+# Exposition
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render(directory=None):
+    samples, gauges = _collect(directory)
+    by_metric = {}
+    for (name, labels), value in samples.items():
+        by_metric.setdefault(name, []).append((tuple(labels), value))
+    for (name, labels), value in gauges.items():
+        by_metric.setdefault(name, []).append((tuple(labels), value))
+
+    lines = []
+    for name, metric in registry.metrics.items():
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for labels, value in sorted(by_metric.get(name, ()), key=lambda item: item[0]):
+            if metric.kind == 'histogram':
+                pairs = list(zip(metric.labelnames, labels))
+                cumulative = 0
+                for le, count in zip(metric.buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(pairs + [("le", le)])} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(pairs)} {_format_value(value[-1])}')
+                lines.append(f'{name}_count{_format_labels(pairs)} {cumulative}')
+            elif metric.kind == 'counter':
+                lines.append(f'{name}{_format_labels(list(zip(metric.labelnames, labels)))} {_format_value(value)}')
+            else:
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+    lines.extend(_cache_hit_ratios(samples))
+    return '\n'.join(lines) + '\n'
+
+
+def _cache_hit_ratios(samples):
+    totals = {}
+    for (name, labels), value in samples.items():
+        if name == CACHE_LOOKUPS.name:
+            cache, result = labels
+            hits_total = totals.setdefault(cache, [0, 0])
+            hits_total[1] += value
+            if result == 'hit':
+                hits_total[0] += value
+    lines = ['# HELP allergy_api_cache_hit_ratio Fraction of cache lookups that hit.',
+             '# TYPE allergy_api_cache_hit_ratio gauge']
+    for cache, (hits, total) in sorted(totals.items()):
+        lines.append(f'allergy_api_cache_hit_ratio{_format_labels([("cache", cache)])} {hits / total if total else 0.0}')
+    return lines
+
+
+# Flask wiring
+def _before_request():
+    g.metrics_started = time.perf_counter()
+    directory = current_app.config.get('METRICS_DIR')
+    if directory:
+        _ensure_flusher(directory, float(current_app.config.get('METRICS_FLUSH_INTERVAL', 5.0)))
+
+
+def _after_request(response):
+    started = g.get('metrics_started')
+    if started is None:
+        return response
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUESTS.inc(route, request.method, str(response.status_code))
+    REQUEST_DURATION.observe(time.perf_counter() - started, route)
+    timing = g.get('request_timing')
+    if timing is not None:
+        SQL_QUERIES.observe(timing.sql_queries, route)
+        if timing.db_connections:
+            DB_CONNECTIONS.inc(route, amount=timing.db_connections)
+    return response
+
+
+def metrics_endpoint():
+    return Response(render(current_app.config.get('METRICS_DIR')), content_type=CONTENT_TYPE)
+
+
+def init_app(app):
+    """Register request hooks and the /metrics route if METRICS is enabled"""
+    if not app.config.get('METRICS'):
+        return
+    if app.config.get('METRICS_DIR'):
+        os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint, methods=['GET'])
@@ -6,16 +6,16 @@ import logging
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("api_server.log"),
-        logging.StreamHandler()
-    ]
+import structured_logging
+
+# Configure logging; api_server.log is written by the background listener,
+# not by the request thread
+structured_logging.configure(
+    level=os.environ.get('ALLERGY_API_LOG_LEVEL', 'DEBUG').upper(),
+    log_file=os.environ.get('ALLERGY_API_LOG_FILE', 'api_server.log'),
+    sampling=structured_logging.parse_sampling(os.environ.get('ALLERGY_API_LOG_SAMPLING'))
 )
-logger = logging.getLogger(__name__)
+logger = logging.getLogger('allergy_api.minimal')
 
 app = Flask(__name__)
 CORS(app)
@@ -25,17 +25,17 @@ def get_db_connection():
     try:
         # Use absolute path to database
         db_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../database/allergy_api.db'))
-        logger.info(f"Connecting to database at: {db_path}")
+        logger.debug('Connecting to database at: %s', db_path)
         
         if not os.path.exists(db_path):
-            logger.error(f"Database file not found at: {db_path}")
+            logger.error('Database file not found at: %s', db_path)
             raise FileNotFoundError(f"Database file not found at: {db_path}")
             
         conn = sqlite3.connect(db_path)
         conn.row_factory = sqlite3.Row
         return conn
     except Exception as e:
-        logger.error(f"Database connection error: {e}")
+        logger.error('Database connection error: %s', e)
         raise
 
 # Health check endpoint
@@ -55,7 +55,7 @@ def health_check():
             'version': '1.0'
         })
     except Exception as e:
-        logger.error(f"Health check failed: {e}")
+        logger.error('Health check failed: %s', e)
         return jsonify({
             'status': 'unhealthy',
             'error': str(e)
@@ -66,4 +66,4 @@ if __name__ == '__main__':
     try:
         app.run(debug=True, host='0.0.0.0', port=5000)
     except Exception as e:
-        logger.critical(f"Failed to start server: {e}")
+        logger.critical('Failed to start server: %s', e)
@@ -0,0 +1,60 @@
+import re
+
+# National Drug Codes. A package NDC is 10 digits in three segments, labeler,
+# product and package, laid out 4-4-2, 5-3-2 or 5-4-1, and the 11-digit 5-4-2
+# billing form pads the short segment with a leading zero. Those 11 digits,
+# without hyphens, are the canonical form used throughout; a product NDC
+# (labeler and product only) is canonically 9 digits, 5-4. Hyphens say which
+# segment is short, so a hyphenated code has one canonical form. A bare
+# 10-digit or 8-digit code does not, and has one candidate per layout.
+
+PACKAGE = 'package'
+PRODUCT = 'product'
+
+_WIDTHS = (5, 4, 2)
+_LAYOUTS = {10: ((4, 4, 2), (5, 3, 2), (5, 4, 1)), 8: ((4, 4), (5, 3))}
+_DIGITS = re.compile(r'[0-9]+')
+
+
+def canonical_forms(ndc):
+    """Candidate canonical forms of an NDC: one for most spellings, () if it is not an NDC"""
+    if not isinstance(ndc, str):
+        return ()
+    text = ndc.strip()
+    if '-' in text:
+        segments = text.split('-')
+        if len(segments) not in (2, 3) or not all(_DIGITS.fullmatch(s) for s in segments):
+            return ()
+        widths = _WIDTHS[:len(segments)]
+        if any(len(s) > w for s, w in zip(segments, widths)) or sum(map(len, segments)) < sum(widths) - 1:
+            return ()
+        return (''.join(s.zfill(w) for s, w in zip(segments, widths)),)
+    if not _DIGITS.fullmatch(text):
+        return ()
+    if len(text) in (11, 9):
+        return (text,)
+    forms = []
+    for layout in _LAYOUTS.get(len(text), ()):
+        start = 0
+        padded = ''
+        for length, width in zip(layout, _WIDTHS):
+            padded += text[start:start + length].zfill(width)
+            start += length
+        forms.append(padded)
+    return tuple(forms)
+
+
+def canonical(ndc):
+    """The canonical form of an NDC, or None if it is not one or is ambiguous"""
+    forms = canonical_forms(ndc)
+    return forms[0] if len(forms) == 1 else None
+
+
+def level(code):
+    """PACKAGE or PRODUCT for a canonical NDC"""
+    return PACKAGE if len(code) == 11 else PRODUCT
+
+
+def product(code):
+    """The canonical product NDC of a canonical NDC: its labeler and product segments"""
+    return code[:9]
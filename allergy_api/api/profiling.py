@@ -0,0 +1,156 @@
+import cProfile
+import functools
+import hmac
+import marshal
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from flask import current_app, make_response, request
+
+# On-demand profiling of a single request. When PROFILING is enabled the view
+# functions listed in PROFILED_ENDPOINTS are wrapped; a request carrying a valid
+# X-Profile-Token header and either an X-Profile header or ?profile= flag runs
+# under a deterministic profiler. The result is returned as a download, or
+# written to PROFILING_DIR with the normal response returned. When PROFILING is
+# off nothing is wrapped, so unprofiled requests pay nothing. The token,
+# directory and rate come from the config of the app serving the request; the
+# rate window and the one-at-a-time lock are shared by the worker.
+
+PROFILED_ENDPOINTS = ('api.check_drug', 'api.batch_check', 'api.get_drug', 'api.get_allergy')
+FORMATS = ('pstats', 'collapsed')
+
+_recent = deque()
+_rate_lock = threading.Lock()
+_busy = threading.Lock()
+
+
+class StackProfiler:
+    """Deterministic profiler recording self time per full call stack"""
+
+    def __init__(self):
+        self.totals = {}
+        self._stack = []
+        self._last = 0.0
+
+    def _charge(self, now):
+        if self._stack:
+            key = ';'.join(self._stack)
+            self.totals[key] = self.totals.get(key, 0.0) + (now - self._last)
+        self._last = now
+
+    def _callback(self, frame, event, arg):
+        now = time.perf_counter()
+        if event == 'call':
+            self._charge(now)
+            code = frame.f_code
+            self._stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        elif event == 'c_call':
+            self._charge(now)
+            self._stack.append(getattr(arg, '__qualname__', getattr(arg, '__name__', repr(arg))))
+        elif event in ('return', 'c_return', 'c_exception'):
+            self._charge(now)
+            if self._stack:
+                self._stack.pop()
+
+    def runcall(self, fn, *args, **kwargs):
+        self._last = time.perf_counter()
+        sys.setprofile(self._callback)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            sys.setprofile(None)
+            self._charge(time.perf_counter())
+
+    def collapsed(self):
+        """Collapsed-stack text ('frame;frame;frame count'), counts in microseconds"""
+        lines = [f'{stack} {max(1, round(seconds * 1e6))}' for stack, seconds in self.totals.items()]
+        return '\n'.join(sorted(lines)) + '\n'
+
+
+def _requested_format():
+    fmt = request.headers.get('X-Profile') or request.args.get('profile')
+    if not fmt:
+        return None
+    fmt = fmt.lower()
+    return fmt if fmt in FORMATS else 'pstats'
+
+
+def _authorized():
+    token = current_app.config.get('PROFILING_TOKEN')
+    supplied = request.headers.get('X-Profile-Token', '')
+    return bool(token) and hmac.compare_digest(supplied.encode(), token.encode())
+
+
+def _allow():
+    now = time.monotonic()
+    with _rate_lock:
+        while _recent and now - _recent[0] > 60:
+            _recent.popleft()
+        if len(_recent) >= int(current_app.config.get('PROFILING_MAX_PER_MINUTE', 6)):
+            return False
+        _recent.append(now)
+        return True
+
+
+def _run_profiled(view, fmt, kwargs):
+    if fmt == 'collapsed':
+        profiler = StackProfiler()
+        response = make_response(profiler.runcall(view, **kwargs))
+        return response, profiler.collapsed().encode(), 'text/plain; charset=utf-8', 'txt'
+    profiler = cProfile.Profile()
+    response = make_response(profiler.runcall(view, **kwargs))
+    profiler.create_stats()
+    return response, marshal.dumps(profiler.stats), 'application/octet-stream', 'pstats'
+
+
+def _profiled(endpoint, view):
+    @functools.wraps(view)
+    def wrapper(**kwargs):
+        fmt = _requested_format()
+        if fmt is None:
+            return view(**kwargs)
+        if not _authorized():
+            return _annotate(make_response(view(**kwargs)), 'unauthorized')
+        if not _allow():
+            return _annotate(make_response(view(**kwargs)), 'rate-limited')
+        # one profiled request at a time per worker keeps profiles clean
+        if not _busy.acquire(blocking=False):
+            return _annotate(make_response(view(**kwargs)), 'busy')
+        try:
+            response, artifact, mimetype, extension = _run_profiled(view, fmt, kwargs)
+        finally:
+            _busy.release()
+
+        filename = f'{endpoint}-{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}-{time.perf_counter_ns() % 1000000}.{extension}'
+        directory = current_app.config.get('PROFILING_DIR')
+        if directory:
+            with open(os.path.join(directory, filename), 'wb') as f:
+                f.write(artifact)
+            response.headers['X-Profile-Artifact'] = filename
+            return _annotate(response, 'written')
+
+        download = make_response(artifact)
+        download.headers['Content-Type'] = mimetype
+        download.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        download.headers['X-Profile-Response-Status'] = str(response.status_code)
+        return _annotate(download, 'returned')
+    return wrapper
+
+
+def _annotate(response, status):
+    response.headers['X-Profile-Status'] = status
+    return response
+
+
+def init_app(app):
+    """Wrap the profiled endpoints if PROFILING is enabled; call after routes are registered"""
+    if not app.config.get('PROFILING'):
+        return
+    if app.config.get('PROFILING_DIR'):
+        os.makedirs(app.config['PROFILING_DIR'], exist_ok=True)
+    for endpoint in PROFILED_ENDPOINTS:
+        if endpoint in app.view_functions:
+            app.view_functions[endpoint] = _profiled(endpoint, app.view_functions[endpoint])
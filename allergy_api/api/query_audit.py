@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import re
+import sqlite3
+import sys
+import threading
+
+# Debug-mode auditor for every statement run through the instrumented SQLite
+# connection (see instrumentation.InstrumentedCursor). For each statement it
+# records execution time (including fetching) and rows returned, captures
+# EXPLAIN QUERY PLAN the first time a distinct statement is seen, flags full
+# table scans, and writes statements slower than the threshold to a JSON
+# slow-query log with their parameters redacted. Run this module as a script
+# to summarize a captured log. Each app with QUERY_AUDIT set has its own
+# Auditor, kept with its knowledge base.
+
+_WHITESPACE = re.compile(r'\s+')
+_PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+_EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+class StatementStats:
+    __slots__ = ('sql', 'count', 'total', 'max', 'rows', 'plan', 'full_scan')
+
+    def __init__(self, sql, plan, full_scan):
+        self.sql = sql
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.plan = plan
+        self.full_scan = full_scan
+
+    def as_dict(self):
+        return {
+            'sql': self.sql,
+            'count': self.count,
+            'total_ms': round(self.total * 1000, 3),
+            'mean_ms': round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            'max_ms': round(self.max * 1000, 3),
+            'rows': self.rows,
+            'full_scan': self.full_scan,
+            'plan': self.plan
+        }
+
+
+class PendingStatement:
+    """A statement whose rows are still being fetched"""
+
+    __slots__ = ('auditor', 'stats', 'parameters', 'elapsed', 'rows')
+
+    def __init__(self, auditor, stats, parameters, elapsed):
+        self.auditor = auditor
+        self.stats = stats
+        self.parameters = parameters
+        self.elapsed = elapsed
+        self.rows = 0
+
+    def add(self, rows, elapsed):
+        self.rows += rows
+        self.elapsed += elapsed
+
+    def finish(self):
+        stats = self.stats
+        auditor = self.auditor
+        with auditor.lock:
+            stats.count += 1
+            stats.total += self.elapsed
+            stats.rows += self.rows
+            if self.elapsed > stats.max:
+                stats.max = self.elapsed
+        if self.elapsed >= auditor.threshold:
+            auditor.slow_logger.warning('slow query', extra={'fields': {
+                'sql': stats.sql,
+                'params': redact_parameters(self.parameters),
+                'ms': round(self.elapsed * 1000, 3),
+                'rows': self.rows,
+                'full_scan': stats.full_scan,
+                'plan': stats.plan
+            }})
+
+
+def normalize_sql(sql):
+    """Collapse whitespace and IN-list placeholders so variants group together"""
+    return _PLACEHOLDER_LIST.sub('?, ...', _WHITESPACE.sub(' ', sql).strip())
+
+
+def redact_parameters(parameters):
+    """Describe parameters by type and size only"""
+    if isinstance(parameters, dict):
+        return {key: _describe(value) for key, value in parameters.items()}
+    return [_describe(value) for value in parameters]
+
+
+def _describe(value):
+    if value is None:
+        return None
+    if isinstance(value, (str, bytes)):
+        return f'<{type(value).__name__}:{len(value)}>'
+    return f'<{type(value).__name__}>'
+
+
+def explain(connection, sql, parameters):
+    """Return (plan detail lines, full_scan) for a statement"""
+    if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return [], False
+    try:
+        # a plain cursor, so the EXPLAIN itself is not audited
+        rows = connection.cursor(sqlite3.Cursor).execute(f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+    except sqlite3.Error:
+        return [], False
+    plan = [row[3] for row in rows]
+    full_scan = any(_is_full_scan(detail) for detail in plan)
+    return plan, full_scan
+
+
+def _is_full_scan(detail):
+    # "SCAN drugs" (or "SCAN TABLE drugs" before SQLite 3.36) walks the whole
+    # table; "SCAN d USING COVERING INDEX" still walks the whole index
+    return detail.startswith('SCAN ') and not detail.startswith('SCAN CONSTANT ROW')
+
+
+class Auditor:
+    """Statement statistics of one app; statements slower than slow_ms go to log_path"""
+
+    def __init__(self, slow_ms=50.0, log_path='slow_queries.log'):
+        import structured_logging
+        self.threshold = slow_ms / 1000.0
+        self.slow_logger = structured_logging.file_logger('allergy_api.slow_query', log_path)
+        self.lock = threading.Lock()
+        self.statements = {}
+
+    def begin(self, connection, sql, parameters, elapsed):
+        """Start accounting for an executed statement"""
+        key = normalize_sql(sql)
+        stats = self.statements.get(key)
+        if stats is None:
+            plan, full_scan = explain(connection, sql, parameters)
+            with self.lock:
+                stats = self.statements.setdefault(key, StatementStats(key, plan, full_scan))
+        return PendingStatement(self, stats, parameters, elapsed)
+
+    def report(self, top=20):
+        """Audited statements ordered by total time"""
+        with self.lock:
+            stats = [s.as_dict() for s in self.statements.values()]
+        return sorted(stats, key=lambda s: s['total_ms'], reverse=True)[:top]
+
+    def reset(self):
+        with self.lock:
+            self.statements.clear()
+
+
+def init_app(app):
+    """Give app's knowledge base an Auditor if QUERY_AUDIT is set in app's config"""
+    if app.config.get('QUERY_AUDIT'):
+        app.extensions['allergy_api'].auditor = Auditor(
+            app.config.get('QUERY_AUDIT_SLOW_MS', 50.0), app.config.get('QUERY_AUDIT_LOG', 'slow_queries.log'))
+
+
+# Summary CLI
+def summarize(lines, top=20):
+    """Aggregate slow-query log lines by statement, ordered by total time"""
+    totals = {}
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if 'sql' not in entry:
+            continue
+        agg = totals.setdefault(entry['sql'], {
+            'sql': entry['sql'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0,
+            'full_scan': entry.get('full_scan', False), 'plan': entry.get('plan', [])
+        })
+        agg['count'] += 1
+        agg['total_ms'] += entry.get('ms', 0.0)
+        agg['max_ms'] = max(agg['max_ms'], entry.get('ms', 0.0))
+        agg['rows'] += entry.get('rows', 0)
+    return sorted(totals.values(), key=lambda a: a['total_ms'], reverse=True)[:top]
+
+
+def print_summary(summary, show_plans=False, out=sys.stdout):
+    out.write(f"{'total ms':>10} {'count':>7} {'mean ms':>9} {'max ms':>9} {'rows':>8} scan  statement\n")
+    for agg in summary:
+        mean = agg['total_ms'] / agg['count'] if agg['count'] else 0.0
+        sql = agg['sql'] if len(agg['sql']) <= 100 else agg['sql'][:97] + '...'
+        flag = 'FULL' if agg['full_scan'] else '    '
+        out.write(f"{agg['total_ms']:10.2f} {agg['count']:7d} {mean:9.3f} {agg['max_ms']:9.3f} {agg['rows']:8d} {flag}  {sql}\n")
+        if show_plans:
+            for detail in agg['plan']:
+                out.write(f"{'':52}-> {detail}\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Summarize a captured slow-query log by total time')
+    parser.add_argument('log', help='slow-query log written by the auditor (JSON lines)')
+    parser.add_argument('--top', type=int, default=20, help='number of statements to show')
+    parser.add_argument('--plans', action='store_true', help='print the captured query plans')
+    args = parser.parse_args(argv)
+    with open(args.log) as f:
+        print_summary(summarize(f, args.top), args.plans)
+
+
+if __name__ == '__main__':
+    main()
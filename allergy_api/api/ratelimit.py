@@ -0,0 +1,214 @@
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g, jsonify, request
+
+import metrics
+
+# Token-bucket rate limiting for /v1/* keyed by API key. Each tier has a refill
+# rate (tokens per second) and a burst capacity; every request takes one token
+# and is answered 429 with Retry-After when its bucket is empty. Requests
+# without a known X-API-Key share the default tier, one bucket per client
+# address. Buckets live in this worker's memory by default (a two-item list per
+# key, guarded by one of a fixed set of striped locks so there is no global
+# lock), or in a SQLite file shared by all workers when RATE_LIMIT_STORE is set.
+# With AUTH enabled the bucket and tier come from the authenticated key. Each
+# app with RATE_LIMIT set has its own RateLimiter, kept with its knowledge base.
+
+logger = logging.getLogger('allergy_api.ratelimit')
+
+DEFAULT_TIERS = 'anonymous=2/20,standard=20/100,premium=100/500'
+SWEEP_INTERVAL = 60.0
+
+RATE_LIMITED = metrics.registry.counter(
+    'allergy_api_rate_limited_total', 'Requests rejected with 429 by the rate limiter.', ('tier',))
+
+
+class MemoryStore:
+    """Per-worker buckets: {key: [tokens, last refill]} behind striped locks"""
+
+    def __init__(self, stripes=64):
+        self.buckets = {}
+        self.locks = [threading.Lock() for _ in range(stripes)]
+        self.mask = stripes - 1
+
+    def take(self, key, rate, burst, cost=1):
+        """Take cost tokens; returns (allowed, tokens left)"""
+        now = time.monotonic()
+        with self.locks[hash(key) & self.mask]:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [burst, now]
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= cost:
+                bucket[0] = tokens - cost
+                return True, bucket[0]
+            bucket[0] = tokens
+            return False, tokens
+
+    def sweep(self, idle):
+        """Drop buckets untouched for idle seconds; they would be full again anyway"""
+        cutoff = time.monotonic() - idle
+        for key, bucket in list(self.buckets.items()):
+            if bucket[1] < cutoff:
+                with self.locks[hash(key) & self.mask]:
+                    if bucket[1] < cutoff:
+                        self.buckets.pop(key, None)
+
+
+class SqliteStore:
+    """Buckets shared by every worker through one SQLite file; one UPSERT per take"""
+
+    TAKE = '''
+        INSERT INTO rate_limit_buckets (key, tokens, updated, allowed)
+        VALUES (:key, :burst - :cost, :now, 1)
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = CASE WHEN MIN(:burst, tokens + MAX(:now - updated, 0) * :rate) >= :cost
+                          THEN MIN(:burst, tokens + MAX(:now - updated, 0) * :rate) - :cost
+                          ELSE MIN(:burst, tokens + MAX(:now - updated, 0) * :rate) END,
+            updated = MAX(updated, :now),
+            allowed = MIN(:burst, tokens + MAX(:now - updated, 0) * :rate) >= :cost
+        RETURNING allowed, tokens
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute('''
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                allowed INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+
+    def _connection(self):
+        # one connection per thread, reopened after fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=1.0)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # bucket state is disposable; don't pay for durability
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, rate, burst, cost=1):
+        """Take cost tokens; returns (allowed, tokens left)"""
+        row = self._connection().execute(self.TAKE, {
+            'key': key, 'rate': rate, 'burst': burst, 'cost': cost, 'now': time.time()
+        }).fetchone()
+        return bool(row[0]), row[1]
+
+    def sweep(self, idle):
+        self._connection().execute('DELETE FROM rate_limit_buckets WHERE updated < ?', (time.time() - idle,))
+
+
+def parse_tiers(spec):
+    """Parse 'tier=rate/burst,...' into {tier: (rate per second, burst)}"""
+    tiers = {}
+    for item in (spec or '').split(','):
+        if '=' not in item:
+            continue
+        name, limits = item.split('=', 1)
+        rate, _, burst = limits.partition('/')
+        rate = float(rate)
+        burst = float(burst) if burst else max(rate, 1.0)
+        if rate <= 0 or burst < 1:
+            raise ValueError(f'invalid rate limit tier {item!r}')
+        tiers[name.strip()] = (rate, burst)
+    return tiers
+
+
+def parse_keys(spec):
+    """Parse 'api_key=tier,...'; keys are replaced by opaque ids for bucket names"""
+    keys = {}
+    for n, item in enumerate((spec or '').split(',')):
+        if '=' in item:
+            key, tier = item.split('=', 1)
+            keys[key.strip()] = (f'key{n}', tier.strip())
+    return keys
+
+
+class RateLimiter:
+    """An app's tiers, configured keys and bucket store"""
+
+    def __init__(self, tiers, default_tier='anonymous', keys=None, store=None):
+        self.tiers = tiers
+        self.default_tier = default_tier
+        self.keys = keys or {}
+        for tier in {default_tier, *(tier for _, tier in self.keys.values())}:
+            if tier not in tiers:
+                raise ValueError(f'unknown rate limit tier {tier!r}')
+        self.store = store or MemoryStore()
+        # a bucket idle this long has refilled completely and can be forgotten
+        self.idle = max(burst / rate for rate, burst in tiers.values())
+        self.last_sweep = 0.0
+
+    def identify(self):
+        """(bucket, tier) of the current request"""
+        api_key = g.get('api_key')
+        if api_key is not None:
+            return f'api{api_key.id}', (api_key.tier if api_key.tier in self.tiers else self.default_tier)
+        known = self.keys.get(request.headers.get('X-API-Key'))
+        if known is not None:
+            return known
+        return f'addr:{request.remote_addr}', self.default_tier
+
+    def take(self, bucket, tier):
+        """(allowed, tokens left, rate) for one request of tier from bucket"""
+        rate, burst = self.tiers[tier]
+        allowed, tokens = self.store.take(bucket, rate, burst)
+        now = time.monotonic()
+        if now - self.last_sweep > SWEEP_INTERVAL:
+            self.last_sweep = now
+            self.store.sweep(self.idle)
+        return allowed, tokens, rate
+
+
+def _retry_after(tokens, rate, cost=1):
+    return max(1, math.ceil((cost - tokens) / rate))
+
+
+def _before_request():
+    if not request.path.startswith('/v1/'):
+        return None
+    limiter = current_app.extensions['allergy_api'].rate_limiter
+    bucket, tier = limiter.identify()
+    try:
+        allowed, tokens, rate = limiter.take(bucket, tier)
+    except sqlite3.Error:
+        # a shared store that is locked or unavailable must not take the API down
+        logger.warning('rate limit store unavailable; allowing request', exc_info=True)
+        return None
+    if allowed:
+        return None
+    RATE_LIMITED.inc(tier)
+    retry_after = _retry_after(tokens, rate)
+    response = jsonify({
+        'error': 'Rate limit exceeded',
+        'message': f'Too many requests for the {tier} tier; retry after {retry_after} seconds'
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def init_app(app):
+    """Rate limit /v1/* if RATE_LIMIT is set in app's config"""
+    if not app.config.get('RATE_LIMIT'):
+        return
+    store_path = app.config.get('RATE_LIMIT_STORE')
+    app.extensions['allergy_api'].rate_limiter = RateLimiter(
+        parse_tiers(app.config.get('RATE_LIMIT_TIERS') or DEFAULT_TIERS),
+        app.config.get('RATE_LIMIT_DEFAULT_TIER', 'anonymous'),
+        parse_keys(app.config.get('RATE_LIMIT_KEYS')),
+        SqliteStore(store_path) if store_path else None)
+    app.before_request(_before_request)
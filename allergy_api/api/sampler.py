@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+import argparse
+import glob
+import os
+import sys
+import threading
+import time
+
+from flask import current_app, request
+
+import metrics
+
+# Continuous low-overhead sampling profiler. A daemon thread in each worker
+# wakes every SAMPLER_INTERVAL_MS, grabs the Python stacks of threads that are
+# currently serving a request (sys._current_frames), and counts them per route
+# as collapsed stacks ("route;frame;frame count"). Counts are flushed to
+# rotating files under SAMPLER_DIR that flamegraph.pl / speedscope read as-is.
+# The sampler measures its own cost and widens the interval if it exceeds
+# SAMPLER_MAX_OVERHEAD of wall time. Each app with SAMPLER set has its own
+# Sampler, kept with its knowledge base. Run this module as a script to report
+# per-function shares from the flushed files.
+
+_code_labels = {}
+
+
+def _label(code):
+    label = _code_labels.get(code)
+    if label is None:
+        label = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+        _code_labels[code] = label
+    return label
+
+
+def _stack_key(frame):
+    labels = []
+    while frame is not None:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+
+class Sampler:
+    """The sampler of one app: its settings, the threads serving its requests and its own thread"""
+
+    def __init__(self, interval=0.01, directory='profiles', flush_seconds=60.0, keep_files=60, max_overhead=0.01):
+        self.interval = interval
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self.keep_files = keep_files
+        self.max_overhead = max_overhead
+        # {thread ident: route} of the requests being served
+        self.active = {}
+        self.state = {'pid': None, 'interval': interval, 'overhead': 0.0, 'samples': 0}
+
+    def flush(self, counts):
+        if not counts:
+            return
+        pid = os.getpid()
+        path = os.path.join(self.directory, f'samples-{pid}-{time.strftime("%Y%m%dT%H%M%S")}.collapsed')
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            for stack, count in counts.items():
+                f.write(f'{stack} {count}\n')
+        os.replace(tmp, path)
+        # rotate: keep the newest keep_files files of this worker
+        files = sorted(glob.glob(os.path.join(self.directory, f'samples-{pid}-*.collapsed')))
+        for old in files[:-self.keep_files]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def run(self):
+        me = threading.get_ident()
+        counts = {}
+        interval = self.interval
+        window_start = time.perf_counter()
+        window_spent = 0.0
+        last_flush = time.monotonic()
+        while True:
+            time.sleep(interval)
+            start = time.perf_counter()
+            if self.active:
+                frames = sys._current_frames()
+                for ident, route in list(self.active.items()):
+                    frame = frames.get(ident)
+                    if frame is None or ident == me:
+                        continue
+                    key = f'{route};{_stack_key(frame)}'
+                    counts[key] = counts.get(key, 0) + 1
+                    self.state['samples'] += 1
+                del frames
+            end = time.perf_counter()
+            window_spent += end - start
+
+            # adapt the interval to stay under the overhead budget
+            if end - window_start >= 1.0:
+                overhead = window_spent / (end - window_start)
+                self.state['overhead'] = overhead
+                if overhead > self.max_overhead:
+                    interval = min(interval * 1.5, 1.0)
+                elif overhead < self.max_overhead / 4 and interval > self.interval:
+                    interval = max(interval / 1.5, self.interval)
+                self.state['interval'] = interval
+                window_start, window_spent = end, 0.0
+
+            if time.monotonic() - last_flush >= self.flush_seconds:
+                try:
+                    self.flush(counts)
+                except OSError:
+                    pass
+                counts = {}
+                last_flush = time.monotonic()
+
+    def ensure_started(self):
+        # started lazily so each forked worker gets its own sampler thread
+        if self.state['pid'] == os.getpid():
+            return
+        self.state['pid'] = os.getpid()
+        self.state['interval'] = self.interval
+        self.active.clear()
+        threading.Thread(target=self.run, name='stack-sampler', daemon=True).start()
+
+
+def _before_request():
+    sampler = current_app.extensions['allergy_api'].sampler
+    sampler.ensure_started()
+    rule = request.url_rule
+    sampler.active[threading.get_ident()] = rule.rule if rule is not None else 'unmatched'
+
+
+def _teardown_request(exc):
+    current_app.extensions['allergy_api'].sampler.active.pop(threading.get_ident(), None)
+
+
+def init_app(app):
+    """Start sampling request threads if SAMPLER is set in app's config"""
+    if not app.config.get('SAMPLER'):
+        return
+    sampler = app.extensions['allergy_api'].sampler = Sampler(
+        app.config.get('SAMPLER_INTERVAL_MS', 10.0) / 1000.0,
+        app.config.get('SAMPLER_DIR', 'profiles'),
+        float(app.config.get('SAMPLER_FLUSH_SECONDS', 60.0)),
+        int(app.config.get('SAMPLER_KEEP_FILES', 60)),
+        float(app.config.get('SAMPLER_MAX_OVERHEAD', 0.01)))
+    os.makedirs(sampler.directory, exist_ok=True)
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
+
+    metrics.registry.gauge('allergy_api_sampler_overhead_ratio',
+                           'Fraction of wall time spent by the stack sampler.',
+                           lambda: {(): sampler.state['overhead']})
+
+
+# Report CLI
+def read_collapsed(paths):
+    counts = {}
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    counts[stack] = counts.get(stack, 0) + int(count)
+    return counts
+
+
+def function_shares(counts, route, functions):
+    """Share of a route's samples whose stack includes each function"""
+    total = 0
+    hits = dict.fromkeys(functions, 0)
+    for stack, count in counts.items():
+        frames = stack.split(';')
+        if frames[0] != route:
+            continue
+        total += count
+        names = {frame.split(' (', 1)[0] for frame in frames[1:]}
+        for fn in functions:
+            if fn in names:
+                hits[fn] += count
+    return total, {fn: (hits[fn] / total if total else 0.0) for fn in functions}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Report per-function sample shares from collapsed-stack files')
+    parser.add_argument('files', nargs='+', help='collapsed-stack files written by the sampler')
+    parser.add_argument('--route', required=True, help='route to report on, e.g. /v1/batch/check')
+    parser.add_argument('--function', action='append', dest='functions', required=True,
+                        help='function name to measure (repeatable)')
+    args = parser.parse_args(argv)
+    paths = [p for pattern in args.files for p in glob.glob(pattern)]
+    total, shares = function_shares(read_collapsed(paths), args.route, args.functions)
+    print(f'{args.route}: {total} samples')
+    for fn, share in shares.items():
+        print(f'  {share * 100:6.2f}%  {fn}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+import json
+import secrets
+import string
+
+from flask import Request, current_app, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+import metrics
+import versioned
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Faster JSON responses with the same bytes as jsonify. FastJSONProvider
+# replaces Flask's provider: in compact mode it encodes with orjson when that
+# is installed and JSON_ENCODER allows it, falling back to the stdlib encoder
+# for any output the two would write differently. Static parts of a response
+# can be wrapped in Raw: they are serialized once, written by the encoder as a
+# placeholder string and then swapped for their bytes with one split, so a
+# response is still encoded by a single C-level call. In debug (indented) mode
+# everything goes through the stdlib encoder and Raw values are expanded.
+# The encoder is chosen per app, from its JSON_ENCODER.
+#
+# /v1/* routes also speak MessagePack when the msgpack package is installed:
+# request bodies sent as application/msgpack are decoded where JSON would be,
+# and responses are packed instead of encoded when the client's Accept prefers
+# application/msgpack to application/json. The objects are the same either
+# way. MessagePack is concatenative like JSON, so Raw values are packed once
+# as well and spliced in the same way.
+
+# Output orjson may write differently from json.dumps(ensure_ascii=True):
+# non-ASCII or DEL (escaped by the stdlib), floats in exponent form, and
+# floats below 1e-4 that orjson writes as plain decimals. The checks use
+# bytes methods rather than a regex, which would cost more than orjson itself;
+# matches inside strings only cost a fallback.
+_DIGITS_TO_ZERO = bytes.maketrans(b'123456789E', b'000000000e')
+
+# Placeholders carry a per-process random tag so request data cannot forge one
+_TAG = '\x00' + ''.join(secrets.choice(string.ascii_letters) for _ in range(16))
+_PLACEHOLDER = b'"\\u0000' + _TAG[1:].encode() + b'"'
+
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+class Raw:
+    """A JSON value serialized once and spliced into responses verbatim"""
+
+    __slots__ = ('value', 'encoded', 'packed')
+
+    def __init__(self, value, encoded):
+        self.value = value
+        self.encoded = encoded
+        self.packed = None
+
+
+def _stdlib_dumps(obj, default):
+    return json.dumps(obj, default=default, ensure_ascii=True, sort_keys=True, separators=(',', ':')).encode()
+
+
+def _orjson_dumps(obj, default):
+    try:
+        encoded = orjson.dumps(obj, default=default, option=orjson.OPT_SORT_KEYS
+                               | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+    except TypeError:
+        # e.g. ints over 64 bits
+        return None
+    if not encoded.isascii() or b'\x7f' in encoded or b'0.0000' in encoded:
+        return None
+    if b'0e' in encoded.translate(_DIGITS_TO_ZERO):
+        return None
+    return encoded
+
+
+def encode(obj, use_orjson=False):
+    """Compact JSON bytes for obj, identical to jsonify's, splicing in Raw values"""
+    fragments = []
+
+    def default(o):
+        if isinstance(o, Raw):
+            fragments.append(o.encoded)
+            return _TAG
+        return DefaultJSONProvider.default(o)
+
+    encoded = _orjson_dumps(obj, default) if use_orjson else None
+    if encoded is None:
+        fragments.clear()
+        encoded = _stdlib_dumps(obj, default)
+    if not fragments:
+        return encoded
+    # both encoders call default() in output order
+    spliced = _splice(encoded, _PLACEHOLDER, fragments)
+    if spliced is None:
+        # the tag turned up in the data itself; expand the fragments instead
+        return _stdlib_dumps(obj, FastJSONProvider.default)
+    return spliced
+
+
+def _splice(encoded, placeholder, fragments):
+    parts = encoded.split(placeholder)
+    if len(parts) != len(fragments) + 1:
+        return None
+    pieces = [b''] * (2 * len(parts) - 1)
+    pieces[::2] = parts
+    pieces[1::2] = fragments
+    return b''.join(pieces)
+
+
+def raw(value, use_orjson=False):
+    return Raw(value, encode(value, use_orjson))
+
+
+def pack(obj):
+    """MessagePack bytes for obj, splicing in Raw values"""
+    fragments = []
+
+    def default(o):
+        if isinstance(o, Raw):
+            if o.packed is None:
+                o.packed = pack(o.value)
+            fragments.append(o.packed)
+            return _TAG
+        return DefaultJSONProvider.default(o)
+
+    packed = msgpack.packb(obj, default=default)
+    if not fragments:
+        return packed
+    spliced = _splice(packed, msgpack.packb(_TAG), fragments)
+    if spliced is None:
+        return msgpack.packb(obj, default=FastJSONProvider.default)
+    return spliced
+
+
+def _reject_ext(code, data):
+    raise ValueError('MessagePack extension types are not accepted')
+
+
+def _use_msgpack():
+    """Whether the current app speaks MessagePack"""
+    return msgpack is not None and bool(current_app.config.get('MSGPACK'))
+
+
+def _response_type():
+    """The negotiated response type on /v1/* routes, or None elsewhere"""
+    if not has_request_context() or not request.path.startswith('/v1/') or not _use_msgpack():
+        return None
+    return request.accept_mimetypes.best_match(('application/json',) + MSGPACK_TYPES) or 'application/json'
+
+
+class MessagePackRequest(Request):
+    """Request whose get_json() also decodes application/msgpack bodies"""
+
+    def get_json(self, force=False, silent=False, cache=True):
+        if self.mimetype not in MSGPACK_TYPES or not _use_msgpack():
+            return super().get_json(force=force, silent=silent, cache=cache)
+        if cache and hasattr(self, '_cached_msgpack'):
+            return self._cached_msgpack
+        try:
+            data = msgpack.unpackb(self.get_data(cache=cache), ext_hook=_reject_ext)
+        except (ValueError, TypeError) as e:
+            if silent:
+                return None
+            return self.on_json_loading_failed(e)
+        if cache:
+            self._cached_msgpack = data
+        return data
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider using the app's JSON_ENCODER and splicing Raw values"""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.use_orjson = orjson_selected(app.config.get('JSON_ENCODER', 'auto'))
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Raw):
+            return o.value
+        return DefaultJSONProvider.default(o)
+
+    def response(self, *args, **kwargs):
+        response_type = _response_type()
+        if response_type in MSGPACK_TYPES:
+            obj = self._prepare_response_obj(args, kwargs)
+            response = self._app.response_class(pack(obj), mimetype=response_type)
+        elif (self.compact is None and self._app.debug) or self.compact is False:
+            response = super().response(*args, **kwargs)
+        else:
+            obj = self._prepare_response_obj(args, kwargs)
+            response = self._app.response_class(encode(obj, self.use_orjson) + b'\n', mimetype=self.mimetype)
+        if response_type is not None:
+            response.vary.add('Accept')
+        return response
+
+
+class FragmentCache:
+    """Pre-serialized per-drug fragments, dropped when the knowledge base version changes"""
+
+    def __init__(self, version_fn, check_interval=60.0):
+        self.enabled = True
+        self.use_orjson = False
+        self._fragments = versioned.VersionedCache(dict, version_fn, check_interval)
+
+    def get(self, key, build):
+        """The fragment for key, calling build() to produce its value on a miss"""
+        if not self.enabled:
+            return build()
+        fragments = self._fragments.get()
+        fragment = fragments.get(key)
+        metrics.record_cache('fragments', fragment is not None)
+        if fragment is None:
+            fragment = fragments[key] = raw(build(), self.use_orjson)
+        return fragment
+
+    def clear(self):
+        self._fragments.clear()
+
+
+def orjson_selected(encoder='auto'):
+    """Whether a JSON_ENCODER of 'orjson', 'stdlib', or 'auto' (orjson when installed) encodes with orjson"""
+    if encoder == 'orjson' and orjson is None:
+        raise RuntimeError('JSON_ENCODER is orjson but orjson is not installed')
+    return orjson is not None and encoder in ('auto', 'orjson')
+
+
+def init_app(app):
+    """Install FastJSONProvider on app with the JSON_ENCODER from its config, and MessagePack if MSGPACK is set"""
+    app.json = FastJSONProvider(app)
+    app.extensions['allergy_api'].fragments.use_orjson = app.json.use_orjson
+    app.request_class = MessagePackRequest
@@ -0,0 +1,881 @@
+import bisect
+import json
+import sqlite3
+
+import allergy_text
+import cross_reactivity
+import crosswalk
+import ndc
+import synonyms
+import versioned
+
+# Knowledge base storage behind one interface, so the routes do not care
+# where the data lives. A backend resolves drugs (by name, RxCUI or NDC),
+# allergies and conditions, fetches a drug's ingredients, contraindications,
+# warnings and brand names, evaluates a drug against a patient's allergies
+# and conditions (the contraindications found, or only the highest severity),
+# and pages through an allergy's related lists and the catalog search index.
+# SqliteStorage answers with queries per call. MemoryStorage reads the tables
+# once into dicts keyed by id and sorted lists, and answers every call from
+# them, with no SQL on the request path; it is rebuilt when the knowledge base
+# version changes. Label search reads SQLite's full-text index with either
+# backend. Both share the name, RxCUI, cross-reactivity and allergy
+# text indexes, which are in memory already, and build their contraindications
+# with the same functions below, so their answers are identical, in the same
+# order. test_storage_parity.py checks that over a generated catalog.
+
+SEVERITIES = (None, 'low', 'medium', 'high')
+EVIDENCE_RANKS = {'high': 3, 'medium': 2, 'low': 1}
+
+# Catalog searches this short read their facets from search_facets
+CATALOG_FACET_PREFIX = 2
+
+# The related lists of /v1/allergy, each read in primary key order from the
+# position in the cursor, so every page is an index range scan of at most
+# limit + 1 rows. Parameters: allergy id, position, limit + 1.
+ALLERGY_INGREDIENTS_PAGE = '''
+    SELECT i.name, i.rxcui, ai.relationship, ai.ingredient_id AS page_key
+    FROM allergy_members ai
+    JOIN ingredients i ON i.id = ai.ingredient_id
+    WHERE ai.allergy_id = ? AND ai.ingredient_id > ?
+    ORDER BY ai.ingredient_id
+    LIMIT ?
+'''
+ALLERGY_CROSS_REACTIVITY_PAGE = '''
+    SELECT cr.evidence_level, cr.description, i.name AS target_name,
+           acr.cross_reactivity_id AS page_key
+    FROM allergy_cross_reactivity acr
+    JOIN cross_reactivity cr ON cr.id = acr.cross_reactivity_id
+    JOIN ingredients i ON i.id = cr.target_id
+    WHERE acr.allergy_id = ? AND acr.cross_reactivity_id > ?
+    ORDER BY acr.cross_reactivity_id
+    LIMIT ?
+'''
+ALLERGY_DRUGS_PAGE = '''
+    SELECT d.name, d.rxcui, ad.relationship, ad.drug_id AS page_key
+    FROM allergy_drugs ad
+    JOIN drugs d ON d.id = ad.drug_id
+    WHERE ad.allergy_id = ? AND ad.drug_id > ?
+    ORDER BY ad.drug_id
+    LIMIT ?
+'''
+
+
+# Contraindications, as both backends report them
+def direct_contraindication(allergy_name, ingredient_name, is_active, relationship, evidence_level, include_evidence):
+    return {
+        'type': 'allergy',
+        'name': allergy_name,
+        'severity': 'high' if is_active else 'medium',
+        'description': f"Contains {ingredient_name} which is related to {allergy_name} allergy",
+        'evidence': {
+            'source': 'custom',
+            'text': f"Direct match with {relationship} relationship, {evidence_level} evidence"
+        } if include_evidence else None,
+        'recommendation': 'Avoid this medication'
+    }
+
+
+def class_contraindication(allergy_name, ingredient_name, is_active, code, class_name, evidence_level,
+                           include_evidence):
+    return {
+        'type': 'allergy',
+        'name': allergy_name,
+        'severity': 'high' if is_active else 'medium',
+        'description': f"Contains {ingredient_name} which is related to {allergy_name} allergy",
+        'evidence': {
+            'source': 'custom',
+            'text': f"Member of class {code} ({class_name}), {evidence_level} evidence"
+        } if include_evidence else None,
+        'recommendation': 'Avoid this medication'
+    }
+
+
+def cross_contraindication(allergy_name, ingredient_name, reaction, include_evidence):
+    return {
+        'type': 'allergy',
+        'name': allergy_name,
+        'severity': 'medium' if reaction.evidence_level == 'high' else 'low',
+        'description': f"Contains {ingredient_name} which may cross-react with {allergy_name} allergy",
+        'evidence': {
+            'source': 'custom',
+            'text': '; '.join(reaction.descriptions),
+            'evidence_level': reaction.evidence_level,
+            'path': reaction.names
+        } if include_evidence else None,
+        'recommendation': 'Use with caution' if reaction.evidence_level == 'low' else 'Consider alternative medication'
+    }
+
+
+def condition_contraindication(condition_name, evidence_level, description, source, include_evidence):
+    return {
+        'type': 'condition',
+        'name': condition_name,
+        'severity': evidence_level,
+        'description': description,
+        'evidence': {
+            'source': source,
+            'text': description
+        } if include_evidence else None,
+        'recommendation': 'Avoid this medication' if evidence_level == 'high' else 'Use with caution'
+    }
+
+
+def cross_reaction_rank(reaction):
+    """The verdict rank of a cross-reaction: medium at most"""
+    return 2 if reaction.evidence_level == 'high' else 1
+
+
+def page(rows, limit):
+    """(page, next position): the first limit of up to limit + 1 rows in keyset order, and None at the end"""
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1]['page_key']
+    return rows, None
+
+
+def _keyed(rows):
+    """{allergy id: (page keys, rows)} of rows read in (allergy_id, page_key) order"""
+    lists = {}
+    for row in rows:
+        row = dict(row)
+        keys, values = lists.setdefault(row.pop('allergy_id'), ([], []))
+        keys.append(row['page_key'])
+        values.append(row)
+    return lists
+
+
+class Storage:
+    """Resolution through the shared in-memory indexes; subclasses fetch and evaluate"""
+
+    def __init__(self, connect, version_fn, max_depth=3):
+        self.connect = connect
+        self.version_fn = version_fn
+        # Best multi-hop cross-reactivity path per allergy and ingredient
+        self.cross_reactions = cross_reactivity.CrossReactivityIndex(connect, version_fn, max_depth)
+        # Every known RxCUI of each drug
+        self.rxcuis = crosswalk.RxcuiCrosswalk(connect, version_fn)
+        # Every name, brand name and synonym of drugs, ingredients, allergies and conditions
+        self.names = synonyms.NameIndex(connect, version_fn)
+        # Free-text allergy lists, resolved by one compiled automaton
+        self.allergy_parser = allergy_text.AllergyTextParser(connect, version_fn)
+
+    def _indexes(self):
+        return (self.cross_reactions, self.rxcuis, self.names, self.allergy_parser)
+
+    def load(self):
+        """Build the in-memory indexes now rather than on first use"""
+        for index in self._indexes():
+            index.load()
+
+    def clear(self):
+        for index in self._indexes():
+            index.clear()
+
+    def drugs_by_names(self, drug_names):
+        """{name: drug} for the names, generic names, brand names and synonyms the name index resolves"""
+        drug_ids = {name: self.names.lookup(name, 'drug') for name in set(drug_names) if isinstance(name, str)}
+        drug_ids = {name: ids[0] for name, ids in drug_ids.items() if ids}
+        if not drug_ids:
+            return {}
+        drugs = self.drugs_by_ids(set(drug_ids.values()))
+        return {name: drugs[drug_id] for name, drug_id in drug_ids.items() if drug_id in drugs}
+
+    def drugs_by_rxcuis(self, rxcui_list):
+        """{rxcui: drug} for the RxCUIs the crosswalk resolves"""
+        drug_ids = {rxcui: self.rxcuis.drug(rxcui) for rxcui in set(rxcui_list)}
+        drug_ids = {rxcui: drug_id for rxcui, drug_id in drug_ids.items() if drug_id is not None}
+        if not drug_ids:
+            return {}
+        drugs = self.drugs_by_ids(set(drug_ids.values()))
+        return {rxcui: drugs[drug_id] for rxcui, drug_id in drug_ids.items() if drug_id in drugs}
+
+    def drugs_by_ndcs(self, ndcs):
+        """{ndc: drug} for the NDCs, in any spelling, that identify exactly one drug"""
+        forms = {code: ndc.canonical_forms(code) for code in set(ndcs)}
+        canonical = sorted({form for code_forms in forms.values() for form in code_forms})
+        if not canonical:
+            return {}
+        found = self.ndc_drug_ids(canonical)
+        drugs = self.drugs_by_ids(set(found.values()))
+        result = {}
+        for code, code_forms in forms.items():
+            matches = {found[form] for form in code_forms if form in found}
+            if len(matches) == 1:
+                result[code] = drugs[matches.pop()]
+        return result
+
+    def allergy_ids(self, allergy_names):
+        """Ids of the allergies known by the names or their synonyms, in id order"""
+        return sorted({i for name in allergy_names for i in self.names.lookup(name, 'allergy')})
+
+    def condition_ids(self, condition_names):
+        """Ids of the conditions known by the names or their synonyms, in id order"""
+        return sorted({i for name in condition_names for i in self.names.lookup(name, 'condition')})
+
+    def parse_allergy_text(self, text):
+        """(resolved, unmatched): the allergies a free-text list names, and the fragments naming none"""
+        return self.allergy_parser.parse(text)
+
+    def search_labels(self, query, kind=None, after=None, limit=20):
+        """Up to limit + 1 label sections matching an FTS5 query, best first past the keyset position after"""
+        filters = ''
+        params = [query]
+        if kind:
+            filters += ' AND kind = ?'
+            params.append(kind)
+        if after:
+            filters += ' AND (rank > ? OR (rank = ? AND rowid > ?))'
+            params += [after[0], after[0], after[1]]
+
+        # Ranked matches (bm25, best first), then the drug, condition and snippet of
+        # each; snippets are built for the page only, not for every match
+        conn = self.connect()
+        try:
+            matches = conn.execute(f'''
+                SELECT m.*, d.name AS drug_name, d.rxcui, c.name AS condition_name,
+                       (SELECT snippet(label_fts, 0, '<mark>', '</mark>', '…', 16)
+                        FROM label_fts WHERE label_fts MATCH ?1 AND rowid = m.id) AS snippet
+                FROM (
+                    SELECT rowid AS id, kind, drug_id, rank
+                    FROM label_fts
+                    WHERE label_fts MATCH ?1{filters}
+                    ORDER BY rank, rowid
+                    LIMIT ?
+                ) m
+                LEFT JOIN drugs d ON d.id = m.drug_id
+                LEFT JOIN drug_contraindications dc ON m.id % 2 = 1 AND dc.id = m.id / 2
+                LEFT JOIN conditions c ON c.id = dc.condition_id
+                ORDER BY m.rank, m.id
+            ''', params + [limit + 1]).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ValueError(f'not a valid search query: {e}')
+        finally:
+            conn.close()
+        return [dict(m) for m in matches]
+
+
+class SqliteStorage(Storage):
+    """The knowledge base read with SQL on every call"""
+
+    def drugs_by_ids(self, drug_ids):
+        """{id: drug} for the drug ids, read in one statement"""
+        conn = self.connect()
+        drugs = {d['id']: dict(d) for d in conn.execute('''
+            SELECT * FROM drugs WHERE id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(sorted(drug_ids)),))}
+        conn.close()
+        return drugs
+
+    def ndc_drug_ids(self, canonical):
+        """{ndc: drug id} for the canonical NDCs that are indexed"""
+        # All codes in one statement, passed as a JSON array, each an index probe
+        conn = self.connect()
+        codes = conn.execute('''
+            SELECT ndc, drug_id FROM ndc_codes
+            WHERE ndc IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(canonical),)).fetchall()
+        conn.close()
+        return {c['ndc']: c['drug_id'] for c in codes}
+
+    def drug_ingredients(self, drug_id):
+        """Get all ingredients for a drug"""
+        conn = self.connect()
+        ingredients = conn.execute('''
+            SELECT i.*, di.is_active
+            FROM ingredients i
+            JOIN drug_ingredients di ON i.id = di.ingredient_id
+            WHERE di.drug_id = ?
+            ORDER BY di.id
+        ''', (drug_id,)).fetchall()
+        conn.close()
+        return [dict(i) for i in ingredients]
+
+    def drug_contraindications(self, drug_id):
+        """Get all contraindications for a drug"""
+        conn = self.connect()
+        contraindications = conn.execute('''
+            SELECT dc.*, c.name as condition_name, c.normalized_name as condition_normalized_name
+            FROM drug_contraindications dc
+            LEFT JOIN conditions c ON dc.condition_id = c.id
+            WHERE dc.drug_id = ?
+            ORDER BY dc.id
+        ''', (drug_id,)).fetchall()
+        conn.close()
+        return [dict(c) for c in contraindications]
+
+    def drug_warnings(self, drug_id):
+        """Get all warnings for a drug"""
+        conn = self.connect()
+        warnings = conn.execute('SELECT * FROM drug_warnings WHERE drug_id = ? ORDER BY id', (drug_id,)).fetchall()
+        conn.close()
+        return [dict(w) for w in warnings]
+
+    def brand_names(self, drug_id):
+        """The brand names of a drug"""
+        conn = self.connect()
+        brand_names = conn.execute('SELECT name FROM brand_names WHERE drug_id = ? ORDER BY id', (drug_id,)).fetchall()
+        conn.close()
+        return [b['name'] for b in brand_names]
+
+    def allergy_contraindications(self, drug_id, allergy_ids, include_cross_reactivity=True, include_evidence=True):
+        """Check if a drug is contraindicated for given allergies"""
+        if not allergy_ids:
+            return []
+
+        conn = self.connect()
+
+        # Get all ingredients for the drug
+        drug_ingredients = conn.execute('''
+            SELECT i.id, i.name, di.is_active
+            FROM ingredients i
+            JOIN drug_ingredients di ON i.id = di.ingredient_id
+            WHERE di.drug_id = ?
+            ORDER BY di.id
+        ''', (drug_id,)).fetchall()
+
+        contraindications = []
+        matched = set()
+
+        # Check direct ingredient matches
+        for allergy_id in allergy_ids:
+            # Get ingredients related to this allergy
+            allergy_ingredients = conn.execute('''
+                SELECT i.id, i.name, ai.relationship, ai.evidence_level, a.name as allergy_name
+                FROM ingredients i
+                JOIN allergy_ingredients ai ON i.id = ai.ingredient_id
+                JOIN allergies a ON ai.allergy_id = a.id
+                WHERE ai.allergy_id = ?
+            ''', (allergy_id,)).fetchall()
+
+            # Check if any drug ingredient matches allergy ingredients
+            for drug_ing in drug_ingredients:
+                for allergy_ing in allergy_ingredients:
+                    if drug_ing['id'] == allergy_ing['id']:
+                        matched.add((allergy_id, drug_ing['id']))
+                        contraindications.append(direct_contraindication(
+                            allergy_ing['allergy_name'], allergy_ing['name'], drug_ing['is_active'],
+                            allergy_ing['relationship'], allergy_ing['evidence_level'], include_evidence))
+
+        # Check class allergies: a drug ingredient is covered when one of its
+        # classes falls in the tree interval of one of the allergy's classes
+        if drug_ingredients:
+            class_matches = conn.execute('''
+                SELECT ic.ingredient_id, ac.allergy_id, a.name AS allergy_name,
+                       c.code, c.name AS class_name, ac.evidence_level
+                FROM ingredient_classes ic
+                JOIN drug_classes m ON m.id = ic.class_id
+                JOIN allergy_classes ac ON ac.allergy_id IN ({})
+                JOIN drug_classes c ON c.id = ac.class_id
+                JOIN allergies a ON a.id = ac.allergy_id
+                WHERE ic.ingredient_id IN ({}) AND m.tree_left BETWEEN c.tree_left AND c.tree_right
+                ORDER BY ac.allergy_id, c.tree_left
+            '''.format(','.join(['?'] * len(allergy_ids)), ','.join(['?'] * len(drug_ingredients))),
+            allergy_ids + [d['id'] for d in drug_ingredients]).fetchall()
+
+            for drug_ing in drug_ingredients:
+                for match in class_matches:
+                    if match['ingredient_id'] != drug_ing['id'] or (match['allergy_id'], drug_ing['id']) in matched:
+                        continue
+                    matched.add((match['allergy_id'], drug_ing['id']))
+                    contraindications.append(class_contraindication(
+                        match['allergy_name'], drug_ing['name'], drug_ing['is_active'],
+                        match['code'], match['class_name'], match['evidence_level'], include_evidence))
+
+        # Check cross-reactivity if enabled: one lookup per allergy and drug ingredient
+        if include_cross_reactivity:
+            allergy_names = dict(conn.execute('''
+                SELECT id, name FROM allergies WHERE id IN ({})
+            '''.format(','.join(['?'] * len(allergy_ids))), allergy_ids).fetchall())
+
+            for drug_ing in drug_ingredients:
+                for allergy_id in sorted(allergy_names):
+                    reaction = self.cross_reactions.lookup(allergy_id, drug_ing['id'])
+                    if reaction:
+                        contraindications.append(cross_contraindication(
+                            allergy_names[allergy_id], drug_ing['name'], reaction, include_evidence))
+
+        conn.close()
+        return contraindications
+
+    def condition_contraindications(self, drug_id, condition_ids, include_evidence=True):
+        """Check if a drug is contraindicated for given conditions"""
+        if not condition_ids:
+            return []
+
+        conn = self.connect()
+
+        placeholders = ', '.join(['?'] * len(condition_ids))
+        contraindications = conn.execute(f'''
+            SELECT dc.*, c.name as condition_name
+            FROM drug_contraindications dc
+            JOIN conditions c ON dc.condition_id = c.id
+            WHERE dc.drug_id = ? AND dc.condition_id IN ({placeholders})
+            ORDER BY dc.id
+        ''', [drug_id] + condition_ids).fetchall()
+
+        conn.close()
+
+        return [condition_contraindication(c['condition_name'], c['evidence_level'], c['description'], c['source'],
+                                           include_evidence) for c in contraindications]
+
+    def verdict(self, drug_id, allergy_ids, condition_ids, include_cross_reactivity=True):
+        """The highest contraindication severity for a drug, or None, in a single query"""
+        if not allergy_ids and not condition_ids:
+            return None
+
+        allergies = ', '.join(['?'] * len(allergy_ids)) or 'NULL'
+        conditions = ', '.join(['?'] * len(condition_ids)) or 'NULL'
+        # Ranks follow the severities allergy_contraindications and
+        # condition_contraindications assign
+        queries = [f'''
+            SELECT CASE WHEN di.is_active THEN 3 ELSE 2 END AS rank
+            FROM drug_ingredients di
+            JOIN allergy_ingredients ai ON ai.ingredient_id = di.ingredient_id
+            WHERE di.drug_id = ? AND ai.allergy_id IN ({allergies})
+        ''', f'''
+            SELECT CASE WHEN di.is_active THEN 3 ELSE 2 END
+            FROM drug_ingredients di
+            JOIN ingredient_classes ic ON ic.ingredient_id = di.ingredient_id
+            JOIN drug_classes m ON m.id = ic.class_id
+            JOIN allergy_classes ac ON ac.allergy_id IN ({allergies})
+            JOIN drug_classes c ON c.id = ac.class_id
+            WHERE di.drug_id = ? AND m.tree_left BETWEEN c.tree_left AND c.tree_right
+        ''', f'''
+            SELECT CASE dc.evidence_level WHEN 'high' THEN 3 WHEN 'medium' THEN 2 WHEN 'low' THEN 1 ELSE 0 END
+            FROM drug_contraindications dc
+            WHERE dc.drug_id = ? AND dc.condition_id IN ({conditions})
+        ''']
+        params = [drug_id] + allergy_ids + allergy_ids + [drug_id] + [drug_id] + condition_ids
+
+        conn = self.connect()
+        rank = conn.execute(f"SELECT MAX(rank) FROM ({' UNION ALL '.join(queries)})", params).fetchone()[0] or 0
+        if include_cross_reactivity and allergy_ids and rank < 2:
+            # Cross-reactions are medium at most: only look them up if they could raise the verdict
+            ingredient_ids = conn.execute('''
+                SELECT di.ingredient_id FROM drug_ingredients di WHERE di.drug_id = ?
+            ''', (drug_id,)).fetchall()
+            for (ingredient_id,) in ingredient_ids:
+                for allergy_id in allergy_ids:
+                    reaction = self.cross_reactions.lookup(allergy_id, ingredient_id)
+                    if reaction:
+                        rank = max(rank, cross_reaction_rank(reaction))
+        conn.close()
+        return SEVERITIES[rank]
+
+    def allergy(self, allergy_id):
+        """The allergy with its classes in code order, or None"""
+        conn = self.connect()
+        allergy = conn.execute('SELECT * FROM allergies WHERE id = ?', (allergy_id,)).fetchone()
+        classes = conn.execute('''
+            SELECT c.code, c.name
+            FROM allergy_classes ac
+            JOIN drug_classes c ON c.id = ac.class_id
+            WHERE ac.allergy_id = ?
+            ORDER BY c.code
+        ''', (allergy_id,)).fetchall()
+        conn.close()
+        if allergy is None:
+            return None
+        allergy = dict(allergy)
+        allergy['classes'] = [dict(c) for c in classes]
+        return allergy
+
+    def _page(self, query, allergy_id, after, limit):
+        if after is None:
+            return [], None
+        conn = self.connect()
+        rows = conn.execute(query, (allergy_id, after, limit + 1)).fetchall()
+        conn.close()
+        return page([dict(r) for r in rows], limit)
+
+    def related_ingredients(self, allergy_id, after, limit):
+        """(page, next position) of the ingredients an allergy covers, by ingredient id"""
+        return self._page(ALLERGY_INGREDIENTS_PAGE, allergy_id, after, limit)
+
+    def related_drugs(self, allergy_id, after, limit):
+        """(page, next position) of the drugs with an ingredient an allergy covers, by drug id"""
+        return self._page(ALLERGY_DRUGS_PAGE, allergy_id, after, limit)
+
+    def related_cross_reactivity(self, allergy_id, after, limit):
+        """(page, next position) of the cross-reactivity rows from an allergy's ingredients, by row id"""
+        return self._page(ALLERGY_CROSS_REACTIVITY_PAGE, allergy_id, after, limit)
+
+    def allergy_totals(self, allergy_id):
+        """The lengths of an allergy's related lists, or None"""
+        conn = self.connect()
+        totals = conn.execute('''
+            SELECT ingredient_count, drug_count, cross_reactivity_count
+            FROM allergy_stats WHERE allergy_id = ?
+        ''', (allergy_id,)).fetchone()
+        conn.close()
+        return dict(totals) if totals else None
+
+    def catalog_matches(self, key, entity_type, limit):
+        """Up to limit exact, prefix and token matches each of a search key, best first, with their drugs"""
+        # Every key starting with the query sorts between key and end
+        params = {'key': key, 'end': key + '\U0010ffff', 'type': entity_type, 'limit': limit}
+        type_filter = ' AND entity_type = :type' if entity_type else ''
+
+        # Each match kind is one range of the index, read in key order up to limit
+        conn = self.connect()
+        hits = conn.execute(f'''
+            SELECT m.*, d.name AS drug_name, d.rxcui
+            FROM (
+                SELECT * FROM (
+                    SELECT 0 AS match, * FROM search_index
+                    WHERE whole = 1 AND key = :key{type_filter}
+                    ORDER BY key, entity_type, entity_id LIMIT :limit
+                )
+                UNION ALL
+                SELECT * FROM (
+                    SELECT 1 AS match, * FROM search_index
+                    WHERE whole = 1 AND key > :key AND key < :end{type_filter}
+                    ORDER BY key, entity_type, entity_id LIMIT :limit
+                )
+                UNION ALL
+                SELECT * FROM (
+                    SELECT 2 AS match, * FROM search_index
+                    WHERE whole = 0 AND key >= :key AND key < :end{type_filter}
+                    ORDER BY key, entity_type, entity_id LIMIT :limit
+                )
+            ) m
+            LEFT JOIN drugs d ON d.id = m.drug_id
+            ORDER BY m.match, m.key, m.entity_type, m.entity_id
+        ''', params).fetchall()
+        conn.close()
+        return [dict(h) for h in hits]
+
+    def catalog_facets(self, key):
+        """{entity type: count} of the entities with a name or word starting with a search key"""
+        conn = self.connect()
+        if len(key) <= CATALOG_FACET_PREFIX:
+            facets = conn.execute('SELECT entity_type, count FROM search_facets WHERE prefix = ?', (key,)).fetchall()
+        else:
+            facets = conn.execute('''
+                SELECT entity_type, COUNT(DISTINCT entity_id) FROM search_index
+                WHERE whole IN (0, 1) AND key >= ? AND key < ?
+                GROUP BY entity_type
+            ''', (key, key + '\U0010ffff')).fetchall()
+        conn.close()
+        return dict(facets)
+
+
+class MemoryStorage(Storage):
+    """The knowledge base read once into dicts, rebuilt when its version changes"""
+
+    def __init__(self, connect, version_fn, max_depth=3, check_interval=60.0):
+        super().__init__(connect, version_fn, max_depth)
+        self._tables = versioned.VersionedCache(self._load, version_fn, check_interval)
+
+    def _load(self):
+        conn = self.connect()
+        drugs = {d['id']: dict(d) for d in conn.execute('SELECT * FROM drugs')}
+        ingredients = {}
+        for row in conn.execute('''
+            SELECT i.*, di.is_active, di.drug_id AS _drug_id
+            FROM drug_ingredients di
+            JOIN ingredients i ON i.id = di.ingredient_id
+            ORDER BY di.id
+        '''):
+            ingredient = dict(row)
+            ingredients.setdefault(ingredient.pop('_drug_id'), []).append(ingredient)
+        contraindications = {}
+        for row in conn.execute('''
+            SELECT dc.*, c.name as condition_name, c.normalized_name as condition_normalized_name
+            FROM drug_contraindications dc
+            LEFT JOIN conditions c ON dc.condition_id = c.id
+            ORDER BY dc.id
+        '''):
+            contraindications.setdefault(row['drug_id'], []).append(dict(row))
+        warnings = {}
+        for row in conn.execute('SELECT * FROM drug_warnings ORDER BY id'):
+            warnings.setdefault(row['drug_id'], []).append(dict(row))
+        brand_names = {}
+        for drug_id, name in conn.execute('SELECT drug_id, name FROM brand_names ORDER BY id'):
+            brand_names.setdefault(drug_id, []).append(name)
+        ndc_codes = dict(conn.execute('SELECT ndc, drug_id FROM ndc_codes').fetchall())
+
+        allergies = {a['id']: dict(a) for a in conn.execute('SELECT * FROM allergies')}
+        allergy_names = {allergy_id: a['name'] for allergy_id, a in allergies.items()}
+        allergy_ingredients = {}
+        for allergy_id, ingredient_id, relationship, evidence_level in conn.execute('''
+            SELECT allergy_id, ingredient_id, relationship, evidence_level FROM allergy_ingredients
+        '''):
+            allergy_ingredients.setdefault(allergy_id, {})[ingredient_id] = (relationship, evidence_level)
+        # Each allergy's classes as tree intervals, in tree order, and each ingredient's class positions
+        allergy_classes = {}
+        for row in conn.execute('''
+            SELECT ac.allergy_id, c.tree_left, c.tree_right, c.code, c.name, ac.evidence_level
+            FROM allergy_classes ac
+            JOIN drug_classes c ON c.id = ac.class_id
+            ORDER BY ac.allergy_id, c.tree_left
+        '''):
+            allergy_classes.setdefault(row[0], []).append(tuple(row[1:]))
+        ingredient_classes = {}
+        for ingredient_id, tree_left in conn.execute('''
+            SELECT ic.ingredient_id, m.tree_left
+            FROM ingredient_classes ic
+            JOIN drug_classes m ON m.id = ic.class_id
+        '''):
+            ingredient_classes.setdefault(ingredient_id, []).append(tree_left)
+
+        # The related lists of each allergy in keyset order, with the columns of the page queries, and their totals
+        related_ingredients = _keyed(conn.execute('''
+            SELECT ai.allergy_id, i.name, i.rxcui, ai.relationship, ai.ingredient_id AS page_key
+            FROM allergy_members ai
+            JOIN ingredients i ON i.id = ai.ingredient_id
+            ORDER BY ai.allergy_id, ai.ingredient_id
+        '''))
+        related_drugs = _keyed(conn.execute('''
+            SELECT ad.allergy_id, d.name, d.rxcui, ad.relationship, ad.drug_id AS page_key
+            FROM allergy_drugs ad
+            JOIN drugs d ON d.id = ad.drug_id
+            ORDER BY ad.allergy_id, ad.drug_id
+        '''))
+        related_cross_reactivity = _keyed(conn.execute('''
+            SELECT acr.allergy_id, cr.evidence_level, cr.description, i.name AS target_name,
+                   acr.cross_reactivity_id AS page_key
+            FROM allergy_cross_reactivity acr
+            JOIN cross_reactivity cr ON cr.id = acr.cross_reactivity_id
+            JOIN ingredients i ON i.id = cr.target_id
+            ORDER BY acr.allergy_id, acr.cross_reactivity_id
+        '''))
+        allergy_totals = {row['allergy_id']: dict(row) for row in conn.execute('''
+            SELECT allergy_id, ingredient_count, drug_count, cross_reactivity_count FROM allergy_stats
+        ''')}
+        for totals in allergy_totals.values():
+            del totals['allergy_id']
+
+        # The catalog search index in key order, whole names and later words
+        # apart, each also split by entity type for type-filtered searches
+        search = {}
+        for row in conn.execute('''
+            SELECT s.*, d.name AS drug_name, d.rxcui
+            FROM search_index s
+            LEFT JOIN drugs d ON d.id = s.drug_id
+            ORDER BY s.whole, s.key, s.entity_type, s.entity_id
+        '''):
+            entry = dict(row)
+            for entity_type in (None, entry['entity_type']):
+                keys, entries = search.setdefault((entry['whole'], entity_type), ([], []))
+                keys.append(entry['key'])
+                entries.append(entry)
+        search_facets = {}
+        for prefix, entity_type, count in conn.execute('SELECT prefix, entity_type, count FROM search_facets'):
+            search_facets.setdefault(prefix, {})[entity_type] = count
+        conn.close()
+
+        return {
+            'drugs': drugs,
+            'ingredients': ingredients,
+            'contraindications': contraindications,
+            'warnings': warnings,
+            'brand_names': brand_names,
+            'ndc_codes': ndc_codes,
+            'allergies': allergies,
+            'allergy_names': allergy_names,
+            'allergy_ingredients': allergy_ingredients,
+            'allergy_classes': allergy_classes,
+            'ingredient_classes': ingredient_classes,
+            'related_ingredients': related_ingredients,
+            'related_drugs': related_drugs,
+            'related_cross_reactivity': related_cross_reactivity,
+            'allergy_totals': allergy_totals,
+            'search': search,
+            'search_facets': search_facets,
+        }
+
+    def load(self):
+        """Read the tables and build the in-memory indexes now rather than on first use"""
+        super().load()
+        self._tables.get()
+
+    def clear(self):
+        super().clear()
+        self._tables.clear()
+
+    def drugs_by_ids(self, drug_ids):
+        """{id: drug} for the drug ids"""
+        drugs = self._tables.get()['drugs']
+        return {drug_id: dict(drugs[drug_id]) for drug_id in drug_ids if drug_id in drugs}
+
+    def ndc_drug_ids(self, canonical):
+        """{ndc: drug id} for the canonical NDCs that are indexed"""
+        codes = self._tables.get()['ndc_codes']
+        return {code: codes[code] for code in canonical if code in codes}
+
+    def drug_ingredients(self, drug_id):
+        """Get all ingredients for a drug"""
+        return [dict(i) for i in self._tables.get()['ingredients'].get(drug_id, ())]
+
+    def drug_contraindications(self, drug_id):
+        """Get all contraindications for a drug"""
+        return [dict(c) for c in self._tables.get()['contraindications'].get(drug_id, ())]
+
+    def drug_warnings(self, drug_id):
+        """Get all warnings for a drug"""
+        return [dict(w) for w in self._tables.get()['warnings'].get(drug_id, ())]
+
+    def brand_names(self, drug_id):
+        """The brand names of a drug"""
+        return list(self._tables.get()['brand_names'].get(drug_id, ()))
+
+    def _covering_class(self, tables, allergy_id, ingredient_id):
+        """The first of an allergy's classes, in tree order, that one of the ingredient's classes falls under"""
+        positions = tables['ingredient_classes'].get(ingredient_id, ())
+        for allergy_class in tables['allergy_classes'].get(allergy_id, ()):
+            if any(allergy_class[0] <= position <= allergy_class[1] for position in positions):
+                return allergy_class
+        return None
+
+    def allergy_contraindications(self, drug_id, allergy_ids, include_cross_reactivity=True, include_evidence=True):
+        """Check if a drug is contraindicated for given allergies"""
+        if not allergy_ids:
+            return []
+        tables = self._tables.get()
+        allergy_names = tables['allergy_names']
+        drug_ingredients = tables['ingredients'].get(drug_id, ())
+
+        contraindications = []
+        matched = set()
+
+        for allergy_id in allergy_ids:
+            if allergy_id not in allergy_names:
+                continue
+            links = tables['allergy_ingredients'].get(allergy_id, {})
+            for ingredient in drug_ingredients:
+                if ingredient['id'] in links:
+                    matched.add((allergy_id, ingredient['id']))
+                    relationship, evidence_level = links[ingredient['id']]
+                    contraindications.append(direct_contraindication(
+                        allergy_names[allergy_id], ingredient['name'], ingredient['is_active'],
+                        relationship, evidence_level, include_evidence))
+
+        known = sorted({allergy_id for allergy_id in allergy_ids if allergy_id in allergy_names})
+        for ingredient in drug_ingredients:
+            for allergy_id in known:
+                if (allergy_id, ingredient['id']) in matched:
+                    continue
+                allergy_class = self._covering_class(tables, allergy_id, ingredient['id'])
+                if allergy_class is None:
+                    continue
+                matched.add((allergy_id, ingredient['id']))
+                _, _, code, class_name, evidence_level = allergy_class
+                contraindications.append(class_contraindication(
+                    allergy_names[allergy_id], ingredient['name'], ingredient['is_active'],
+                    code, class_name, evidence_level, include_evidence))
+
+        if include_cross_reactivity:
+            for ingredient in drug_ingredients:
+                for allergy_id in known:
+                    reaction = self.cross_reactions.lookup(allergy_id, ingredient['id'])
+                    if reaction:
+                        contraindications.append(cross_contraindication(
+                            allergy_names[allergy_id], ingredient['name'], reaction, include_evidence))
+        return contraindications
+
+    def condition_contraindications(self, drug_id, condition_ids, include_evidence=True):
+        """Check if a drug is contraindicated for given conditions"""
+        if not condition_ids:
+            return []
+        wanted = set(condition_ids)
+        return [condition_contraindication(c['condition_name'], c['evidence_level'], c['description'], c['source'],
+                                           include_evidence)
+                for c in self._tables.get()['contraindications'].get(drug_id, ())
+                if c['condition_id'] in wanted and c['condition_name'] is not None]
+
+    def verdict(self, drug_id, allergy_ids, condition_ids, include_cross_reactivity=True):
+        """The highest contraindication severity for a drug, or None"""
+        if not allergy_ids and not condition_ids:
+            return None
+        tables = self._tables.get()
+        ingredients = tables['ingredients'].get(drug_id, ())
+
+        rank = 0
+        for ingredient in ingredients:
+            for allergy_id in allergy_ids:
+                if (ingredient['id'] in tables['allergy_ingredients'].get(allergy_id, ())
+                        or self._covering_class(tables, allergy_id, ingredient['id'])):
+                    rank = max(rank, 3 if ingredient['is_active'] else 2)
+        wanted = set(condition_ids)
+        for c in tables['contraindications'].get(drug_id, ()):
+            if c['condition_id'] in wanted:
+                rank = max(rank, EVIDENCE_RANKS.get(c['evidence_level'], 0))
+        if include_cross_reactivity and allergy_ids and rank < 2:
+            # Cross-reactions are medium at most: only look them up if they could raise the verdict
+            for ingredient in ingredients:
+                for allergy_id in allergy_ids:
+                    reaction = self.cross_reactions.lookup(allergy_id, ingredient['id'])
+                    if reaction:
+                        rank = max(rank, cross_reaction_rank(reaction))
+        return SEVERITIES[rank]
+
+    def allergy(self, allergy_id):
+        """The allergy with its classes in code order, or None"""
+        tables = self._tables.get()
+        if allergy_id not in tables['allergies']:
+            return None
+        allergy = dict(tables['allergies'][allergy_id])
+        classes = sorted(tables['allergy_classes'].get(allergy_id, ()), key=lambda c: c[2])
+        allergy['classes'] = [{'code': code, 'name': name} for _, _, code, name, _ in classes]
+        return allergy
+
+    def _page(self, name, allergy_id, after, limit):
+        if after is None:
+            return [], None
+        keys, rows = self._tables.get()[name].get(allergy_id, ((), ()))
+        start = bisect.bisect_right(keys, after)
+        return page([dict(r) for r in rows[start:start + limit + 1]], limit)
+
+    def related_ingredients(self, allergy_id, after, limit):
+        """(page, next position) of the ingredients an allergy covers, by ingredient id"""
+        return self._page('related_ingredients', allergy_id, after, limit)
+
+    def related_drugs(self, allergy_id, after, limit):
+        """(page, next position) of the drugs with an ingredient an allergy covers, by drug id"""
+        return self._page('related_drugs', allergy_id, after, limit)
+
+    def related_cross_reactivity(self, allergy_id, after, limit):
+        """(page, next position) of the cross-reactivity rows from an allergy's ingredients, by row id"""
+        return self._page('related_cross_reactivity', allergy_id, after, limit)
+
+    def allergy_totals(self, allergy_id):
+        """The lengths of an allergy's related lists, or None"""
+        totals = self._tables.get()['allergy_totals'].get(allergy_id)
+        return dict(totals) if totals else None
+
+    def catalog_matches(self, key, entity_type, limit):
+        """Up to limit exact, prefix and token matches each of a search key, best first, with their drugs"""
+        search = self._tables.get()['search']
+        end = key + '\U0010ffff'
+        # Exact is the whole names equal to key, prefix the whole names after
+        # it up to end, token the later words from key up to end
+        keys, entries = search.get((1, entity_type), ((), ()))
+        exact = bisect.bisect_left(keys, key)
+        prefix = bisect.bisect_right(keys, key)
+        ranges = [(0, entries, exact, prefix), (1, entries, prefix, bisect.bisect_left(keys, end))]
+        keys, entries = search.get((0, entity_type), ((), ()))
+        ranges.append((2, entries, bisect.bisect_left(keys, key), bisect.bisect_left(keys, end)))
+        hits = []
+        for match, entries, start, stop in ranges:
+            hits += [dict(entry, match=match) for entry in entries[start:min(stop, start + limit)]]
+        return hits
+
+    def catalog_facets(self, key):
+        """{entity type: count} of the entities with a name or word starting with a search key"""
+        tables = self._tables.get()
+        if len(key) <= CATALOG_FACET_PREFIX:
+            return dict(tables['search_facets'].get(key, {}))
+        end = key + '\U0010ffff'
+        entities = set()
+        for whole in (1, 0):
+            keys, entries = tables['search'].get((whole, None), ((), ()))
+            for entry in entries[bisect.bisect_left(keys, key):bisect.bisect_left(keys, end)]:
+                entities.add((entry['entity_type'], entry['entity_id']))
+        facets = {}
+        for entity_type, _ in entities:
+            facets[entity_type] = facets.get(entity_type, 0) + 1
+        return facets
+
+
+BACKENDS = {'sqlite': SqliteStorage, 'memory': MemoryStorage}
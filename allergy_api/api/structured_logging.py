@@ -0,0 +1,276 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, request
+
+# Structured JSON logging that never blocks a request thread. Records are
+# redacted and sampled in the calling thread, pushed onto a bounded queue
+# without being formatted, and formatted/written by a background listener.
+# When the queue is full the record is dropped and counted instead of waiting.
+
+# Keys whose values may carry patient information; they are scrubbed from the
+# structured fields before the record leaves the calling thread.
+PHI_FIELDS = frozenset({
+    'patient', 'allergies', 'allergy_names', 'allergy_ids', 'conditions',
+    'condition_names', 'condition_ids', 'body', 'data', 'payload'
+})
+REDACTED = '[REDACTED]'
+
+# Request options that request summaries carry, as booleans; anything else a
+# client puts in options is left out
+REQUEST_OPTIONS = ('include_inactive_ingredients', 'include_cross_reactivity', 'include_evidence', 'verdict_only')
+
+_RESERVED = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+_listener = None
+_handler = None
+_handlers = ()
+_queue_size = 10000
+
+
+class JsonFormatter(logging.Formatter):
+    """Render a record as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and key != 'fields':
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RedactingFilter(logging.Filter):
+    """Replace PHI-bearing structured fields with a redaction marker"""
+
+    def filter(self, record):
+        fields = getattr(record, 'fields', None)
+        if fields:
+            record.fields = {
+                key: (_redact(value) if key in PHI_FIELDS else value)
+                for key, value in fields.items()
+            }
+        for key in PHI_FIELDS.intersection(record.__dict__):
+            setattr(record, key, _redact(getattr(record, key)))
+        return True
+
+
+def _redact(value):
+    # keep the shape useful for debugging without keeping the content
+    if isinstance(value, (list, tuple, dict)):
+        return f'{REDACTED} ({len(value)} items)'
+    return REDACTED
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of records below WARNING, per logger name prefix"""
+
+    def __init__(self, rates):
+        super().__init__()
+        # longest prefix first so 'allergy_api.db' wins over 'allergy_api'
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def rate_for(self, name):
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + '.'):
+                return rate
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that defers formatting and drops records when full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The listener lives in this process, so the record does not need to be
+        # pickled; formatting is left to the listener thread.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def summarize_request(data):
+    """Shape of a check/batch request body, without any patient content"""
+    if not isinstance(data, dict):
+        return {'valid_body': False}
+    patient = data.get('patient') or {}
+    options = data.get('options')
+    if not isinstance(options, dict):
+        options = {}
+    summary = {
+        'allergy_count': len(patient.get('allergies') or []),
+        'condition_count': len(patient.get('conditions') or []),
+        'options': {key: bool(options[key]) for key in REQUEST_OPTIONS if key in options}
+    }
+    if isinstance(data.get('drug'), dict):
+        summary['drug'] = data['drug'].get('name')
+    if isinstance(data.get('drugs'), list):
+        summary['drug_count'] = len(data['drugs'])
+    return summary
+
+
+def parse_sampling(spec):
+    """Parse 'logger=rate,logger=rate' into a dict"""
+    rates = {}
+    for item in (spec or '').split(','):
+        if '=' in item:
+            name, rate = item.split('=', 1)
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+def configure(level='INFO', log_file=None, sampling=None, queue_size=10000, stream=sys.stderr):
+    """Install the queue-backed JSON pipeline on the root logger"""
+    global _listener, _handler, _handlers, _queue_size
+    if _listener is not None:
+        return _handler
+
+    formatter = JsonFormatter()
+    handlers = []
+    if stream is not None:
+        stream_handler = logging.StreamHandler(stream)
+        stream_handler.setFormatter(formatter)
+        handlers.append(stream_handler)
+    if log_file:
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    _handler = NonBlockingQueueHandler(log_queue)
+    _handler.addFilter(RedactingFilter())
+    if sampling:
+        _handler.addFilter(SamplingFilter(sampling))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_handler)
+    root.setLevel(level)
+
+    _handlers = tuple(handlers)
+    _queue_size = queue_size
+    _listener = QueueListener(log_queue, *_handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown)
+    return _handler
+
+
+def _restart_after_fork():
+    # Listener threads do not survive fork (e.g. gunicorn --preload), and the
+    # parent's queues may have been locked mid-operation; start afresh.
+    global _listener
+    if _listener is not None:
+        log_queue = queue.Queue(maxsize=_queue_size)
+        _handler.queue = log_queue
+        _listener = QueueListener(log_queue, *_handlers, respect_handler_level=True)
+        _listener.start()
+    for entry in _file_listeners:
+        handler, listener = entry
+        handler.queue = queue.Queue(maxsize=listener.queue.maxsize)
+        entry[1] = QueueListener(handler.queue, *listener.handlers)
+        entry[1].start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def shutdown():
+    """Drain the queue and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    for _, listener in _file_listeners:
+        listener.stop()
+    _file_listeners.clear()
+
+
+_file_listeners = []
+# {absolute path: logger}
+_file_loggers = {}
+
+
+def file_logger(name, path, queue_size=10000):
+    """A JSON logger named name writing to path, with its own queue and writer thread; one per path"""
+    path = os.path.abspath(path)
+    logger = _file_loggers.get(path)
+    if logger is not None:
+        return logger
+    # not registered under name, so loggers of the same name can write to other files
+    logger = _file_loggers[path] = logging.Logger(name)
+    file_handler = logging.FileHandler(path)
+    file_handler.setFormatter(JsonFormatter())
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(RedactingFilter())
+    logger.addHandler(handler)
+    listener = QueueListener(handler.queue, file_handler)
+    listener.start()
+    _file_listeners.append([handler, listener])
+    atexit.register(shutdown)
+    return logger
+
+
+def configure_from_env():
+    return configure(
+        level=os.environ.get('ALLERGY_API_LOG_LEVEL', 'INFO').upper(),
+        log_file=os.environ.get('ALLERGY_API_LOG_FILE'),
+        sampling=parse_sampling(os.environ.get('ALLERGY_API_LOG_SAMPLING'))
+    )
+
+
+# Access log
+access_logger = logging.getLogger('allergy_api.access')
+
+
+def _before_request():
+    g.access_started = time.perf_counter()
+
+
+def _after_request(response):
+    started = g.get('access_started')
+    if started is not None and access_logger.isEnabledFor(logging.INFO):
+        access_logger.info('request', extra={'fields': {
+            'method': request.method,
+            'route': request.url_rule.rule if request.url_rule is not None else request.path,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 3)
+        }})
+    return response
+
+
+def init_app(app):
+    """Emit one structured access log record per request if ACCESS_LOG is set"""
+    if app.config.get('ACCESS_LOG'):
+        app.before_request(_before_request)
+        app.after_request(_after_request)
@@ -0,0 +1,67 @@
+import re
+import unicodedata
+
+import versioned
+
+# Name lookup. Every name a drug, ingredient, allergy or condition is known
+# by (its name, a drug's generic and brand names, and the synonyms table of
+# abbreviations and other spellings: ASA, PCN, TMP-SMX) is reduced to a key
+# and held in one hash map from (entity type, key) to ids, so resolving a
+# name is one dict lookup. A key is the name casefolded and NFKD-decomposed,
+# with accents dropped and words separated by single spaces: "Penicillin-G"
+# and "penicillin g" share a key, "penicilling" does not, and letters outside
+# ASCII are kept. Where a key names several entities of one type, names come
+# before brand names and brand names before synonyms, then the lowest id.
+# The index is rebuilt when the knowledge base version changes.
+
+ENTITY_TYPES = ('drug', 'ingredient', 'allergy', 'condition')
+
+WORDS = re.compile(r'[^\W_]+')
+
+
+def normalize(name):
+    """The lookup key of a name"""
+    text = unicodedata.normalize('NFKD', name.casefold())
+    return ' '.join(WORDS.findall(''.join(c for c in text if not unicodedata.combining(c))))
+
+
+class NameIndex:
+    """Names, brand names and synonyms to entity ids, rebuilt when the knowledge base version changes"""
+
+    def __init__(self, connect, version_fn, check_interval=60.0):
+        self.connect = connect
+        self._index = versioned.VersionedCache(self._load, version_fn, check_interval)
+
+    def _load(self):
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT 'drug', id, name, 0 FROM drugs
+            UNION ALL SELECT 'drug', id, generic_name, 0 FROM drugs WHERE generic_name IS NOT NULL
+            UNION ALL SELECT 'drug', drug_id, name, 1 FROM brand_names
+            UNION ALL SELECT 'ingredient', id, name, 0 FROM ingredients
+            UNION ALL SELECT 'allergy', id, name, 0 FROM allergies
+            UNION ALL SELECT 'condition', id, name, 0 FROM conditions
+            UNION ALL SELECT entity_type, entity_id, name, 2 FROM synonyms
+        ''').fetchall()
+        conn.close()
+
+        index = {}
+        for entity_type, entity_id, name, tier in sorted(rows, key=lambda r: (r[3], r[1])):
+            ids = index.setdefault((entity_type, normalize(name)), [])
+            if entity_id not in ids:
+                ids.append(entity_id)
+        return {key: tuple(ids) for key, ids in index.items()}
+
+    def lookup(self, name, entity_type):
+        """The ids of the entities of a type known by a name, best first"""
+        index = self._index.get()
+        if not isinstance(name, str):
+            return ()
+        return index.get((entity_type, normalize(name)), ())
+
+    def load(self):
+        """Build the index now rather than on first use"""
+        self._index.get()
+
+    def clear(self):
+        self._index.clear()
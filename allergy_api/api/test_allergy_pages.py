@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import storage
+import test_storage_parity
+
+# Query plans of the /v1/allergy pages: on a generated catalog, each related
+# list must be a range scan of its table's primary key joined by primary key
+# lookups, never a temp B-tree for sorting or grouping, which would mean the
+# whole list is read and sorted on every page.
+
+PAGES = {
+    'allergy_members': storage.ALLERGY_INGREDIENTS_PAGE,
+    'allergy_cross_reactivity': storage.ALLERGY_CROSS_REACTIVITY_PAGE,
+    'allergy_drugs': storage.ALLERGY_DRUGS_PAGE,
+}
+
+def query_plan(conn, query):
+    """The detail lines of EXPLAIN QUERY PLAN for query with sample parameters"""
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, (1, 0, 101))]
+
+def check_plans(database):
+    conn = sqlite3.connect(database)
+    plans = {table: query_plan(conn, query) for table, query in PAGES.items()}
+    conn.close()
+    for table, plan in plans.items():
+        assert not any('TEMP B-TREE' in line for line in plan), (table, plan)
+        # the list table itself is searched by (allergy_id, position), its primary key
+        assert plan[0].startswith('SEARCH') and '(allergy_id=? AND' in plan[0], (table, plan)
+    return plans
+
+def test_allergy_page_plans():
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'allergy_api.db')
+        test_storage_parity.build_database(database)
+        check_plans(database)
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'allergy_api.db')
+        test_storage_parity.build_database(database)
+        for table, plan in check_plans(database).items():
+            print(f'{table}:')
+            for line in plan:
+                print(f'    {line}')
+
+if __name__ == '__main__':
+    main()
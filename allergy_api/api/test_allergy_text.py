@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import allergy_text
+import test_storage_parity
+
+# The free-text allergy parser on a small hand-made knowledge base: splitting
+# into fragments, names, synonyms and ingredients resolved to allergies, the
+# longest of overlapping matches, "no known allergies" phrases, and fragments
+# naming nothing.
+
+CATALOG = '''
+    INSERT INTO allergies (id, name, type) VALUES (1, 'Penicillin', 'class'), (2, 'Sulfonamides', 'class'),
+        (3, 'Latex', 'ingredient'), (4, 'Peanut', 'ingredient'), (5, 'Peanut oil', 'ingredient'),
+        (6, 'Beta-lactams', 'class');
+    INSERT INTO synonyms (entity_type, entity_id, name) VALUES ('allergy', 1, 'PCN'), ('allergy', 2, 'sulfa');
+    INSERT INTO ingredients (id, name) VALUES (1, 'Amoxicillin'), (2, 'Cephalexin');
+    INSERT INTO allergy_ingredients (allergy_id, ingredient_id, relationship, evidence_level)
+        VALUES (1, 1, 'exact', 'high');
+    INSERT INTO drug_classes (id, code, name, parent_id, tree_left, tree_right)
+        VALUES (1, 'J01D', 'Other beta-lactams', NULL, 1, 2), (2, 'J01DB', 'First-generation cephalosporins', 1, 2, 2);
+    INSERT INTO ingredient_classes (ingredient_id, class_id) VALUES (2, 2);
+    INSERT INTO allergy_classes (allergy_id, class_id, evidence_level) VALUES (6, 1, 'high');
+'''
+
+def parse(text):
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'allergy_text.db')
+        conn = sqlite3.connect(database)
+        test_storage_parity.create_schema(conn)
+        conn.executescript(CATALOG)
+        conn.commit()
+        conn.close()
+        parser = allergy_text.AllergyTextParser(lambda: sqlite3.connect(database), lambda: 1)
+        return parser.parse(text)
+
+def resolved(text):
+    return [(a['id'], a['text']) for a in parse(text)[0]]
+
+def test_fragments_and_synonyms():
+    assert parse('PCN - hives; sulfa, latex gloves | \n;;') == ([
+        {'id': 1, 'name': 'Penicillin', 'text': 'PCN'},
+        {'id': 2, 'name': 'Sulfonamides', 'text': 'sulfa'},
+        {'id': 3, 'name': 'Latex', 'text': 'latex'},
+    ], [])
+
+def test_each_allergy_once_with_the_first_text_naming_it():
+    assert resolved('PCN; penicillin; Pénicilline') == [(1, 'PCN')]
+
+def test_ingredients_stand_for_the_allergies_covering_them():
+    assert resolved('amoxicillin (rash)') == [(1, 'amoxicillin')]
+    # Cephalexin is under the Beta-lactams class
+    assert resolved('cephalexin') == [(6, 'cephalexin')]
+
+def test_longest_match_wins():
+    assert resolved('peanut oil') == [(5, 'peanut oil')]
+    assert resolved('peanut butter') == [(4, 'peanut')]
+
+def test_no_allergy_phrases_and_unmatched_fragments():
+    assert parse('NKDA') == ([], [])
+    assert parse('No known drug allergies') == ([], [])
+    assert parse('bee stings; latex') == ([{'id': 3, 'name': 'Latex', 'text': 'latex'}], ['bee stings'])
+    assert parse('') == ([], [])
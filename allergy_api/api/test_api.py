@@ -2,9 +2,17 @@
 
 import requests
 import json
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+import os
 import sys
 
 BASE_URL = "http://localhost:5000"
+# Needed when the server runs with ALLERGY_API_AUTH=1
+API_KEY = os.environ.get("ALLERGY_API_KEY")
+HEADERS = {"X-API-Key": API_KEY} if API_KEY else {}
 
 def test_drug_check():
     """Test the /v1/check endpoint with various scenarios"""
@@ -28,7 +36,7 @@ def test_drug_check():
     }
     
     try:
-        response = requests.post(f"{BASE_URL}/v1/check", json=payload)
+        response = requests.post(f"{BASE_URL}/v1/check", json=payload, headers=HEADERS)
         print(f"Status code: {response.status_code}")
         if response.status_code == 200:
             result = response.json()
@@ -54,7 +62,7 @@ def test_drug_check():
     }
     
     try:
-        response = requests.post(f"{BASE_URL}/v1/check", json=payload)
+        response = requests.post(f"{BASE_URL}/v1/check", json=payload, headers=HEADERS)
         print(f"Status code: {response.status_code}")
         if response.status_code == 200:
             result = response.json()
@@ -80,7 +88,7 @@ def test_drug_check():
     }
     
     try:
-        response = requests.post(f"{BASE_URL}/v1/check", json=payload)
+        response = requests.post(f"{BASE_URL}/v1/check", json=payload, headers=HEADERS)
         print(f"Status code: {response.status_code}")
         if response.status_code == 200:
             result = response.json()
@@ -111,7 +119,7 @@ def test_drug_check():
     }
     
     try:
-        response = requests.post(f"{BASE_URL}/v1/check", json=payload)
+        response = requests.post(f"{BASE_URL}/v1/check", json=payload, headers=HEADERS)
         print(f"Status code: {response.status_code}")
         if response.status_code == 200:
             result = response.json()
@@ -134,7 +142,7 @@ def test_drug_check():
     }
     
     try:
-        response = requests.post(f"{BASE_URL}/v1/check", json=payload)
+        response = requests.post(f"{BASE_URL}/v1/check", json=payload, headers=HEADERS)
         print(f"Status code: {response.status_code}")
         print(f"Response: {response.text}")
     except Exception as e:
@@ -147,7 +155,7 @@ def test_drug_info():
     # Test 1: Get info for a known drug by name
     print("\nTest 1: Get info for Amoxil by name")
     try:
-        response = requests.get(f"{BASE_URL}/v1/drug/Amoxil")
+        response = requests.get(f"{BASE_URL}/v1/drug/Amoxil", headers=HEADERS)
         print(f"Status code: {response.status_code}")
         if response.status_code == 200:
             result = response.json()
@@ -166,7 +174,7 @@ def test_drug_info():
     # Test 2: Get info for a known drug by rxcui
     print("\nTest 2: Get info for a drug by rxcui")
     try:
-        response = requests.get(f"{BASE_URL}/v1/drug/723?identifier_type=rxcui")
+        response = requests.get(f"{BASE_URL}/v1/drug/723?identifier_type=rxcui", headers=HEADERS)
         print(f"Status code: {response.status_code}")
         if response.status_code == 200:
             result = response.json()
@@ -180,7 +188,7 @@ def test_drug_info():
     # Test 3: Get info for a non-existent drug
     print("\nTest 3: Get info for a non-existent drug")
     try:
-        response = requests.get(f"{BASE_URL}/v1/drug/NonExistentDrug123")
+        response = requests.get(f"{BASE_URL}/v1/drug/NonExistentDrug123", headers=HEADERS)
         print(f"Status code: {response.status_code}")
         print(f"Response: {response.text}")
     except Exception as e:
@@ -193,7 +201,7 @@ def test_allergy_info():
     # Test 1: Get info for a known allergy
     print("\nTest 1: Get info for Penicillin allergy")
     try:
-        response = requests.get(f"{BASE_URL}/v1/allergy/Penicillin")
+        response = requests.get(f"{BASE_URL}/v1/allergy/Penicillin", headers=HEADERS)
         print(f"Status code: {response.status_code}")
         if response.status_code == 200:
             result = response.json()
@@ -214,7 +222,7 @@ def test_allergy_info():
     # Test 2: Get info for a non-existent allergy
     print("\nTest 2: Get info for a non-existent allergy")
     try:
-        response = requests.get(f"{BASE_URL}/v1/allergy/NonExistentAllergy123")
+        response = requests.get(f"{BASE_URL}/v1/allergy/NonExistentAllergy123", headers=HEADERS)
         print(f"Status code: {response.status_code}")
         print(f"Response: {response.text}")
     except Exception as e:
@@ -248,7 +256,7 @@ def test_batch_check():
     }
     
     try:
-        response = requests.post(f"{BASE_URL}/v1/batch/check", json=payload)
+        response = requests.post(f"{BASE_URL}/v1/batch/check", json=payload, headers=HEADERS)
         print(f"Status code: {response.status_code}")
         if response.status_code == 200:
             result = response.json()
@@ -263,12 +271,55 @@ def test_batch_check():
     except Exception as e:
         print(f"Exception: {e}")
 
+def test_metrics():
+    """Test the /metrics endpoint"""
+    print("\n=== Testing /metrics endpoint ===")
+    
+    try:
+        response = requests.get(f"{BASE_URL}/metrics")
+        print(f"Status code: {response.status_code}")
+        if response.status_code == 200:
+            print(f"Content-Type: {response.headers.get('Content-Type')}")
+            for line in response.text.splitlines():
+                if line.startswith('allergy_api_requests_total'):
+                    print(f"  {line}")
+        else:
+            print(f"Error: {response.text}")
+    except Exception as e:
+        print(f"Exception: {e}")
+
+def test_msgpack():
+    """Test MessagePack request and response bodies against JSON"""
+    print("\n=== Testing MessagePack ===")
+    if msgpack is None:
+        print("Skipped: msgpack is not installed")
+        return
+    
+    payload = {
+        "drugs": [{"name": "Amoxil"}, {"name": "Advil"}],
+        "patient": {"allergies": [{"name": "Penicillin"}, {"name": "NSAIDs"}]}
+    }
+    headers = dict(HEADERS, **{"Content-Type": "application/msgpack", "Accept": "application/msgpack"})
+    
+    try:
+        packed = requests.post(f"{BASE_URL}/v1/batch/check", data=msgpack.packb(payload), headers=headers)
+        plain = requests.post(f"{BASE_URL}/v1/batch/check", json=payload, headers=HEADERS)
+        print(f"Status code: {packed.status_code}")
+        print(f"Content-Type: {packed.headers.get('Content-Type')}")
+        if packed.status_code == 200:
+            same = msgpack.unpackb(packed.content)['results'] == plain.json()['results']
+            print(f"Size: {len(packed.content)} bytes (JSON {len(plain.content)}), same results: {same}")
+        else:
+            print(f"Error: {packed.content}")
+    except Exception as e:
+        print(f"Exception: {e}")
+
 def main():
     print("Starting API tests...")
     
     # Check if API is running
     try:
-        response = requests.get(f"{BASE_URL}/v1/drug/Amoxil")
+        response = requests.get(f"{BASE_URL}/v1/drug/Amoxil", headers=HEADERS)
         if response.status_code not in [200, 404]:
             print(f"Warning: API may not be running correctly. Status code: {response.status_code}")
             print("Make sure the API server is running on http://localhost:5000")
@@ -285,6 +336,8 @@ def main():
     test_drug_info()
     test_allergy_info()
     test_batch_check()
+    test_metrics()
+    test_msgpack()
     
     print("\nAll tests completed.")
 
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as api_app
+import auth
+
+# API-key authentication through the Flask test client, on a copy of the
+# knowledge base: /v1/* answers 401 without a valid key and 200 with one in
+# either header, a revoked key lasts until its cache entry expires, bad keys
+# cannot push valid ones out of the cache, and two apps in one process keep
+# their own databases and caches.
+
+def auth_app(tmp, config=None):
+    database = os.path.join(tmp, 'allergy_api.db')
+    shutil.copy(api_app.DEFAULT_DATABASE, database)
+    app = api_app.create_app({'DATABASE': database, 'AUTH': True, **(config or {})})
+    return app, sqlite3.connect(database)
+
+def test_key_required_on_v1():
+    with tempfile.TemporaryDirectory() as tmp:
+        app, conn = auth_app(tmp)
+        client = app.test_client()
+        response = client.get('/v1/drug/Advil')
+        assert response.status_code == 401
+        assert response.headers['WWW-Authenticate'] == 'Bearer'
+        assert response.json['error'] == 'Unauthorized'
+        assert client.get('/v1/drug/Advil', headers={'X-API-Key': 'ak_wrong'}).status_code == 401
+        assert client.get('/v1/drug/Advil', headers={'Authorization': 'Basic ak_wrong'}).status_code == 401
+        key = auth.create_key(conn, 'test')
+        assert client.get('/v1/drug/Advil', headers={'X-API-Key': key}).status_code == 200
+        assert client.get('/v1/drug/Advil', headers={'Authorization': f'Bearer {key}'}).status_code == 200
+        # routes outside /v1/ stay open
+        assert client.get('/metrics').status_code == 200
+        conn.close()
+
+def test_revoked_key_expires_from_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        app, conn = auth_app(tmp)
+        client = app.test_client()
+        key = auth.create_key(conn, 'test')
+        headers = {'X-API-Key': key}
+        assert client.get('/v1/drug/Advil', headers=headers).status_code == 200
+        key_id = conn.execute('SELECT id FROM api_keys WHERE key_hash = ?', (auth.hash_key(key),)).fetchone()[0]
+        assert auth.revoke_key(conn, key_id)
+        assert not auth.revoke_key(conn, key_id)
+        # still cached for AUTH_CACHE_TTL
+        assert client.get('/v1/drug/Advil', headers=headers).status_code == 200
+        app.extensions['allergy_api'].api_keys.clear()
+        assert client.get('/v1/drug/Advil', headers=headers).status_code == 401
+        conn.close()
+
+def test_bad_keys_do_not_evict_valid_ones():
+    with tempfile.TemporaryDirectory() as tmp:
+        app, conn = auth_app(tmp)
+        api_keys = app.extensions['allergy_api'].api_keys
+        api_keys.max_negative_entries = 3
+        key = auth.create_key(conn, 'test')
+        assert api_keys.verify(key).name == 'test'
+        for n in range(10):
+            assert api_keys.verify(f'ak_wrong{n}') is None
+        assert len(api_keys.unknown) == 3
+        assert auth.hash_key('ak_wrong9') in api_keys.unknown
+        assert auth.hash_key(key) in api_keys.keys
+        conn.close()
+
+def test_apps_keep_their_own_keys():
+    with tempfile.TemporaryDirectory() as tmp_a, tempfile.TemporaryDirectory() as tmp_b:
+        app_a, conn_a = auth_app(tmp_a)
+        app_b, conn_b = auth_app(tmp_b, {'AUTH_CACHE_TTL': 0})
+        key_a = auth.create_key(conn_a, 'a')
+        key_b = auth.create_key(conn_b, 'b')
+        client_a, client_b = app_a.test_client(), app_b.test_client()
+        assert client_a.get('/v1/drug/Advil', headers={'X-API-Key': key_a}).status_code == 200
+        assert client_b.get('/v1/drug/Advil', headers={'X-API-Key': key_b}).status_code == 200
+        assert client_a.get('/v1/drug/Advil', headers={'X-API-Key': key_b}).status_code == 401
+        assert client_b.get('/v1/drug/Advil', headers={'X-API-Key': key_a}).status_code == 401
+        assert app_a.extensions['allergy_api'].api_keys.ttl == 30
+        assert app_b.extensions['allergy_api'].api_keys.ttl == 0
+        conn_a.close()
+        conn_b.close()
+
+def test_auth_disabled():
+    with tempfile.TemporaryDirectory() as tmp:
+        app, conn = auth_app(tmp, {'AUTH': False})
+        assert app.test_client().get('/v1/drug/Advil').status_code == 200
+        conn.close()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import gzip
+import os
+import sys
+
+import pytest
+from flask import Response
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as api_app
+import compression
+
+# Response compression through the Flask test client: the coding follows the
+# client's q-values and * with ties going to COMPRESSION_ENCODINGS order,
+# small responses go out as-is unless the client refuses identity, and a
+# client that accepts no available coding gets 406. Compressed and
+# uncompressed responses alike vary on Accept-Encoding.
+
+LARGE = '/v1/allergy/Penicillin'
+SMALL = '/v1/drug/Advil'
+
+def decode(response):
+    encoding = response.headers.get('Content-Encoding')
+    if encoding == 'gzip':
+        return gzip.decompress(response.data)
+    if encoding == 'br':
+        return compression.brotli.decompress(response.data)
+    if encoding == 'zstd':
+        return compression.zstandard.ZstdDecompressor().decompressobj().decompress(response.data)
+    assert encoding is None
+    return response.data
+
+@pytest.fixture
+def app():
+    return api_app.create_app({'COMPRESSION': True})
+
+def get(c, url, accept, **kwargs):
+    headers = {'Accept-Encoding': accept} if accept is not None else {}
+    return c.get(url, headers={**headers, **kwargs.pop('headers', {})}, **kwargs)
+
+def test_selection(app):
+    c = app.test_client()
+    plain = get(c, LARGE, None).data
+    assert len(plain) >= app.config['COMPRESSION_MIN_SIZE']
+    cases = [(None, None), ('', None), ('gzip', 'gzip'), ('deflate', None), ('GZIP', 'gzip'),
+             ('gzip;q=1, br;q=0.5', 'gzip'), ('gzip;q=0, deflate', None), ('identity', None)]
+    if 'br' in compression.ENCODINGS:
+        cases += [('gzip, br', 'br'), ('br;q=0.2, gzip;q=0.9', 'gzip')]
+    if 'zstd' in compression.ENCODINGS:
+        cases += [('gzip, br, zstd', 'zstd'), ('zstd;q=0.5, gzip', 'gzip'), ('*', 'zstd'), ('*;q=0.5, gzip', 'gzip'),
+                  ('*, zstd;q=0', 'br' if 'br' in compression.ENCODINGS else 'gzip')]
+    for accept, expected in cases:
+        response = get(c, LARGE, accept)
+        assert response.status_code == 200
+        assert response.headers.get('Content-Encoding') == expected, accept
+        assert decode(response) == plain
+        assert 'Accept-Encoding' in response.vary
+
+def test_configured_preference(app):
+    app.config['COMPRESSION_ENCODINGS'] = 'gzip'
+    c = app.test_client()
+    assert get(c, LARGE, '*').headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in get(c, LARGE, 'br, zstd').headers
+
+def test_size_threshold(app):
+    c = app.test_client()
+    small = get(c, SMALL, 'gzip')
+    assert len(small.data) < app.config['COMPRESSION_MIN_SIZE']
+    assert 'Content-Encoding' not in small.headers
+    assert 'Accept-Encoding' in small.vary
+    app.config['COMPRESSION_MIN_SIZE'] = 0
+    assert get(c, SMALL, 'gzip').headers['Content-Encoding'] == 'gzip'
+
+def test_head_and_range(app):
+    body = b'{"part": "' + b'x' * 4000 + b'"}'
+
+    @app.route('/partial')
+    def partial():
+        return Response(body[:2000], 206, {'Content-Range': f'bytes 0-1999/{len(body)}'}, mimetype='application/json')
+
+    c = app.test_client()
+    full = get(c, LARGE, 'gzip')
+    head = c.head(LARGE, headers={'Accept-Encoding': 'gzip'})
+    assert head.status_code == 200 and head.data == b''
+    assert head.headers['Content-Encoding'] == 'gzip'
+    assert head.headers['Content-Length'] == str(len(full.data))
+    # JSON routes ignore Range, so the whole body is sent and compressed
+    ranged = get(c, LARGE, 'gzip', headers={'Range': 'bytes=0-99'})
+    assert ranged.status_code == 200 and 'Content-Range' not in ranged.headers
+    assert ranged.data == full.data
+    # a partial response is never compressed, its range is of the plain body
+    response = get(c, '/partial', 'gzip')
+    assert response.status_code == 206 and 'Content-Encoding' not in response.headers
+    assert response.data == body[:2000]
+
+def test_identity_refused(app):
+    c = app.test_client()
+    small = get(c, SMALL, 'gzip, identity;q=0')
+    assert small.headers['Content-Encoding'] == 'gzip'
+    assert decode(small) == get(c, SMALL, None).data
+    assert get(c, SMALL, 'gzip, *;q=0').headers['Content-Encoding'] == 'gzip'
+    for accept in ('identity;q=0', '*;q=0', 'deflate, identity;q=0', 'gzip;q=0, br;q=0, zstd;q=0, identity;q=0'):
+        response = get(c, LARGE, accept)
+        assert response.status_code == 406, accept
+        assert 'Content-Encoding' not in response.headers
+        assert response.json['error'] == 'Not acceptable'
+        assert 'Accept-Encoding' in response.vary
+    # identity listed with a q-value above zero overrides *;q=0
+    assert get(c, SMALL, '*;q=0, identity').status_code == 200
+
+def test_compression_disabled():
+    c = api_app.create_app({'COMPRESSION': False}).test_client()
+    response = get(c, LARGE, 'gzip')
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' not in response.vary
+    assert get(c, LARGE, 'identity;q=0').status_code == 200
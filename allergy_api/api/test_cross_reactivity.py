@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import cross_reactivity
+from cross_reactivity import RANKS
+
+# The cross-reactivity closure on small hand-made graphs: the CSR layout, the
+# best path to each ingredient with its evidence lowered one level per hop
+# past the first, the tie-breaks between equally strong paths, and the
+# per-allergy index built from the database.
+
+HIGH, MEDIUM, LOW = RANKS['high'], RANKS['medium'], RANKS['low']
+
+# 1 -> 2 -> 3 -> 4 is strong, 1 -> 5 -> 3 starts weak; 3 -> 1 closes a cycle
+EDGES = [(1, 2, HIGH), (2, 3, HIGH), (3, 4, MEDIUM), (1, 5, LOW), (5, 3, HIGH), (3, 1, HIGH)]
+
+def test_csr_layout():
+    graph = cross_reactivity.Graph(EDGES)
+    assert list(graph.ids) == [1, 2, 3, 4, 5]
+    for source, target, rank in EDGES:
+        n = graph.index[source]
+        edges = range(graph.offsets[n], graph.offsets[n + 1])
+        assert (graph.index[target], rank) in [(graph.targets[e], graph.ranks[e]) for e in edges]
+    assert graph.offsets[-1] == len(EDGES)
+
+def test_closure_lowers_evidence_per_hop():
+    closure = cross_reactivity.Graph(EDGES).closure(1, 3)
+    assert closure == {
+        2: (HIGH, (1, 2)),
+        5: (LOW, (1, 5)),
+        # two hops of high evidence are medium; the path through 5 is only low
+        3: (MEDIUM, (1, 2, 3)),
+        # medium over three hops bottoms out at low; both paths tie, the lower ids win
+        4: (LOW, (1, 2, 3, 4)),
+    }
+
+def test_closure_depth_cycles_and_unknown_sources():
+    graph = cross_reactivity.Graph(EDGES)
+    assert set(graph.closure(1, 1)) == {2, 5}
+    assert 4 not in graph.closure(1, 2)
+    # the cycle back to the source is not a reaction to it
+    assert 1 not in graph.closure(1, 3)
+    assert graph.closure(99, 3) == {}
+
+def test_closure_prefers_shorter_paths_of_equal_evidence():
+    graph = cross_reactivity.Graph([(1, 2, LOW), (2, 3, LOW), (1, 3, LOW)])
+    assert graph.closure(1, 3)[3] == (LOW, (1, 3))
+
+def test_index_leaves_out_an_allergys_own_ingredients():
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'cross_reactivity.db')
+        conn = sqlite3.connect(database)
+        conn.executescript('''
+            CREATE TABLE ingredients (id INTEGER PRIMARY KEY, name TEXT);
+            CREATE TABLE cross_reactivity (source_id INTEGER, target_id INTEGER, evidence_level TEXT, description TEXT);
+            CREATE TABLE allergy_members (allergy_id INTEGER, ingredient_id INTEGER);
+            INSERT INTO ingredients VALUES (1, 'Penicillin'), (2, 'Amoxicillin'), (3, 'Cephalexin'), (4, 'Cefazolin');
+            INSERT INTO cross_reactivity VALUES (1, 2, 'high', 'same ring'), (2, 3, 'high', 'side chain'),
+                                                (3, 4, 'low', 'class');
+            INSERT INTO allergy_members VALUES (10, 1), (10, 2);
+        ''')
+        conn.commit()
+        conn.close()
+        index = cross_reactivity.CrossReactivityIndex(lambda: sqlite3.connect(database), lambda: 1, max_depth=3)
+        assert index.lookup(10, 2) is None
+        reaction = index.lookup(10, 3)
+        # one hop from Amoxicillin, a member, beats two from Penicillin
+        assert (reaction.evidence_level, reaction.path) == ('high', (2, 3))
+        assert reaction.names == ['Amoxicillin', 'Cephalexin']
+        assert reaction.descriptions == ['side chain']
+        reaction = index.lookup(10, 4)
+        assert (reaction.evidence_level, reaction.path) == ('low', (2, 3, 4))
+        assert index.lookup(11, 3) is None
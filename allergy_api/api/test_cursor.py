@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import base64
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as api_app
+
+# Keyset cursors: what encode_cursor writes decodes back to the same
+# positions, and anything else, from garbage to well-formed JSON holding the
+# wrong values, decodes to None so the routes can answer 400.
+
+def raw_cursor(text):
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip('=')
+
+def test_round_trip():
+    for positions in ([0, 0, 0], [12, None, 3], [-4.25, 17], [None, None, None], [2 ** 63 - 1, -2 ** 63, 0]):
+        cursor = api_app.encode_cursor(positions)
+        assert '=' not in cursor and '+' not in cursor and '/' not in cursor
+        assert api_app.decode_cursor(cursor, len(positions)) == positions
+
+def test_invalid_cursors():
+    for cursor in ('', '!!!', 'a', raw_cursor('[1,2'), '_w', raw_cursor('{"a":1}'), raw_cursor('"x"'),
+                   raw_cursor('[1,2]'), raw_cursor('[1,2,3,4]'),
+                   raw_cursor('["1",2,3]'), raw_cursor('[true,2,3]'), raw_cursor('[[1],2,3]'),
+                   raw_cursor('[NaN,2,3]'), raw_cursor('[Infinity,2,3]'), raw_cursor('[1e999,2,3]'),
+                   raw_cursor(f'[{2 ** 63},2,3]'), raw_cursor(f'[{-2 ** 63 - 1},2,3]')):
+        assert api_app.decode_cursor(cursor, 3) is None, cursor
+
+def test_routes_reject_invalid_cursors():
+    client = api_app.create_app().test_client()
+    for url in ('/v1/allergy/Penicillin?cursor=', '/v1/search/labels?q=bleeding&cursor='):
+        for cursor in ('!!!', raw_cursor(f'[{2 ** 70},0,0]'), raw_cursor(f'[{2 ** 70},0]')):
+            response = client.get(url + cursor)
+            assert response.status_code == 400, (url, cursor)
+            assert response.get_json()['error'] == 'Invalid request'
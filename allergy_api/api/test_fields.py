@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as api_app
+
+# ?fields= and options.verdict_only on /v1/check and /v1/batch/check through
+# the Flask test client: each field set returns exactly those fields, a safe
+# verdict without contraindications comes from the single-query verdict and
+# agrees with the full check, and verdict_only returns only the verdict.
+
+DRUGS = ['Advil', 'Keflex', 'Amoxil', 'Bactrim', 'Tylenol with Codeine']
+PATIENT = {'allergies': [{'name': 'Penicillin'}, {'name': 'NSAIDs'}], 'conditions': [{'name': 'Pregnancy'}]}
+TEXT_PATIENT = {**PATIENT, 'allergy_text': 'sulfa'}
+FIELD_SETS = ['safe', 'drug', 'warnings', 'metadata', 'contraindications', 'safe,warnings', 'drug,contraindications',
+              'drug,contraindications,warnings,safe,metadata']
+
+@pytest.fixture
+def app():
+    return api_app.create_app()
+
+def check(c, drug, fields=None, patient=PATIENT, options=None):
+    url = f'/v1/check?fields={fields}' if fields else '/v1/check'
+    return c.post(url, json={'drug': {'name': drug}, 'patient': patient, 'options': options or {}})
+
+def batch(c, fields=None, patient=PATIENT, options=None):
+    url = f'/v1/batch/check?fields={fields}' if fields else '/v1/batch/check'
+    return c.post(url, json={'drugs': [{'name': d} for d in DRUGS], 'patient': patient, 'options': options or {}})
+
+def test_fields_return_only_what_was_asked(app):
+    c = app.test_client()
+    for fields in FIELD_SETS:
+        wanted = set(fields.split(','))
+        assert set(check(c, 'Advil', fields).json) == wanted
+        response = batch(c, fields).json
+        assert set(response) == {'results'} | (wanted & {'metadata'})
+        assert all(set(result) == wanted - {'metadata'} for result in response['results'])
+        # parsed allergies only come with the fields that depend on the patient
+        parsed = 'parsed_allergies' in check(c, 'Advil', fields, TEXT_PATIENT).json
+        assert parsed == bool(wanted & {'safe', 'contraindications'})
+        assert ('parsed_allergies' in batch(c, fields, TEXT_PATIENT).json) == parsed
+
+def test_unknown_fields_rejected(app):
+    c = app.test_client()
+    assert check(c, 'Advil', 'safe,dosage').status_code == 400
+    assert batch(c, 'nothing').status_code == 400
+
+def test_safe_alone_uses_the_verdict(app, monkeypatch):
+    c = app.test_client()
+    expected = {drug: check(c, drug).json['safe'] for drug in DRUGS}
+    assert set(expected.values()) == {True, False}
+    store = app.extensions['allergy_api'].store
+    for name in ('allergy_contraindications', 'condition_contraindications'):
+        monkeypatch.setattr(store, name, lambda *args: pytest.fail('full check for fields=safe'))
+    for drug in DRUGS:
+        assert check(c, drug, 'safe').json == {'safe': expected[drug]}
+        assert check(c, drug, 'safe,warnings,drug').json['safe'] == expected[drug]
+    assert [r['safe'] for r in batch(c, 'safe').json['results']] == [expected[d] for d in DRUGS]
+
+def test_verdict_only(app):
+    c = app.test_client()
+    for drug in DRUGS:
+        full = check(c, drug).json
+        verdict = check(c, drug, options={'verdict_only': True}).json
+        assert set(verdict) == {'safe', 'max_severity', 'metadata'}
+        assert verdict['safe'] == full['safe']
+        severities = [con['severity'] for con in full['contraindications']]
+        assert verdict['max_severity'] == max(severities, key=['low', 'medium', 'high'].index, default=None)
+        assert 'parsed_allergies' in check(c, drug, patient=TEXT_PATIENT, options={'verdict_only': True}).json
+    results = batch(c, options={'verdict_only': True}).json['results']
+    assert all(set(r) == {'drug', 'safe', 'max_severity'} for r in results)
+    assert [r['drug']['name'] for r in results] == DRUGS
+    assert [r['safe'] for r in results] == [r['safe'] for r in batch(c).json['results']]
+    # no patient, nothing to contraindicate
+    assert check(c, 'Advil', patient={}, options={'verdict_only': True}).json['max_severity'] is None
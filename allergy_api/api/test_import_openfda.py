@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import queue
+import sqlite3
+import sys
+import tempfile
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import test_storage_parity
+
+sys.path.insert(0, test_storage_parity.DATABASE_DIR)
+import import_openfda
+import matcher
+
+# The openFDA label importer on small hand-made bulk files: labels are
+# streamed out of the zip whatever the chunk boundaries and wherever meta
+# sits, section headings are cleaned off, labels are matched to drugs by
+# RxCUI, NDC, brand and generic name, and an import resumed from a mid-file
+# checkpoint stores what an uninterrupted one does, without duplicates.
+
+CATALOG = '''
+    INSERT INTO drugs (id, name, rxcui, generic_name) VALUES (1, 'Advil', '153010', 'Ibuprofen'),
+        (2, 'Keflex', '203542', 'Cephalexin'), (3, 'Motrin', '202488', 'Ibuprofen');
+    INSERT INTO rxcui_crosswalk (rxcui, drug_id) VALUES ('153010', 1), ('203542', 2);
+    INSERT INTO ndc_codes (ndc, drug_id, level) VALUES ('00777086902', 2, 'package');
+    INSERT INTO brand_names (drug_id, name) VALUES (3, 'Motrin IB');
+    INSERT INTO conditions (id, name, normalized_name) VALUES (1, 'Renal impairment', 'renal impairment');
+    INSERT INTO allergies (id, name, type) VALUES (1, 'Penicillin', 'class');
+'''
+
+LABELS = [
+    # RxCUI, bringing another RxCUI and an NDC along
+    {'openfda': {'rxcui': ['153010', '310965'], 'package_ndc': ['0573-0164-20'], 'brand_name': ['Advil']},
+     'contraindications': ['4 CONTRAINDICATIONS  Do not use in renal impairment.'],
+     'warnings': ['WARNINGS: Stomach bleeding } ] " warning.']},
+    # NDC
+    {'openfda': {'product_ndc': ['0777-0869'], 'package_ndc': ['0777-0869-02']},
+     'boxed_warning': ['BOXED WARNING: WARNING: Penicillin allergy — cross-reactions.']},
+    # brand name, in another case
+    {'openfda': {'brand_name': ['MOTRIN IB']}, 'warnings_and_cautions': ['5.1 WARNINGS AND PRECAUTIONS Heart attack.']},
+    # generic name only: both ibuprofen drugs, the section already stored for Advil is skipped
+    {'openfda': {'generic_name': ['ibuprofen']}, 'warnings': ['WARNINGS: Stomach bleeding } ] " warning.', '   ']},
+    # nothing we know
+    {'openfda': {'rxcui': ['999999'], 'brand_name': ['Unknownol']}, 'warnings': ['WARNINGS: Never stored.']},
+    # a repackager repeating the first label
+    {'openfda': {'rxcui': ['310965']}, 'contraindications': ['CONTRAINDICATIONS: Do not use in renal impairment.'],
+     'warnings': ['Long text ' + 'é' * 3000]},
+]
+
+def write_zip(path, labels, meta_first=True, indent=None):
+    meta = {'results': {'skip': 0, 'limit': len(labels), 'total': len(labels)}, 'terms': ['[', ']', '{', '}']}
+    items = [('meta', meta), ('results', labels)] if meta_first else [('results', labels), ('meta', meta)]
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('README.txt', '{"results": [1]}')
+        archive.writestr('drug-label-0001-of-0001.json', json.dumps(dict(items), indent=indent, ensure_ascii=False))
+
+def database(tmp, name):
+    path = os.path.join(tmp, name)
+    conn = sqlite3.connect(path)
+    test_storage_parity.create_schema(conn)
+    conn.executescript(CATALOG)
+    conn.commit()
+    return conn
+
+def batches(conn, path, start=0):
+    """The batches a worker puts on its queue for one file"""
+    results = queue.Queue()
+    import_openfda._init_worker(results, matcher.Automaton(import_openfda.phrases(conn)))
+    import_openfda._import_file((path, start))
+    items = []
+    while not results.empty():
+        items.append(results.get())
+    return items
+
+def stored(conn):
+    return {
+        'warnings': sorted(conn.execute('SELECT drug_id, type, text FROM drug_warnings')),
+        'mentions': sorted(conn.execute('''
+            SELECT w.drug_id, w.text, m.entity_type, m.entity_id
+            FROM label_mentions m JOIN drug_warnings w ON w.id = m.label_id
+        ''')),
+        'rxcuis': sorted(conn.execute('SELECT rxcui, drug_id FROM rxcui_crosswalk')),
+        'ndcs': sorted(conn.execute('SELECT ndc, drug_id, level FROM ndc_codes')),
+        'checkpoints': list(conn.execute('SELECT file, position, done FROM import_checkpoints')),
+    }
+
+@pytest.mark.parametrize('chunk', [1, 7, 100, 1 << 20])
+@pytest.mark.parametrize('meta_first', [True, False])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_labels_stream_across_chunks(monkeypatch, chunk, meta_first, indent):
+    monkeypatch.setattr(import_openfda, 'CHUNK', chunk)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'labels.json.zip')
+        write_zip(path, LABELS, meta_first, indent)
+        assert list(import_openfda.iter_labels(path)) == LABELS
+        write_zip(path, [], meta_first, indent)
+        assert list(import_openfda.iter_labels(path)) == []
+
+def test_truncated_file_fails():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'labels.json.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.writestr('drug-label.json', json.dumps({'meta': {}, 'results': LABELS})[:-200])
+        with pytest.raises(ValueError):
+            list(import_openfda.iter_labels(path))
+
+def test_clean():
+    assert import_openfda.clean('4 CONTRAINDICATIONS  Do not use') == 'Do not use'
+    assert import_openfda.clean('5.1 WARNINGS AND PRECAUTIONS Hepatotoxicity') == 'Hepatotoxicity'
+    assert import_openfda.clean('WARNING\n\n  Liver   damage.') == 'Liver damage.'
+    assert import_openfda.clean('CONTRAINDICATION. None.') == 'None.'
+    # one heading only, and only a heading
+    assert import_openfda.clean('BOXED WARNING: WARNING: RISK') == 'WARNING: RISK'
+    assert import_openfda.clean('Warnings are listed') == 'Warnings are listed'
+    assert import_openfda.clean('CONTRAINDICATED in x') == 'CONTRAINDICATED in x'
+    assert import_openfda.clean(' \n ') == ''
+
+def test_writer(monkeypatch):
+    monkeypatch.setattr(import_openfda, 'BATCH', 2)
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = database(tmp, 'allergy_api.db')
+        path = os.path.join(tmp, 'labels.json.zip')
+        write_zip(path, LABELS)
+        items = batches(conn, path)
+        assert [(position, len(labels), done) for _, position, labels, done in items] == [
+            (2, 2, False), (4, 2, False), (6, 2, False), (6, 0, True)]
+        writer = import_openfda.Writer(conn)
+        for item in items:
+            writer.write(*item)
+        assert (writer.labels, writer.matched) == (6, 5)
+        result = stored(conn)
+        assert result['warnings'] == [
+            (1, 'contraindication', 'Do not use in renal impairment.'),
+            (1, 'general', 'Long text ' + 'é' * 3000),
+            (1, 'general', 'Stomach bleeding } ] " warning.'),
+            (2, 'specific', 'WARNING: Penicillin allergy — cross-reactions.'),
+            (3, 'general', 'Heart attack.'),
+            (3, 'general', 'Stomach bleeding } ] " warning.'),
+        ]
+        assert result['mentions'] == [
+            (1, 'Do not use in renal impairment.', 'condition', 1),
+            (2, 'WARNING: Penicillin allergy — cross-reactions.', 'allergy', 1),
+        ]
+        # the label matched by RxCUI alone taught us its other RxCUI and NDC,
+        # which matched the repackager's label
+        assert ('310965', 1) in result['rxcuis']
+        assert ('00573016420', 1, 'package') in result['ndcs']
+        assert ('00777086902', 2, 'package') in result['ndcs'] and ('007770869', 2, 'product') in result['ndcs']
+        assert result['checkpoints'] == [('labels.json.zip', 6, 1)]
+        conn.close()
+
+@pytest.mark.parametrize('interrupted_after', [1, 2])
+def test_resume_from_checkpoint(monkeypatch, interrupted_after):
+    monkeypatch.setattr(import_openfda, 'BATCH', 2)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'labels.json.zip')
+        write_zip(path, LABELS)
+        whole = database(tmp, 'whole.db')
+        writer = import_openfda.Writer(whole)
+        for item in batches(whole, path):
+            writer.write(*item)
+
+        resumed = database(tmp, 'resumed.db')
+        writer = import_openfda.Writer(resumed)
+        for item in batches(resumed, path)[:interrupted_after]:
+            writer.write(*item)
+        (position, done), = resumed.execute('SELECT position, done FROM import_checkpoints')
+        assert (position, done) == (2 * interrupted_after, 0)
+        # a new run: a new writer, and the worker skips the labels already committed
+        writer = import_openfda.Writer(resumed)
+        items = batches(resumed, path, position)
+        assert sum(len(labels) for _, _, labels, _ in items) == len(LABELS) - position
+        for item in items:
+            writer.write(*item)
+        assert stored(resumed) == stored(whole)
+        # restarting from the top of the file stores nothing twice either
+        for item in batches(resumed, path):
+            writer.write(*item)
+        assert stored(resumed) == stored(whole)
+        whole.close()
+        resumed.close()
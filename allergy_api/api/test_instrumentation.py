@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as api_app
+
+# The Server-Timing header and metadata.debug through the Flask test client:
+# one entry per stage a route went through, then the SQL statements, rows and
+# connections of the request and its total; metadata.debug only with
+# SERVER_TIMING_METADATA; neither without SERVER_TIMING; and each app follows
+# its own settings, whatever other apps the process has built.
+
+CHECK = {'drug': {'name': 'Advil'}, 'patient': {'allergies': [{'name': 'NSAIDs'}]}}
+BATCH = {'drugs': [{'name': 'Advil'}, {'name': 'Keflex'}], 'patient': CHECK['patient']}
+ROUTES = [
+    ('get', '/v1/drug/Advil', None, ['resolve', 'ingredients', 'conditions', 'warnings', 'brand_names', 'serialize']),
+    ('post', '/v1/check', CHECK,
+     ['resolve', 'patient', 'ingredients', 'allergies', 'conditions', 'warnings', 'serialize']),
+    ('post', '/v1/check?fields=safe', CHECK, ['resolve', 'patient', 'verdict', 'serialize']),
+    ('post', '/v1/batch/check', BATCH, ['patient', 'resolve', 'allergies', 'conditions', 'warnings', 'serialize']),
+    ('get', '/v1/allergy/Penicillin', None,
+     ['resolve', 'ingredients', 'cross_reactivity', 'related_drugs', 'totals', 'serialize']),
+    ('get', '/v1/search?q=am', None, ['search', 'facets', 'serialize']),
+    ('get', '/v1/search/labels?q=may', None, ['search', 'serialize']),
+]
+SQL = re.compile(r'sql;dur=[0-9.]+;desc="queries=(\d+) rows=(\d+) connections=(\d+)"')
+
+def stages(header):
+    return [part.split(';')[0] for part in header.split(', ')]
+
+def durations(header):
+    return {part.split(';')[0]: float(part.split(';')[1][len('dur='):]) for part in header.split(', ')}
+
+@pytest.mark.parametrize('storage', ['sqlite', 'memory'])
+def test_one_entry_per_stage(storage):
+    c = api_app.create_app({'SERVER_TIMING': True, 'STORAGE': storage}).test_client()
+    for method, url, body, expected in ROUTES:
+        header = getattr(c, method)(url, json=body).headers['Server-Timing']
+        assert stages(header) == expected + ['sql', 'total'], url
+        times = durations(header)
+        assert all(ms >= 0 for ms in times.values())
+        assert times['total'] >= sum(ms for name, ms in times.items() if name not in ('sql', 'total'))
+        queries, rows, connections = map(int, SQL.search(header).groups())
+        assert queries >= connections, url
+        # the memory storage answers from its tables once they are loaded
+        if storage == 'sqlite':
+            assert connections >= 1 and rows >= 1, url
+
+def test_sql_counts():
+    c = api_app.create_app({'SERVER_TIMING': True, 'STORAGE': 'sqlite'}).test_client()
+    header = c.get('/v1/search/labels?q=may').headers['Server-Timing']
+    results = c.get('/v1/search/labels?q=may').json['results']
+    # one statement returning the page, on one connection
+    assert SQL.search(header).groups() == ('1', str(len(results)), '1')
+
+def test_debug_metadata_only_when_enabled():
+    plain = api_app.create_app({'SERVER_TIMING': True}).test_client()
+    debug = api_app.create_app({'SERVER_TIMING': True, 'SERVER_TIMING_METADATA': True}).test_client()
+    for method, url, body, expected in ROUTES:
+        metadata = getattr(plain, method)(url, json=body).json.get('metadata')
+        if metadata is None:
+            continue
+        assert 'debug' not in metadata, url
+        info = getattr(debug, method)(url, json=body).json['metadata']['debug']
+        assert set(info) == {'stages_ms', 'sql_queries', 'sql_rows', 'sql_ms', 'db_connections', 'total_ms'}
+        # taken before the response is serialized
+        assert set(info['stages_ms']) <= set(expected) - {'serialize'}, url
+        assert info['db_connections'] <= info['sql_queries']
+
+def test_header_absent_when_off():
+    for config in ({}, {'SERVER_TIMING': False, 'SERVER_TIMING_METADATA': True}, {'METRICS': True}):
+        c = api_app.create_app(config).test_client()
+        for method, url, body, _ in ROUTES:
+            response = getattr(c, method)(url, json=body)
+            assert 'Server-Timing' not in response.headers, (config, url)
+            assert 'debug' not in (response.json.get('metadata') or {}), (config, url)
+
+def test_apps_keep_their_own_settings():
+    timed = api_app.create_app({'SERVER_TIMING': True, 'SERVER_TIMING_METADATA': True}).test_client()
+    untimed = api_app.create_app({'SERVER_TIMING': False}).test_client()
+    header = timed.get('/v1/drug/Advil').headers['Server-Timing']
+    assert stages(header)[:2] == ['resolve', 'ingredients']
+    assert 'debug' in timed.post('/v1/check', json=CHECK).json['metadata']
+    assert 'Server-Timing' not in untimed.get('/v1/drug/Advil').headers
+    assert 'debug' not in untimed.post('/v1/check', json=CHECK).json['metadata']
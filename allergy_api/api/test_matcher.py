@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import matcher
+import synonyms
+
+# The Aho-Corasick automaton: whole-word matches only, every overlapping
+# phrase reported, names compared by their synonyms.py keys with offsets into
+# the original text, and on random texts exactly the matches a naive search
+# of every phrase finds.
+
+def spans(automaton, text):
+    return [(text[start:end], value) for start, end, value in automaton.scan(text)]
+
+def test_whole_words_only():
+    automaton = matcher.Automaton([('asthma', 1)])
+    assert spans(automaton, 'Asthma, severe') == [('Asthma', 1)]
+    assert spans(automaton, 'asthmatic; nonasthma') == []
+    assert spans(automaton, 'history of asthma') == [('asthma', 1)]
+
+def test_overlapping_phrases_in_order_of_their_end():
+    automaton = matcher.Automaton([('renal failure', 1), ('failure', 2), ('acute renal', 3)])
+    assert spans(automaton, 'acute renal failure') == [('acute renal', 3), ('renal failure', 1), ('failure', 2)]
+
+def test_one_phrase_many_values():
+    automaton = matcher.Automaton([('sulfa', 1), ('Sulfa', 2), ('', 3)])
+    assert automaton.values('SULFA drugs') == {1, 2}
+
+def test_normalized_names_with_offsets_into_the_text():
+    automaton = matcher.Automaton([('Acetylsalicylic acid', 1), ('penicilline', 2), ('fi', 3), ('ss', 4)])
+    assert spans(automaton, 'acetylsalicylic-acid') == [('acetylsalicylic-acid', 1)]
+    assert spans(automaton, 'ACETYLSALICYLIC  ACID!') == [('ACETYLSALICYLIC  ACID', 1)]
+    assert spans(automaton, 'Pénicilline - hives') == [('Pénicilline', 2)]
+    # characters whose key is longer or shorter than themselves
+    assert spans(automaton, 'a ﬁ b') == [('ﬁ', 3)]
+    assert spans(automaton, 'x ß') == [('ß', 4)]
+    assert spans(automaton, 'Ａｓｐｉｒｉｎ, penicilline') == [('penicilline', 2)]
+
+def test_random_texts_match_a_naive_search():
+    rng = random.Random(7)
+    for _ in range(300):
+        words = ['a', 'b', 'ab', 'ba', 'aab']
+        phrases = [(' '.join(rng.choice(words) for _ in range(rng.randint(1, 3))), n) for n in range(rng.randint(1, 6))]
+        automaton = matcher.Automaton(phrases)
+        text = ''.join(rng.choice('ab -É') for _ in range(rng.randint(0, 30)))
+        key = synonyms.normalize(text)
+        expected = sorted(
+            (start, start + len(phrase), value)
+            for phrase, value in phrases
+            for start in range(len(key))
+            if key.startswith(phrase, start)
+            and (start == 0 or key[start - 1] == ' ')
+            and (start + len(phrase) == len(key) or key[start + len(phrase)] == ' ')
+        )
+        found = automaton.scan(text)
+        assert len(found) == len(expected), (phrases, text)
+        assert sorted(value for _, _, value in found) == sorted(value for _, _, value in expected)
+        for start, end, value in found:
+            assert synonyms.normalize(text[start:end]) == next(p for p, v in phrases if v == value)
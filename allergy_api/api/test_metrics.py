@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as api_app
+
+# /metrics through the Flask test client: the exposition format, and the
+# request, batch size and connection series moving by what was served. The
+# registry is shared by every app in the process, so the tests compare
+# scrapes taken before and after their requests.
+
+SAMPLE = re.compile(r'^([a-z_]+(?:\{[^}]*\})?) (\S+)$')
+
+def scrape(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    samples = {}
+    for line in response.get_data(as_text=True).splitlines():
+        if not line.startswith('#'):
+            name, value = SAMPLE.match(line).groups()
+            samples[name] = float(value)
+    return samples
+
+def delta(before, after, name):
+    return after.get(name, 0.0) - before.get(name, 0.0)
+
+def test_exposition_format():
+    client = api_app.create_app({'METRICS': True}).test_client()
+    client.get('/v1/drug/Advil')
+    response = client.get('/metrics')
+    assert response.content_type == 'text/plain; version=0.0.4; charset=utf-8'
+    declared = {}
+    for line in response.get_data(as_text=True).splitlines():
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split()
+            declared[name] = kind
+        elif not line.startswith('#'):
+            name = SAMPLE.match(line).group(1).split('{')[0]
+            base = re.sub(r'_(bucket|sum|count)$', '', name)
+            assert name in declared or declared.get(base) == 'histogram'
+    assert declared['allergy_api_requests_total'] == 'counter'
+    assert declared['allergy_api_request_duration_seconds'] == 'histogram'
+    assert declared['allergy_api_db_connections_open'] == 'gauge'
+
+def test_requests_counted_by_route_and_status():
+    client = api_app.create_app({'METRICS': True}).test_client()
+    before = scrape(client)
+    for _ in range(3):
+        assert client.get('/v1/drug/Advil').status_code == 200
+    assert client.get('/v1/drug/NoSuchDrug').status_code == 404
+    after = scrape(client)
+    found = 'allergy_api_requests_total{route="/v1/drug/<identifier>",method="GET",status="200"}'
+    missing = 'allergy_api_requests_total{route="/v1/drug/<identifier>",method="GET",status="404"}'
+    assert delta(before, after, found) == 3
+    assert delta(before, after, missing) == 1
+    durations = 'allergy_api_request_duration_seconds_count{route="/v1/drug/<identifier>"}'
+    assert delta(before, after, durations) == 4
+    # every connection a request opened was closed
+    assert after['allergy_api_db_connections_open'] == 0
+
+def test_histogram_buckets_are_cumulative():
+    client = api_app.create_app({'METRICS': True}).test_client()
+    before = scrape(client)
+    body = {'drugs': [{'name': 'Advil'}, {'name': 'Keflex'}, {'name': 'Aspirin'}]}
+    assert client.post('/v1/batch/check', json=body).status_code == 200
+    after = scrape(client)
+    assert delta(before, after, 'allergy_api_batch_size_count') == 1
+    assert delta(before, after, 'allergy_api_batch_size_sum') == 3
+    assert delta(before, after, 'allergy_api_batch_size_bucket{le="2"}') == 0
+    assert delta(before, after, 'allergy_api_batch_size_bucket{le="5"}') == 1
+    assert delta(before, after, 'allergy_api_batch_size_bucket{le="+Inf"}') == 1
+    buckets = [value for name, value in after.items()
+               if name.startswith('allergy_api_request_duration_seconds_bucket{route="/v1/batch/check"')]
+    assert buckets == sorted(buckets)
+    assert buckets[-1] == after['allergy_api_request_duration_seconds_count{route="/v1/batch/check"}']
+
+def test_metrics_disabled():
+    client = api_app.create_app({'METRICS': False}).test_client()
+    assert client.get('/metrics').status_code == 404
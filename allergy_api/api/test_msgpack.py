@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as api_app
+
+msgpack = pytest.importorskip('msgpack')
+
+# MessagePack negotiation through the Flask test client: request bodies and
+# responses in either format carry the same objects, Accept picks the response
+# format with ties going to JSON, /v1/* responses vary on Accept, and bad
+# bodies are rejected as bad JSON is.
+
+PACKED = {'Accept': 'application/msgpack'}
+CHECK = {
+    'drug': {'name': 'Keflex'},
+    'patient': {'allergies': [{'name': 'Penicillin'}], 'conditions': [{'name': 'Pregnancy'}]},
+    'options': {'include_cross_reactivity': True}
+}
+BATCH = {'drugs': [{'name': 'Advil'}, {'name': 'Amoxil'}, {'name': 'Keflex'}], 'patient': CHECK['patient']}
+
+def client(enabled=True):
+    return api_app.create_app({'MSGPACK': enabled}).test_client()
+
+def test_packed_responses_match_json():
+    c = client()
+    for method, url, body in [('get', '/v1/drug/Advil', None), ('get', '/v1/drug/NoSuchDrug', None),
+                              ('post', '/v1/check', CHECK), ('post', '/v1/batch/check', BATCH)]:
+        as_json = getattr(c, method)(url, json=body)
+        packed = getattr(c, method)(url, json=body, headers=PACKED)
+        assert packed.status_code == as_json.status_code
+        assert packed.content_type == 'application/msgpack'
+        assert msgpack.unpackb(packed.data) == as_json.json
+        assert 'Accept' in packed.vary and 'Accept' in as_json.vary
+
+def test_packed_request_bodies():
+    c = client()
+    for url, body in [('/v1/check', CHECK), ('/v1/batch/check', BATCH), ('/v1/check', {'drug': {}})]:
+        as_json = c.post(url, json=body)
+        for content_type in ('application/msgpack', 'application/x-msgpack'):
+            packed = c.post(url, data=msgpack.packb(body), content_type=content_type)
+            assert packed.status_code == as_json.status_code
+            assert packed.data == as_json.data
+
+def test_accept_negotiation():
+    c = client()
+    for accept, expected in [(None, 'application/json'),
+                             ('application/json, application/msgpack', 'application/json'),
+                             ('application/json;q=0.5, application/msgpack', 'application/msgpack'),
+                             ('application/x-msgpack', 'application/x-msgpack'),
+                             ('text/html', 'application/json')]:
+        headers = {'Accept': accept} if accept else {}
+        assert c.get('/v1/drug/Advil', headers=headers).content_type == expected
+    # only /v1/* is negotiated
+    metrics = c.get('/metrics', headers=PACKED)
+    assert metrics.content_type.startswith('text/plain')
+    assert 'Accept' not in metrics.vary
+
+def test_bad_bodies_rejected():
+    c = client()
+    assert c.post('/v1/check', data=b'{', content_type='application/json').status_code == 400
+    assert c.post('/v1/check', data=b'\xc1', content_type='application/msgpack').status_code == 400
+    # truncated, and extension types
+    assert c.post('/v1/check', data=msgpack.packb(CHECK)[:-1], content_type='application/msgpack').status_code == 400
+    ext = msgpack.packb({'drug': msgpack.ExtType(1, b'x')})
+    assert c.post('/v1/check', data=ext, content_type='application/msgpack').status_code == 400
+
+def test_msgpack_disabled():
+    c = client(False)
+    response = c.get('/v1/drug/Advil', headers=PACKED)
+    assert response.content_type == 'application/json'
+    assert 'Accept' not in response.vary
+    assert c.post('/v1/check', data=msgpack.packb(CHECK), content_type='application/msgpack').status_code == 415
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import ndc
+
+# NDC spellings and the canonical forms they must convert to: every 10-digit
+# layout hyphenated and bare, the 11-digit billing form, product NDCs, and
+# input that is not an NDC at all.
+
+# (spelling, canonical forms)
+FORMS = [
+    # 10-digit package NDCs: hyphens say which segment is short
+    ('1234-5678-90', ('01234567890',)),
+    ('12345-678-90', ('12345067890',)),
+    ('12345-6789-0', ('12345678900',)),
+    # the 11-digit 5-4-2 form, hyphenated or not, and the same code padded by hand
+    ('12345-6789-01', ('12345678901',)),
+    ('12345678901', ('12345678901',)),
+    ('01234-5678-90', ('01234567890',)),
+    ('12345-0678-90', ('12345067890',)),
+    ('12345-6789-00', ('12345678900',)),
+    (' 12345-6789-01 ', ('12345678901',)),
+    # a bare 10-digit code could be any layout
+    ('1234567890', ('01234567890', '12345067890', '12345678900')),
+    # product NDCs: labeler and product only
+    ('1234-5678', ('012345678',)),
+    ('12345-678', ('123450678',)),
+    ('12345-6789', ('123456789',)),
+    ('123456789', ('123456789',)),
+    ('12345678', ('012345678', '123450678')),
+    # not NDCs
+    ('', ()),
+    ('abc', ()),
+    ('1234-5678-9a', ()),
+    ('123456-789-01', ()),
+    ('12345-67890-1', ()),
+    ('1234-567-89', ()),
+    ('123-4567-8', ()),
+    ('12345--01', ()),
+    ('1-2-3-4', ()),
+    ('12345-6789-01-2', ()),
+    ('1234567', ()),
+    ('123456789012', ()),
+    ('１２３４５-６７８９-０１', ()),
+    (None, ()),
+    (12345678901, ()),
+]
+
+def test_canonical_forms():
+    for spelling, forms in FORMS:
+        assert ndc.canonical_forms(spelling) == forms, spelling
+
+def test_canonical():
+    for spelling, forms in FORMS:
+        assert ndc.canonical(spelling) == (forms[0] if len(forms) == 1 else None), spelling
+
+def test_ten_and_eleven_digit_forms_agree():
+    # each 10-digit layout and its zero-padded 11-digit spelling are one code
+    for ten, eleven in (('1234-5678-90', '01234-5678-90'), ('12345-678-90', '12345-0678-90'),
+                        ('12345-6789-0', '12345-6789-00')):
+        assert ndc.canonical(ten) == ndc.canonical(eleven) == ndc.canonical(eleven.replace('-', ''))
+
+def test_level_and_product():
+    assert ndc.level('12345678901') == ndc.PACKAGE
+    assert ndc.level('123456789') == ndc.PRODUCT
+    assert ndc.product('12345678901') == '123456789'
+    assert ndc.product(ndc.canonical('1234-5678-90')) == ndc.canonical('1234-5678')
+    assert ndc.product('123456789') == '123456789'
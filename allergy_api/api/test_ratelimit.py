@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as api_app
+import ratelimit
+
+# The token bucket of both rate limit stores on a fake clock: a full bucket
+# allows a burst, refills at the tier's rate up to its capacity, and a
+# rejected request takes nothing. Then the tier spec parser and the 429
+# answered by the API.
+
+class Clock:
+    """Stands in for the time module: both clocks at the same settable second"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+def stores(tmp):
+    return [ratelimit.MemoryStore(), ratelimit.SqliteStore(os.path.join(tmp, 'buckets.db'))]
+
+def test_burst_then_refill(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    with tempfile.TemporaryDirectory() as tmp:
+        for store in stores(tmp):
+            rate, burst = 2.0, 3.0
+            assert [store.take('a', rate, burst)[0] for _ in range(4)] == [True, True, True, False]
+            # a rejected take leaves the bucket as it was
+            assert store.take('a', rate, burst) == (False, 0.0)
+            clock.now += 0.5
+            assert store.take('a', rate, burst) == (True, 0.0)
+            assert not store.take('a', rate, burst)[0]
+            # a long idle period refills to the burst capacity, no further
+            clock.now += 3600
+            assert store.take('a', rate, burst) == (True, burst - 1)
+            # buckets are per key
+            assert store.take('b', rate, burst) == (True, burst - 1)
+
+def test_partial_tokens_accumulate(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    with tempfile.TemporaryDirectory() as tmp:
+        for store in stores(tmp):
+            assert store.take('a', 1.0, 1.0)[0]
+            for _ in range(3):
+                clock.now += 0.25
+                assert not store.take('a', 1.0, 1.0)[0]
+            clock.now += 0.25
+            assert store.take('a', 1.0, 1.0)[0]
+
+def test_sweep_forgets_idle_buckets(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    store = ratelimit.MemoryStore()
+    store.take('old', 1.0, 5.0)
+    clock.now += 10
+    store.take('new', 1.0, 5.0)
+    store.sweep(5.0)
+    assert set(store.buckets) == {'new'}
+
+def test_parse_tiers():
+    assert ratelimit.parse_tiers('free=0.5/10, pro=20') == {'free': (0.5, 10.0), 'pro': (20.0, 20.0)}
+    assert ratelimit.parse_tiers('slow=0.1') == {'slow': (0.1, 1.0)}
+    for spec in ('bad=0/10', 'bad=-1', 'bad=5/0.5', 'bad=x'):
+        try:
+            ratelimit.parse_tiers(spec)
+        except ValueError:
+            continue
+        raise AssertionError(spec)
+
+def test_retry_after():
+    assert ratelimit._retry_after(0.0, 2.0) == 1
+    assert ratelimit._retry_after(0.0, 0.1) == 10
+    assert ratelimit._retry_after(0.95, 0.1) == 1
+
+def test_api_answers_429_with_retry_after():
+    client = api_app.create_app({'RATE_LIMIT': True, 'RATE_LIMIT_TIERS': 'anonymous=0.01/2'}).test_client()
+    statuses = [client.get('/v1/drug/Advil').status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    response = client.get('/v1/drug/Advil')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '100'
+    assert response.get_json()['error'] == 'Rate limit exceeded'
+    # routes outside /v1/ are not limited
+    assert client.get('/metrics').status_code != 429
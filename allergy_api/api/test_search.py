@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as api_app
+import test_storage_parity
+
+# /v1/search/labels through the Flask test client, on a small hand-made
+# knowledge base: words match stemmed and all together, type filters warnings
+# from contraindications, quotes and stars in q are taken as plain text or
+# prefixes, and label_fts follows inserts, updates and deletes on
+# drug_warnings through its triggers.
+#
+# /v1/search on the shipped knowledge base with either storage: exact matches
+# rank before prefix matches before later-word matches, type filters results
+# but not facets, limit is bounded, and one- and two-character prefixes, whose
+# facets come from search_facets, find the seeded names they should.
+
+LABELS = '''
+    INSERT INTO drugs (id, name, rxcui) VALUES (1, 'Dozeoff', '1001'), (2, 'Sunblock', '1002'), (3, 'Kidneasy', '1003');
+    INSERT INTO conditions (id, name, normalized_name) VALUES (1, 'Renal impairment', 'renal impairment');
+    INSERT INTO drug_warnings (id, drug_id, type, text, source) VALUES
+        (1, 1, 'general', 'May cause drowsiness. Do not drive or operate machinery.', 'openFDA'),
+        (2, 2, 'specific', 'May cause photosensitivity. Avoid prolonged sunlight.', 'openFDA'),
+        (3, 3, 'contraindication', 'Do not use in patients with severe renal disease.', 'openFDA'),
+        (4, 2, 'general', 'Contains "oxybenzone" 5% *sensitizer*.', 'custom');
+    INSERT INTO drug_contraindications (id, drug_id, condition_id, evidence_level, description, source) VALUES
+        (1, 3, 1, 'high', 'Drowsy patients with renal impairment accumulate the drug.', 'custom');
+'''
+
+def search_app(tmp):
+    database = os.path.join(tmp, 'allergy_api.db')
+    conn = sqlite3.connect(database)
+    test_storage_parity.create_schema(conn)
+    conn.executescript(LABELS)
+    conn.commit()
+    return api_app.create_app({'DATABASE': database}), conn
+
+def labels(client, q, **args):
+    response = client.get('/v1/search/labels', query_string={'q': q, **args})
+    assert response.status_code == 200, response.json
+    return [(r['drug']['name'], r['type'], r['condition']) for r in response.json['results']]
+
+def test_fts_query():
+    assert api_app.fts_query('may cause') == '"may" "cause"'
+    assert api_app.fts_query('drows* "oxybenzone"') == '"drows"* """oxybenzone"""'
+    assert api_app.fts_query('a"b *c* **') == '"a""b" "*c"*'
+    assert api_app.fts_query('NEAR(a b) OR c') == '"NEAR(a" "b)" "OR" "c"'
+    assert api_app.fts_query('  * ** ') == ''
+
+def test_words_match_stemmed_and_together():
+    with tempfile.TemporaryDirectory() as tmp:
+        app, conn = search_app(tmp)
+        c = app.test_client()
+        # porter stemming: drowsiness and drowsy are one term
+        assert sorted(labels(c, 'drowsy')) == [('Dozeoff', 'warning', None),
+                                               ('Kidneasy', 'contraindication', 'Renal impairment')]
+        assert labels(c, 'drowsy machinery') == [('Dozeoff', 'warning', None)]
+        assert labels(c, 'drowsy sunlight') == []
+        assert labels(c, 'photo* sun*') == [('Sunblock', 'warning', None)]
+        assert labels(c, 'RENAL disease') == [('Kidneasy', 'contraindication', None)]
+        response = c.get('/v1/search/labels?q=photosensitivity').json
+        assert response['query'] == 'photosensitivity'
+        assert response['results'][0]['snippet'].startswith('May cause <mark>photosensitivity</mark>')
+        assert response['results'][0]['score'] > 0
+        conn.close()
+
+def test_type_filter():
+    with tempfile.TemporaryDirectory() as tmp:
+        app, conn = search_app(tmp)
+        c = app.test_client()
+        assert labels(c, 'renal', type='contraindication') == labels(c, 'renal')
+        assert len(labels(c, 'renal')) == 2
+        assert labels(c, 'renal', type='warning') == []
+        assert labels(c, 'drowsy', type='warning') == [('Dozeoff', 'warning', None)]
+        assert c.get('/v1/search/labels?q=renal&type=boxed').status_code == 400
+        conn.close()
+
+def test_quotes_and_stars_are_text():
+    with tempfile.TemporaryDirectory() as tmp:
+        app, conn = search_app(tmp)
+        c = app.test_client()
+        for q in ('"oxybenzone"', 'oxybenzone"', '*sensitizer*', '"oxyb*', 'sensitizer OR drowsy', 'NEAR(oxybenzone'):
+            assert c.get('/v1/search/labels', query_string={'q': q}).status_code == 200, q
+        assert labels(c, '"oxybenzone"') == [('Sunblock', 'warning', None)]
+        assert labels(c, '"oxyb*') == [('Sunblock', 'warning', None)]
+        assert labels(c, 'sensitizer OR drowsy') == []
+        for q in ('', '*', ' ** '):
+            assert c.get('/v1/search/labels', query_string={'q': q}).status_code == 400
+        conn.close()
+
+def test_pagination():
+    with tempfile.TemporaryDirectory() as tmp:
+        app, conn = search_app(tmp)
+        c = app.test_client()
+        everything = labels(c, 'do not')
+        assert len(everything) == 2
+        first = c.get('/v1/search/labels?q=do not&limit=1').json
+        assert first['pagination']['next_cursor'] is not None
+        cursor = first['pagination']['next_cursor']
+        rest = c.get('/v1/search/labels', query_string={'q': 'do not', 'cursor': cursor}).json
+        assert [r['drug']['name'] for r in first['results'] + rest['results']] == [name for name, _, _ in everything]
+        assert rest['pagination']['next_cursor'] is None
+        assert c.get('/v1/search/labels?q=do&cursor=garbage').status_code == 400
+        conn.close()
+
+def test_index_follows_drug_warnings():
+    with tempfile.TemporaryDirectory() as tmp:
+        app, conn = search_app(tmp)
+        c = app.test_client()
+        assert labels(c, 'hepatotoxicity') == []
+        conn.execute('''INSERT INTO drug_warnings (id, drug_id, type, text, source)
+                        VALUES (5, 3, 'specific', 'Risk of hepatotoxicity.', 'openFDA')''')
+        conn.commit()
+        assert labels(c, 'hepatotoxicity') == [('Kidneasy', 'warning', None)]
+        conn.execute("UPDATE drug_warnings SET text = 'Risk of nephrotoxicity.', type = 'contraindication' WHERE id = 5")
+        conn.commit()
+        assert labels(c, 'hepatotoxicity') == []
+        assert labels(c, 'nephrotoxicity') == [('Kidneasy', 'contraindication', None)]
+        conn.execute('DELETE FROM drug_warnings WHERE id IN (1, 5)')
+        conn.commit()
+        assert labels(c, 'nephrotoxicity') == []
+        assert labels(c, 'drowsy') == [('Kidneasy', 'contraindication', 'Renal impairment')]
+        assert conn.execute('SELECT COUNT(*) FROM label_fts').fetchone()[0] == 4
+        conn.close()
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def catalog(request):
+    return api_app.create_app({'STORAGE': request.param}).test_client()
+
+def catalog_search(client, q, **args):
+    response = client.get('/v1/search', query_string={'q': q, **args})
+    assert response.status_code == 200, response.json
+    return response.json
+
+def hits(client, q, **args):
+    return [(r['type'], r['name'], r['match']) for r in catalog_search(client, q, **args)['results']]
+
+def test_catalog_ranking(catalog):
+    assert hits(catalog, 'codeine') == [('ingredient', 'Codeine', 'exact'),
+                                        ('drug', 'Tylenol with Codeine', 'token'),
+                                        ('generic', 'Acetaminophen/Codeine', 'token')]
+    assert hits(catalog, 'Amoxicillin') == [('generic', 'Amoxicillin', 'exact'),
+                                            ('ingredient', 'Amoxicillin', 'exact'),
+                                            ('generic', 'Amoxicillin/Clavulanate', 'prefix')]
+    # matches resolve to the canonical drug, when there is one
+    drugs = {r['name']: r['drug'] and r['drug']['name'] for r in catalog_search(catalog, 'sulfa')['results']}
+    assert drugs == {'Sulfamethoxazole': 'Bactrim', 'Sulfamethoxazole/Trimethoprim': 'Bactrim'}
+    assert catalog_search(catalog, 'penicillin')['results'][0]['drug'] is None
+    # - / , ( ) are word breaks and case does not matter
+    assert hits(catalog, 'AMOXICILLIN/clav') == [('generic', 'Amoxicillin/Clavulanate', 'prefix')]
+    assert hits(catalog, 'with-codeine') == [('drug', 'Tylenol with Codeine', 'token')]
+
+def test_catalog_type_filter(catalog):
+    everything = catalog_search(catalog, 'amox')
+    generics = catalog_search(catalog, 'amox', type='generic')
+    assert [r['name'] for r in generics['results']] == ['Amoxicillin', 'Amoxicillin/Clavulanate']
+    assert generics['facets'] == everything['facets'] == {'brand': 0, 'drug': 1, 'generic': 2, 'ingredient': 1}
+    assert hits(catalog, 'amox', type='drug') == [('drug', 'Amoxil', 'prefix')]
+    assert hits(catalog, 'amox', type='brand') == []
+    assert catalog.get('/v1/search?q=amox&type=class').status_code == 400
+
+def test_catalog_limit(catalog):
+    assert len(catalog_search(catalog, 'a')['results']) == 10
+    assert len(catalog_search(catalog, 'a', limit=1)['results']) == 1
+    assert len(catalog_search(catalog, 'a', limit=100)['results']) == 14
+    for limit in ('0', '101', '-1', '1.5', 'ten', ''):
+        assert catalog.get('/v1/search', query_string={'q': 'a', 'limit': limit}).status_code == 400, limit
+    for q in ('', '  ', '-/,()'):
+        assert catalog.get('/v1/search', query_string={'q': q}).status_code == 400
+
+def test_catalog_short_prefixes(catalog):
+    assert hits(catalog, 'x') == [('drug', 'Xylocaine', 'prefix')]
+    assert hits(catalog, 'am') == [('generic', 'Amoxicillin', 'prefix'), ('ingredient', 'Amoxicillin', 'prefix'),
+                                   ('generic', 'Amoxicillin/Clavulanate', 'prefix'), ('drug', 'Amoxil', 'prefix'),
+                                   ('ingredient', 'Ampicillin', 'prefix')]
+    assert catalog_search(catalog, 'zz')['results'] == []
+    assert set(catalog_search(catalog, 'zz')['facets'].values()) == {0}
+    # precomputed facets of short prefixes agree with the entities found
+    for q in ('a', 'am', 'x', 'c', 'co', 'amo', 'codeine'):
+        response = catalog_search(catalog, q, limit=100)
+        counts = {t: 0 for t in api_app.CATALOG_TYPES}
+        for r in response['results']:
+            counts[r['type']] += 1
+        assert response['facets'] == counts, q
+    assert catalog_search(catalog, 'a')['facets'] == {'brand': 0, 'drug': 5, 'generic': 5, 'ingredient': 4}
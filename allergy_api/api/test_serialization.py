@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import pytest
+from flask.json.provider import DefaultJSONProvider
+
+import app as api_app
+import serialization
+
+# Response serialization through the Flask test client: with JSON_FRAGMENTS
+# and JSON_ENCODER in any combination responses are byte for byte what Flask's
+# own provider writes, including non-ASCII text and floats echoed from the
+# request, and options that become part of fragment cache keys are taken as
+# booleans, whatever value the client sends.
+
+CHECK = {'drug': {'name': 'Advil'}, 'patient': {'allergies': [{'name': 'NSAIDs'}]}}
+TEXT = {
+    'drug': {'name': 'Keflex'},
+    'patient': {'allergy_text': 'pénicilline, sulfa — ibuprofène', 'conditions': [{'name': 'Pregnancy'}]}
+}
+BATCH = {
+    'drugs': [{'name': 'Advil'}, {'name': 'Amoxil'}, {'name': 'Ibuprofène'}, {'rxcui': 1.5e-7},
+              {'rxcui': 0.00001}, {'rxcui': 2 ** 70}, {'ndc': '\x7f'}, {'name': 'Keflex'}],
+    'patient': TEXT['patient']
+}
+REQUESTS = [
+    ('post', '/v1/check', CHECK), ('post', '/v1/check', TEXT),
+    ('post', '/v1/check', {**CHECK, 'options': {'include_evidence': False, 'include_inactive_ingredients': False}}),
+    ('post', '/v1/batch/check', BATCH), ('post', '/v1/batch/check', {**BATCH, 'options': {'verdict_only': True}}),
+    ('get', '/v1/drug/Advil', None), ('get', '/v1/drug/Ibuprofène', None),
+    ('get', '/v1/allergy/Penicillin', None), ('get', '/v1/allergy/Pénicilline', None),
+    ('get', '/v1/search/labels?q=may cause', None), ('get', '/v1/search/labels?q=drowsiness ünïcode', None),
+    ('get', '/v1/search?q=pen', None), ('get', '/v1/search?q=ibuß', None)
+]
+ENCODERS = ['stdlib'] + (['orjson'] if serialization.orjson is not None else [])
+
+def responses(app):
+    c = app.test_client()
+    return [(response.status_code, response.data)
+            for response in (getattr(c, method)(url, json=body) for method, url, body in REQUESTS)]
+
+@pytest.fixture(scope='module')
+def expected():
+    app = api_app.create_app({'JSON_FRAGMENTS': False})
+    app.json = DefaultJSONProvider(app)
+    return responses(app)
+
+@pytest.mark.parametrize('encoder', ENCODERS)
+@pytest.mark.parametrize('fragments', [False, True])
+def test_responses_match_flask_provider(expected, encoder, fragments):
+    app = api_app.create_app({'JSON_ENCODER': encoder, 'JSON_FRAGMENTS': fragments})
+    # twice, so cached fragments are spliced in as well as built
+    assert responses(app) == expected
+    assert responses(app) == expected
+
+def test_fragment_keys_are_booleans():
+    app = api_app.create_app({'JSON_FRAGMENTS': True})
+    c = app.test_client()
+    expected = {flag: c.post('/v1/check', json={**CHECK, 'options': {
+        'include_evidence': flag, 'include_inactive_ingredients': flag}}).data for flag in (False, True)}
+    for value in ({}, [1], 'yes', 'also yes', 1, 0):
+        options = {'include_evidence': value, 'include_inactive_ingredients': value}
+        assert c.post('/v1/check', json={**CHECK, 'options': options}).data == expected[bool(value)]
+        batch = {'drugs': [CHECK['drug']], 'patient': CHECK['patient'], 'options': options}
+        assert c.post('/v1/batch/check', json=batch).status_code == 200
+    fragments = app.extensions['allergy_api'].fragments._fragments.get()
+    assert all(isinstance(flag, bool) for _, _, *flags in fragments for flag in flags)
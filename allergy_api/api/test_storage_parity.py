@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as api_app
+import ndc
+
+# Parity of the storage backends: a random catalog is generated into a fresh
+# SQLite database, the same generated requests are answered by the app on
+# each backend, and every response must be byte-identical. Runs under pytest
+# or as a script; SEED picks another catalog.
+
+SEED = int(os.environ.get('ALLERGY_API_PARITY_SEED', '50'))
+DATABASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'database')
+BACKENDS = ('sqlite', 'memory')
+
+SYLLABLES = ('am', 'ox', 'cil', 'lin', 'pro', 'fen', 'sul', 'fa', 'ceph', 'al', 'ex', 'met', 'for', 'zol',
+             'ib', 'u', 'nap', 'rox', 'en', 'ter', 'bu', 'tal', 'vir', 'dol')
+EVIDENCE = ('high', 'medium', 'low')
+
+def make_name(rng, taken):
+    """A made-up word not used yet"""
+    while True:
+        name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        if name.lower() not in taken:
+            taken.add(name.lower())
+            return name
+
+def make_ndc(rng):
+    return f"{rng.randint(0, 99999):05d}-{rng.randint(0, 9999):04d}-{rng.randint(0, 99):02d}"
+
+def create_schema(conn):
+    """The schema as setup_database.py applies it"""
+    with open(os.path.join(DATABASE_DIR, 'schema.sql')) as schema_file:
+        schema_sql = schema_file.read()
+    schema_sql = schema_sql.replace('SERIAL PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT')
+    schema_sql = schema_sql.replace('TIMESTAMP DEFAULT CURRENT_TIMESTAMP', 'TIMESTAMP DEFAULT (datetime(\'now\',\'localtime\'))')
+    conn.executescript(schema_sql)
+
+def generate_catalog(conn, rng):
+    """Random drugs, ingredients, classes, allergies and conditions linked every way the checks follow"""
+    taken = set()
+    catalog = {'drugs': [], 'allergies': [], 'conditions': [], 'synonyms': []}
+
+    class_ids = []
+    for n in range(12):
+        parent = rng.choice(class_ids) if class_ids and rng.random() < 0.7 else None
+        class_ids.append(conn.execute('INSERT INTO drug_classes (code, name, parent_id) VALUES (?, ?, ?)',
+                                      (f'C{n:02d}', make_name(rng, taken), parent)).lastrowid)
+
+    ingredient_ids = []
+    for _ in range(40):
+        name = make_name(rng, taken)
+        ingredient_id = conn.execute('INSERT INTO ingredients (name, rxcui, normalized_name) VALUES (?, ?, ?)',
+                                     (name, str(rng.randint(1000, 999999)), name.lower())).lastrowid
+        ingredient_ids.append(ingredient_id)
+        for class_id in rng.sample(class_ids, rng.choice((0, 1, 1, 2))):
+            conn.execute('INSERT INTO ingredient_classes (ingredient_id, class_id) VALUES (?, ?)',
+                         (ingredient_id, class_id))
+    for source_id, target_id in {tuple(rng.sample(ingredient_ids, 2)) for _ in range(30)}:
+        conn.execute('''
+            INSERT INTO cross_reactivity (source_id, target_id, evidence_level, description) VALUES (?, ?, ?, ?)
+        ''', (source_id, target_id, rng.choice(EVIDENCE), f'Reported with {rng.randint(1, 20)}% of patients'))
+
+    for _ in range(60):
+        name = make_name(rng, taken)
+        generic_name = make_name(rng, taken).lower() if rng.random() < 0.5 else None
+        drug_id = conn.execute('''
+            INSERT INTO drugs (name, rxcui, ndc, generic_name, is_otc, dosage_form) VALUES (?, ?, ?, ?, ?, ?)
+        ''', (name, str(rng.randint(1000, 999999)), make_ndc(rng) if rng.random() < 0.8 else None,
+              generic_name, rng.random() < 0.3, rng.choice(('tablet', 'capsule', 'solution')))).lastrowid
+        for ingredient_id in rng.sample(ingredient_ids, rng.randint(1, 4)):
+            conn.execute('INSERT INTO drug_ingredients (drug_id, ingredient_id, is_active) VALUES (?, ?, ?)',
+                         (drug_id, ingredient_id, rng.random() < 0.7))
+        for _ in range(rng.choice((0, 1, 2))):
+            conn.execute('INSERT INTO brand_names (drug_id, name) VALUES (?, ?)', (drug_id, make_name(rng, taken)))
+        for _ in range(rng.choice((0, 1, 2))):
+            conn.execute('INSERT INTO drug_warnings (drug_id, type, text, source) VALUES (?, ?, ?, ?)',
+                         (drug_id, rng.choice(('general', 'specific', 'contraindication')), f'Warning {rng.randint(1, 999)}',
+                          rng.choice(('openFDA', 'custom'))))
+        catalog['drugs'].append(drug_id)
+
+    for _ in range(15):
+        name = make_name(rng, taken)
+        allergy_id = conn.execute('INSERT INTO allergies (name, normalized_name, type) VALUES (?, ?, ?)',
+                                  (name, name.lower(), rng.choice(('drug', 'ingredient', 'class')))).lastrowid
+        for ingredient_id in rng.sample(ingredient_ids, rng.randint(0, 4)):
+            conn.execute('''
+                INSERT INTO allergy_ingredients (allergy_id, ingredient_id, relationship, evidence_level)
+                VALUES (?, ?, ?, ?)
+            ''', (allergy_id, ingredient_id, rng.choice(('exact', 'contains', 'cross_reactive')), rng.choice(EVIDENCE)))
+        for class_id in rng.sample(class_ids, rng.choice((0, 0, 1, 2))):
+            conn.execute('INSERT INTO allergy_classes (allergy_id, class_id, evidence_level) VALUES (?, ?, ?)',
+                         (allergy_id, class_id, rng.choice(EVIDENCE)))
+        catalog['allergies'].append(name)
+
+    condition_ids = []
+    for _ in range(10):
+        name = make_name(rng, taken)
+        condition_ids.append(conn.execute('INSERT INTO conditions (name, normalized_name) VALUES (?, ?)',
+                                          (name, name.lower())).lastrowid)
+        catalog['conditions'].append(name)
+    for drug_id, condition_id in {(rng.choice(catalog['drugs']), rng.choice(condition_ids)) for _ in range(50)}:
+        conn.execute('''
+            INSERT INTO drug_contraindications (drug_id, condition_id, evidence_level, description, source)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (drug_id, condition_id, rng.choice(EVIDENCE), f'Contraindicated {rng.randint(1, 999)}',
+              rng.choice(('openFDA', 'custom'))))
+
+    for entity_type, table in (('allergy', 'allergies'), ('ingredient', 'ingredients'), ('drug', 'drugs')):
+        ids = [row[0] for row in conn.execute(f'SELECT id FROM {table}')]
+        for entity_id in rng.sample(ids, 5):
+            synonym = make_name(rng, taken).upper()[:rng.randint(3, 5)]
+            if conn.execute('INSERT OR IGNORE INTO synonyms (entity_type, entity_id, name) VALUES (?, ?, ?)',
+                            (entity_type, entity_id, synonym)).rowcount:
+                catalog['synonyms'].append(synonym)
+    return catalog
+
+def derive(conn):
+    """The NDC index, RxCUI crosswalk and derived tables, as setup_database.py builds them"""
+    for drug_id, code in conn.execute('SELECT id, ndc FROM drugs WHERE ndc IS NOT NULL').fetchall():
+        canonical = ndc.canonical(code)
+        if canonical is not None:
+            for indexed in (canonical, ndc.product(canonical)):
+                conn.execute('INSERT OR IGNORE INTO ndc_codes (ndc, drug_id, level) VALUES (?, ?, ?)',
+                             (indexed, drug_id, ndc.level(indexed)))
+    conn.execute('''
+        INSERT OR IGNORE INTO rxcui_crosswalk (rxcui, drug_id)
+        SELECT rxcui, id FROM drugs WHERE rxcui IS NOT NULL
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO rxcui_crosswalk (rxcui, ingredient_id)
+        SELECT rxcui, id FROM ingredients WHERE rxcui IS NOT NULL
+    ''')
+    conn.commit()
+    with open(os.path.join(DATABASE_DIR, 'derived_data.sql')) as derived_file:
+        conn.executescript(derived_file.read())
+    conn.commit()
+
+def drug_identifiers(conn):
+    """Every way each drug can be named in a request: name, generic or brand name, RxCUI, NDC"""
+    identifiers = []
+    for drug in conn.execute('SELECT id, name, rxcui, ndc, generic_name FROM drugs'):
+        brands = [b[0] for b in conn.execute('SELECT name FROM brand_names WHERE drug_id = ?', (drug[0],))]
+        identifiers.append({'names': [n for n in (drug[1], drug[4]) if n] + brands, 'rxcui': drug[2], 'ndc': drug[3]})
+    return identifiers
+
+def generate_requests(conn, catalog, rng, count=150):
+    """(method, path, body) for checks, batch checks, drug and allergy lookups and searches over the catalog"""
+    identifiers = drug_identifiers(conn)
+    allergy_names = catalog['allergies'] + catalog['synonyms'] + ['Unknownium']
+    condition_names = catalog['conditions'] + ['Nothingitis']
+
+    def patient():
+        result = {
+            'allergies': [{'name': n} for n in rng.sample(allergy_names, rng.randint(0, 4))],
+            'conditions': [{'name': n} for n in rng.sample(condition_names, rng.randint(0, 3))]
+        }
+        if rng.random() < 0.3:
+            result['allergy_text'] = '; '.join(rng.sample(allergy_names, 2)) + ', nkda, ' + make_name(rng, set())
+        return result
+
+    def options():
+        return {
+            'include_inactive_ingredients': rng.random() < 0.7,
+            'include_cross_reactivity': rng.random() < 0.8,
+            'include_evidence': rng.random() < 0.7,
+            'verdict_only': rng.random() < 0.2
+        }
+
+    def drug(identifier):
+        choice = rng.random()
+        if choice < 0.2 and identifier['rxcui']:
+            return {'name': 'unused', 'rxcui': identifier['rxcui']}
+        if choice < 0.4 and identifier['ndc']:
+            return {'name': 'unused', 'ndc': identifier['ndc'].replace('-', '')}
+        return {'name': rng.choice(identifier['names'])}
+
+    requests = []
+    for _ in range(count):
+        fields = rng.choice(('', '?fields=safe', '?fields=drug,contraindications', '?fields=warnings,metadata'))
+        requests.append(('POST', '/v1/check' + fields,
+                         {'drug': drug(rng.choice(identifiers)), 'patient': patient(), 'options': options()}))
+    for _ in range(count // 5):
+        drugs = [drug(i) for i in rng.sample(identifiers, rng.randint(1, 20))] + [{'name': 'Notadrug'}]
+        fields = rng.choice(('', '?fields=safe', '?fields=drug,contraindications'))
+        requests.append(('POST', '/v1/batch/check' + fields, {'drugs': drugs, 'patient': patient(), 'options': options()}))
+    for identifier in identifiers:
+        requests.append(('GET', f"/v1/drug/{rng.choice(identifier['names'])}", None))
+        requests.append(('GET', f"/v1/drug/{identifier['rxcui']}?identifier_type=rxcui", None))
+        if identifier['ndc']:
+            requests.append(('GET', f"/v1/drug/{identifier['ndc']}?identifier_type=ndc", None))
+            product = identifier['ndc'].rsplit('-', 1)[0]
+            requests.append(('GET', f"/v1/drug/{product}?identifier_type=ndc", None))
+    requests.append(('GET', '/v1/drug/Notadrug', None))
+
+    # Allergy pages: whole lists, short pages, and cursors at random positions
+    for name in allergy_names:
+        requests.append(('GET', f'/v1/allergy/{name}', None))
+        requests.append(('GET', f'/v1/allergy/{name}?limit={rng.randint(1, 3)}', None))
+        positions = [rng.choice((None, 0, rng.randint(1, 45), rng.randint(1, 60) + 0.5)) for _ in range(3)]
+        requests.append(('GET', f'/v1/allergy/{name}?limit=2&cursor={api_app.encode_cursor(positions)}', None))
+
+    # Catalog searches of one, two and more characters, whole words and later
+    # words, with and without a type; and label searches
+    names = [n for identifier in identifiers for n in identifier['names']]
+    for name in rng.sample(names, 30):
+        words = name.lower().split()
+        q = rng.choice((name[:1], name[:2], name[:rng.randint(3, 6)], name, words[-1][:3]))
+        entity_type = rng.choice(('', '&type=drug', '&type=generic', '&type=brand', '&type=ingredient'))
+        requests.append(('GET', f'/v1/search?q={q}{entity_type}&limit={rng.randint(1, 12)}', None))
+    for q in ('Warning', 'Contraindicated', 'Warn*', 'Nothing', '"unbalanced'):
+        requests.append(('GET', f'/v1/search/labels?q={q}&limit=3', None))
+        requests.append(('GET', f'/v1/search/labels?q={q}&type=warning', None))
+    return requests
+
+def build_database(path, seed=SEED):
+    """A generated catalog at path, and requests over it"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    create_schema(conn)
+    catalog = generate_catalog(conn, rng)
+    derive(conn)
+    requests = generate_requests(conn, catalog, rng)
+    conn.close()
+    return requests
+
+def responses(database, backend, requests):
+    """(status, body) of each request, answered by the app on backend"""
+    app = api_app.create_app({
+        'DATABASE': database, 'STORAGE': backend,
+        'AUTH': False, 'RATE_LIMIT': False, 'SERVER_TIMING': False, 'SERVER_TIMING_METADATA': False
+    })
+    client = app.test_client()
+    result = []
+    for method, path, body in requests:
+        response = client.open(path, method=method, json=body)
+        result.append((response.status_code, response.get_data()))
+    return result
+
+def check_parity(seed=SEED):
+    """The requests on which the backends disagree, and the number of requests"""
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'parity.db')
+        requests = build_database(database, seed)
+        answers = {backend: responses(database, backend, requests) for backend in BACKENDS}
+    mismatches = [request for request, *results in zip(requests, *answers.values()) if len(set(results)) > 1]
+    return mismatches, len(requests)
+
+def test_storage_parity():
+    """Both backends answer every generated request identically"""
+    mismatches, count = check_parity()
+    assert not mismatches, f"{len(mismatches)} of {count} responses differ, first: {mismatches[0]}"
+
+def main():
+    seeds = [int(s) for s in sys.argv[1:]] or [SEED]
+    failed = False
+    for seed in seeds:
+        mismatches, count = check_parity(seed)
+        print(f"seed {seed}: {count - len(mismatches)} of {count} responses identical across {', '.join(BACKENDS)}")
+        for method, path, body in mismatches[:5]:
+            print(f"  differs: {method} {path} {body}")
+        failed = failed or bool(mismatches)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
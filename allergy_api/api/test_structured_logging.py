@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import structured_logging
+
+# Request summaries logged in debug mode: counts and the drug asked about,
+# and only the known options, as booleans, whatever else the body carries.
+
+def test_summary_keeps_known_options_only():
+    summary = structured_logging.summarize_request({
+        'drug': {'name': 'Advil'},
+        'patient': {'allergies': [{'name': 'Penicillin'}], 'conditions': [], 'allergy_text': 'sulfa'},
+        'options': {'include_evidence': {'note': 'patient is pregnant'}, 'verdict_only': 0,
+                    'include_cross_reactivity': 'yes', 'notes': 'penicillin allergy since 2001'}
+    })
+    assert summary == {
+        'allergy_count': 1,
+        'condition_count': 0,
+        'options': {'include_cross_reactivity': True, 'include_evidence': True, 'verdict_only': False},
+        'drug': 'Advil'
+    }
+
+def test_summary_of_odd_bodies():
+    assert structured_logging.summarize_request(None) == {'valid_body': False}
+    assert structured_logging.summarize_request([1]) == {'valid_body': False}
+    summary = structured_logging.summarize_request({'drugs': [{}, {}], 'options': ['verdict_only']})
+    assert summary == {'allergy_count': 0, 'condition_count': 0, 'options': {}, 'drug_count': 2}
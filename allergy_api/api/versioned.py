@@ -0,0 +1,48 @@
+import threading
+import time
+
+# Values built from the knowledge base and kept in memory. A value is rebuilt
+# when the knowledge base version (a counter bumped by triggers on every
+# change, see schema.sql) differs from the one it was built at; the version is
+# read at most once per check_interval. One thread rebuilds at a time: before
+# the first build the others wait for it, afterwards they keep using the
+# previous value until the new one is ready.
+
+
+class VersionedCache:
+    """A value built by build(), rebuilt when version_fn() changes"""
+
+    def __init__(self, build, version_fn, check_interval=60.0):
+        self.build = build
+        self.version_fn = version_fn
+        self.check_interval = check_interval
+        self._value = None
+        self._version = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def _due(self):
+        return self._checked is None or time.monotonic() - self._checked > self.check_interval
+
+    def get(self):
+        """The value, built or rebuilt first if the version check is due and the version changed"""
+        if not self._due():
+            return self._value
+        if not self._lock.acquire(blocking=self._value is None):
+            return self._value
+        try:
+            if self._due():
+                version = self.version_fn()
+                if version != self._version or self._value is None:
+                    self._value = self.build()
+                    self._version = version
+                self._checked = time.monotonic()
+        finally:
+            self._lock.release()
+        return self._value
+
+    def clear(self):
+        """Rebuild on the next get()"""
+        with self._lock:
+            self._version = None
+            self._checked = None
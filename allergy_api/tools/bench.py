@@ -0,0 +1,697 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+from flask.json.provider import DefaultJSONProvider
+
+import app
+import app_debug
+import auth
+import compression
+import matcher
+import ndc
+import ratelimit
+import serialization
+import structured_logging
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Benchmarks of the API, one per subcommand:
+#
+#   python allergy_api/tools/bench.py search pagination
+#
+# Benchmarks that add synthetic rows work on a scratch copy of the shipped
+# knowledge base, so the real one is never touched. Each prints what it
+# measures; the figures quoted in api_documentation.md come from here.
+
+DERIVED_DATA = os.path.join(os.path.dirname(app.DEFAULT_DATABASE), 'derived_data.sql')
+
+DRUGS = ['Advil', 'Aleve', 'Amoxil', 'Aspirin', 'Augmentin', 'Bactrim', 'Cipro', 'Dilantin', 'Erythrocin',
+         'Keflex', 'Levaquin', 'Prinivil', 'Tegretol', 'Tetracycline', 'Tylenol with Codeine', 'Vibramycin',
+         'Xylocaine', 'Zithromax']
+PATIENT = {
+    "allergies": [{"name": "Penicillin"}, {"name": "NSAIDs"}, {"name": "Sulfonamides"}],
+    "conditions": [{"name": "Pregnancy"}, {"name": "Renal impairment"}]
+}
+BATCH_SIZES = (1, 10, 50, 200)
+SYLLABLES = 'al am ba cef ci dol fen fla lo max mi na ol pra pro ril sar so ta tin va xa zo'.split()
+
+
+@contextlib.contextmanager
+def database_copy():
+    """The path of a scratch copy of the knowledge base, removed afterwards"""
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'allergy_api.db')
+        shutil.copy(app.DEFAULT_DATABASE, database)
+        yield database
+
+
+def rebuild_derived(conn):
+    with open(DERIVED_DATA) as derived_file:
+        conn.executescript(derived_file.read())
+
+
+def batch_payload(size):
+    return {"drugs": [{"name": DRUGS[i % len(DRUGS)]} for i in range(size)], "patient": PATIENT}
+
+
+def per_call(fn, duration=0.5):
+    """Seconds per call of fn(), calling it for about duration seconds after one warm-up call"""
+    fn()
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        fn()
+        count += 1
+    return (time.perf_counter() - start) / count
+
+
+def per_get(client, url, calls):
+    """Seconds per GET of url, over calls requests after one warm-up request"""
+    client.get(url)
+    start = time.perf_counter()
+    for _ in range(calls):
+        client.get(url)
+    return (time.perf_counter() - start) / calls
+
+
+# API-key authentication: verify() and the request hook for a cached key
+AUTH_CALLS = 200000
+
+def bench_auth():
+    with database_copy() as database:
+        api = app.create_app({'DATABASE': database, 'AUTH': True})
+        api_keys = api.extensions['allergy_api'].api_keys
+        key = auth.create_key(sqlite3.connect(database), 'benchmark')
+
+        api_keys.verify(key)
+        start = time.perf_counter()
+        for _ in range(AUTH_CALLS):
+            api_keys.verify(key)
+        elapsed = time.perf_counter() - start
+        print(f"{'verify(), cached':<28} {elapsed / AUTH_CALLS * 1e6:10.2f} us/call")
+        api_keys.clear()
+        start = time.perf_counter()
+        for _ in range(1000):
+            api_keys.lookup(auth.hash_key(key))
+        elapsed = time.perf_counter() - start
+        print(f"{'hash + DB lookup, uncached':<28} {elapsed / 1000 * 1e6:10.2f} us/call")
+
+        with api.test_request_context('/v1/drug/advil', headers={'X-API-Key': key}):
+            auth._before_request()
+            start = time.perf_counter()
+            for _ in range(AUTH_CALLS):
+                auth._before_request()
+            elapsed = time.perf_counter() - start
+        print(f"{'before_request hook, cached':<28} {elapsed / AUTH_CALLS * 1e6:10.2f} us/request")
+
+
+# Response compression: size and CPU time per encoding and level
+# Extra levels around the defaults in compression.LEVELS, for comparison
+EXTRA_LEVELS = {'gzip': (1, 9), 'br': (1, 11), 'zstd': (1, 10)}
+STREAM_CHUNK = 4096
+
+def streamed(body, encoding):
+    """Compress in STREAM_CHUNK pieces with a flush per chunk, as streamed responses are"""
+    stream = compression.ENCODINGS[encoding][1](compression.LEVELS[encoding])
+    out = [stream.chunk(body[i:i + STREAM_CHUNK]) for i in range(0, len(body), STREAM_CHUNK)]
+    out.append(stream.finish())
+    return b''.join(out)
+
+def compression_report(label, body):
+    print(f"{label}: {len(body)} bytes uncompressed")
+    for encoding in compression.ENCODINGS:
+        default = compression.LEVELS[encoding]
+        for level in sorted({default, *EXTRA_LEVELS[encoding]}):
+            size = len(compression.compress(body, encoding, level))
+            cost = per_call(lambda: compression.compress(body, encoding, level))
+            marker = '*' if level == default else ' '
+            print(f"  {encoding:<5} level {level:>2}{marker} {size:9d} bytes {len(body) / size:6.1f}x {cost * 1e6:9.1f} us")
+        size = len(streamed(body, encoding))
+        cost = per_call(lambda: streamed(body, encoding))
+        print(f"  {encoding:<5} streamed  {size:9d} bytes {len(body) / size:6.1f}x {cost * 1e6:9.1f} us")
+
+def bench_compression():
+    client = app.create_app().test_client()
+    print(f"encodings available: {', '.join(compression.ENCODINGS)}; * = default level")
+    for size in BATCH_SIZES:
+        compression_report(f"POST /v1/batch/check, {size} drugs",
+                           client.post('/v1/batch/check', json=batch_payload(size)).data)
+    compression_report("GET /v1/allergy/Penicillin", client.get('/v1/allergy/Penicillin').data)
+
+
+# Logging: request throughput with logging off, a synchronous handler and the
+# queue pipeline, against an instant sink and a slow one
+LOGGING_REQUESTS = 2000
+# Per-write latency of the simulated slow sink (network log shipper, busy disk)
+SLOW_SINK_DELAY = 0.0002
+LOGGED_CHECK = {
+    "drug": {"name": "Keflex"},
+    "patient": {
+        "allergies": [{"name": "Penicillin"}, {"name": "Sulfonamides"}],
+        "conditions": [{"name": "Pregnancy"}]
+    },
+    "options": {"include_cross_reactivity": True}
+}
+
+class SlowSink:
+    """File-like sink that takes delay seconds per write"""
+
+    def __init__(self):
+        self.delay = 0.0
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+
+    def flush(self):
+        pass
+
+def run_logged(api, label, handler):
+    root = logging.getLogger()
+    root.handlers = [handler] if handler else []
+    root.setLevel(logging.DEBUG if handler else logging.WARNING)
+    client = api.test_client()
+    for _ in range(50):
+        client.post('/v1/check', json=LOGGED_CHECK)
+    start = time.perf_counter()
+    for _ in range(LOGGING_REQUESTS):
+        client.post('/v1/check', json=LOGGED_CHECK)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {LOGGING_REQUESTS / elapsed:10.1f} req/s {elapsed / LOGGING_REQUESTS * 1e6:10.1f} us/req")
+
+def bench_logging():
+    sink = SlowSink()
+    queue_handler = structured_logging.configure(level='DEBUG', stream=sink)
+    # The previous setup: DEBUG records formatted and written in the request thread
+    sync_handler = logging.StreamHandler(sink)
+    sync_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    api = app_debug.create_app()
+
+    print(f"POST /v1/check x {LOGGING_REQUESTS} (Flask test client, app_debug)")
+    run_logged(api, "logging off", None)
+    for delay in (0.0, SLOW_SINK_DELAY):
+        sink.delay = delay
+        print(f"-- sink latency {delay * 1e6:.0f} us/write")
+        run_logged(api, "sync handler (DEBUG)", sync_handler)
+        run_logged(api, "queue + JSON (DEBUG)", queue_handler)
+        # let the listener drain before the next run
+        while not queue_handler.queue.empty():
+            time.sleep(0.01)
+    structured_logging.shutdown()
+    print(f"records dropped on full queue: {queue_handler.dropped}")
+
+
+# Label tagging: synthetic label paragraphs, filler words from a
+# Zipf-distributed vocabulary with the names of our conditions and allergies
+# mixed in. Each dictionary adds synthetic multi-word phrases to those names;
+# the automaton's time per paragraph should not grow with it. The regex
+# methods grow with it, so they only run on a sample of the paragraphs, and
+# only up to REGEX_PHRASES phrases.
+PARAGRAPHS = 20000
+VOCABULARY = 20000
+MENTIONS = 2
+DICTIONARIES = [0, 1000, 10000, 100000]
+REGEX_SAMPLE = 200
+REGEX_PHRASES = 20000
+
+def known_names():
+    conn = sqlite3.connect(app.DEFAULT_DATABASE)
+    rows = conn.execute('SELECT name FROM conditions UNION ALL SELECT name FROM allergies').fetchall()
+    conn.close()
+    return [name for name, in rows]
+
+def label_corpus(rng, known):
+    words = [f'w{n}' for n in range(VOCABULARY)]
+    weights = [1 / (n + 1) for n in range(VOCABULARY)]
+    paragraphs = []
+    for _ in range(PARAGRAPHS):
+        text = rng.choices(words, weights, k=rng.randint(40, 200))
+        for _ in range(rng.randint(0, MENTIONS)):
+            text.insert(rng.randrange(len(text)), rng.choice(known).lower())
+        paragraphs.append(' '.join(text).capitalize() + '.')
+    return paragraphs
+
+def per_paragraph(find, paragraphs):
+    start = time.perf_counter()
+    found = [find(p) for p in paragraphs]
+    return (time.perf_counter() - start) / len(paragraphs), found
+
+def bench_matcher():
+    rng = random.Random(0)
+    known = known_names()
+    paragraphs = label_corpus(rng, known)
+    chars = sum(map(len, paragraphs))
+    print(f"{PARAGRAPHS} label paragraphs, {chars / PARAGRAPHS:.0f} characters each")
+
+    for extra in DICTIONARIES:
+        phrases = known + [' '.join(''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4)))
+                                    for _ in range(rng.randint(1, 3))) for _ in range(extra)]
+        start = time.perf_counter()
+        automaton = matcher.Automaton((p, p.lower()) for p in phrases)
+        built = time.perf_counter() - start
+        print(f"  {len(phrases)} phrases, {len(automaton)} states, compiled in {built * 1e3:.0f} ms")
+
+        elapsed, found = per_paragraph(automaton.values, paragraphs)
+        print(f"    {'automaton':<24} {elapsed * 1e6:9.1f} us/paragraph  {chars / PARAGRAPHS / elapsed / 1e6:6.1f} Mchar/s")
+
+        if len(phrases) > REGEX_PHRASES:
+            continue
+        # Whole words, case-insensitive, as the automaton matches these ASCII phrases
+        patterns = [(p.lower(), re.compile(r'(?<![^\W_])' + re.escape(p.lower()) + r'(?![^\W_])')) for p in phrases]
+        sample = [p.lower() for p in paragraphs[:REGEX_SAMPLE]]
+        elapsed, regex_found = per_paragraph(
+            lambda text: {p for p, pattern in patterns if pattern.search(text)}, sample)
+        print(f"    {'one regex per phrase':<24} {elapsed * 1e6:9.1f} us/paragraph")
+        assert regex_found == found[:REGEX_SAMPLE]
+
+        # One alternation of every phrase, longest first; it cannot report overlapping matches
+        alternation = re.compile(r'(?<![^\W_])(?:' + '|'.join(re.escape(p) for p, _ in sorted(
+            patterns, key=lambda item: -len(item[0]))) + r')(?![^\W_])')
+        elapsed, _ = per_paragraph(lambda text: set(alternation.findall(text)), sample)
+        print(f"    {'one alternation regex':<24} {elapsed * 1e6:9.1f} us/paragraph")
+
+
+# MessagePack: size and codec time against JSON, and whole requests
+def codecs():
+    # name, encode, decode
+    yield "json (stdlib)", lambda o: json.dumps(o, sort_keys=True, separators=(',', ':')).encode(), json.loads
+    if orjson is not None:
+        yield "json (orjson)", lambda o: orjson.dumps(o, option=orjson.OPT_SORT_KEYS), orjson.loads
+    yield "msgpack", msgpack.packb, msgpack.unpackb
+
+def run_negotiated(client, label, headers):
+    """Time per whole /v1/batch/check request"""
+    payload = batch_payload(200)
+    body = msgpack.packb(payload) if 'Content-Type' in headers else json.dumps(payload).encode()
+    headers.setdefault('Content-Type', 'application/json')
+    elapsed = per_call(lambda: client.post('/v1/batch/check', data=body, headers=headers))
+    print(f"  {label:<22} {elapsed * 1e3:9.2f} ms/req")
+
+def bench_msgpack():
+    if msgpack is None:
+        sys.exit('msgpack is not installed')
+    client = app.create_app().test_client()
+    for size in BATCH_SIZES:
+        # the object /v1/batch/check serializes, fragments expanded
+        obj = client.post('/v1/batch/check', json=batch_payload(size)).get_json()
+        print(f"/v1/batch/check response, {size} drugs")
+        for label, encode, decode in codecs():
+            encoded = encode(obj)
+            assert decode(encoded) == obj
+            encode_time = per_call(lambda: encode(obj))
+            decode_time = per_call(lambda: decode(encoded))
+            print(f"  {label:<16} {len(encoded):8} B  gzip {len(zlib.compress(encoded, 6)):6} B"
+                  f"   encode {encode_time * 1e6:8.1f} us   decode {decode_time * 1e6:8.1f} us")
+
+    print("POST /v1/batch/check, 200 drugs, through the app")
+    run_negotiated(client, "JSON in, JSON out", {})
+    run_negotiated(client, "msgpack in and out", {'Content-Type': 'application/msgpack', 'Accept': 'application/msgpack'})
+    packed = client.post('/v1/batch/check', data=msgpack.packb(batch_payload(200)),
+                         headers={'Content-Type': 'application/msgpack', 'Accept': 'application/msgpack'})
+    same = msgpack.unpackb(packed.data) == client.post('/v1/batch/check', json=batch_payload(200)).get_json()
+    print(f"  same response object: {'yes' if same else 'NO'}")
+
+
+# NDC resolution: synthetic drugs, each with one product NDC and several
+# package NDCs, and a batch of NDCs for them in the spellings pharmacy feeds use
+NDC_DRUGS = 100000
+NDC_PACKAGES = 3
+NDC_BATCH = 2000
+NDC_CALLS = 20
+
+def ndc_spellings(code):
+    """An 11-digit package NDC as 5-4-2, as unhyphenated 11 digits, and as its 10-digit hyphenated form"""
+    labeler, product, package = code[:5], code[5:9], code[9:]
+    if labeler[0] == '0':
+        ten = f'{labeler[1:]}-{product}-{package}'
+    elif product[0] == '0':
+        ten = f'{labeler}-{product[1:]}-{package}'
+    else:
+        ten = f'{labeler}-{product}-{package[1:]}'
+    return [f'{labeler}-{product}-{package}', code, ten]
+
+def add_ndcs(database):
+    conn = sqlite3.connect(database)
+    packages = []
+    rows = []
+    for n in range(NDC_DRUGS):
+        drug_id = conn.execute('INSERT INTO drugs (name) VALUES (?)', (f'Synthetic {n}',)).lastrowid
+        # one of the three segments padded, as in the 10-digit layouts
+        short = n % 3
+        a, b = divmod(n, 100)
+        labeler = f'0{a + 1000:04d}' if short == 0 else f'{a + 10000 * short:05d}'
+        product = f'0{b + 100:03d}' if short == 1 else f'{b + 1000:04d}'
+        rows.append((labeler + product, drug_id, ndc.PRODUCT))
+        for p in range(NDC_PACKAGES):
+            code = labeler + product + (f'0{p}' if short == 2 else f'{p + 10:02d}')
+            rows.append((code, drug_id, ndc.PACKAGE))
+            packages.append(code)
+    conn.executemany('INSERT INTO ndc_codes (ndc, drug_id, level) VALUES (?, ?, ?)', rows)
+    conn.commit()
+    print(f"{conn.execute('SELECT COUNT(*) FROM ndc_codes').fetchone()[0]} NDCs indexed, batches of {NDC_BATCH}")
+    conn.close()
+    return packages
+
+def bench_ndc():
+    rng = random.Random(0)
+    with database_copy() as database:
+        packages = add_ndcs(database)
+        batch = [rng.choice(ndc_spellings(code)) for code in rng.sample(packages, NDC_BATCH)]
+        api = app.create_app({'DATABASE': database})
+
+        start = time.perf_counter()
+        for _ in range(NDC_CALLS):
+            found = api.extensions['allergy_api'].store.drugs_by_ndcs(batch)
+        elapsed = (time.perf_counter() - start) / NDC_CALLS
+        print(f"  {'resolve only':<28} {len(found):>5} found  {NDC_BATCH / elapsed:10.0f} NDCs/s")
+
+        with api.app_context():
+            start = time.perf_counter()
+            for code in batch[:200]:
+                app.find_drug_by_identifier(code, 'ndc')
+            elapsed = (time.perf_counter() - start) / 200
+        print(f"  {'one lookup per NDC':<28} {'':>11}  {1 / elapsed:10.0f} NDCs/s")
+
+        client = api.test_client()
+        body = {'drugs': [{'ndc': code} for code in batch], 'options': {'verdict_only': True}}
+        results = client.post('/v1/batch/check', json=body).json['results']
+        start = time.perf_counter()
+        for _ in range(NDC_CALLS // 4):
+            client.post('/v1/batch/check', json=body)
+        elapsed = (time.perf_counter() - start) / (NDC_CALLS // 4)
+        resolved = sum('error' not in r for r in results)
+        print(f"  {'/v1/batch/check verdict_only':<28} {resolved:>5} found  {NDC_BATCH / elapsed:10.0f} NDCs/s")
+
+
+# Allergy pages: related drugs added to one allergy to model a class allergy at RxNorm scale
+PAGED_DRUGS = 50000
+PAGED_ALLERGY = 'Penicillin'
+PAGE_LIMIT = 100
+PAGE_CALLS = 200
+
+def add_related_drugs(database):
+    conn = sqlite3.connect(database)
+    ingredient_id = conn.execute('''
+        SELECT ai.ingredient_id FROM allergy_members ai
+        JOIN allergies a ON a.id = ai.allergy_id
+        WHERE a.name = ? LIMIT 1
+    ''', (PAGED_ALLERGY,)).fetchone()[0]
+    for n in range(PAGED_DRUGS):
+        drug_id = conn.execute('INSERT INTO drugs (name) VALUES (?)', (f'Synthetic {n}',)).lastrowid
+        conn.execute('INSERT INTO drug_ingredients (drug_id, ingredient_id, is_active) VALUES (?, ?, 1)',
+                     (drug_id, ingredient_id))
+    conn.commit()
+    rebuild_derived(conn)
+    conn.close()
+
+def unpaginated(conn, allergy_id):
+    """The related drugs query /v1/allergy ran before pagination"""
+    return conn.execute('''
+        SELECT d.*,
+               CASE
+                   WHEN ai.relationship = 'exact' THEN 'contains'
+                   WHEN ai.relationship = 'cross_reactive' THEN 'may_contain'
+                   ELSE ai.relationship
+               END as relationship
+        FROM drugs d
+        JOIN drug_ingredients di ON d.id = di.drug_id
+        JOIN allergy_members ai ON di.ingredient_id = ai.ingredient_id
+        WHERE ai.allergy_id = ?
+    ''', (allergy_id,)).fetchall()
+
+def bench_pagination():
+    with database_copy() as database:
+        add_related_drugs(database)
+        client = app.create_app({'DATABASE': database}).test_client()
+        base = f'/v1/allergy/{PAGED_ALLERGY}?limit={PAGE_LIMIT}'
+
+        # Walk every page once to collect the cursors
+        cursors = [None]
+        while True:
+            url = base + (f'&cursor={cursors[-1]}' if cursors[-1] else '')
+            cursor = client.get(url).json['pagination']['next_cursor']
+            if not cursor:
+                break
+            cursors.append(cursor)
+        total = client.get(base).json['pagination']['totals']['related_drugs']
+        print(f"GET /v1/allergy/{PAGED_ALLERGY}: {total} related drugs, {len(cursors)} pages of {PAGE_LIMIT}")
+
+        for label, cursor in [('first page', cursors[0]), ('middle page', cursors[len(cursors) // 2]),
+                              ('last page', cursors[-1])]:
+            url = base + (f'&cursor={cursor}' if cursor else '')
+            print(f"  {label:<22} {per_get(client, url, PAGE_CALLS) * 1e3:9.2f} ms/req")
+
+        conn = sqlite3.connect(database)
+        allergy_id = conn.execute('SELECT id FROM allergies WHERE name = ?', (PAGED_ALLERGY,)).fetchone()[0]
+        start = time.perf_counter()
+        for _ in range(10):
+            unpaginated(conn, allergy_id)
+        print(f"  {'unpaginated query only':<22} {(time.perf_counter() - start) / 10 * 1e3:9.2f} ms/req")
+        conn.close()
+
+
+# Rate limiting: take() on both bucket stores, and a shared bucket across processes
+TAKES = 200000
+BUCKET_KEYS = 10000
+THREADS = 8
+# High enough that nothing is throttled; this measures the bookkeeping cost
+RATE, BURST = 1e9, 1e9
+
+def run_takes(label, store, threads=1, takes=TAKES):
+    per_thread = takes // threads
+
+    def worker(offset):
+        take = store.take
+        for i in range(per_thread):
+            take(f'key{(i + offset) % BUCKET_KEYS}', RATE, BURST)
+
+    workers = [threading.Thread(target=worker, args=(n * 7919,)) for n in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    total = per_thread * threads
+    print(f"{label:<34} {elapsed / total * 1e6:8.2f} us/take {total / elapsed:12.0f} takes/s")
+
+def drain(path, results):
+    store = ratelimit.SqliteStore(path)
+    allowed = sum(store.take('shared', 0.001, 100)[0] for _ in range(100))
+    results.put(allowed)
+
+def shared_store_check(path):
+    """Four processes drain one bucket of 100 tokens; together they must get exactly 100"""
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=drain, args=(path, results)) for _ in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    allowed = sum(results.get() for _ in procs)
+    print(f"shared store, 4 processes x 100 takes on a 100-token bucket: {allowed} allowed")
+
+def bench_ratelimit():
+    print(f"token bucket take() over {BUCKET_KEYS} keys")
+    run_takes("memory, 1 thread", ratelimit.MemoryStore())
+    run_takes(f"memory, {THREADS} threads", ratelimit.MemoryStore(), THREADS)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'buckets.db')
+        run_takes("sqlite, 1 thread", ratelimit.SqliteStore(path), takes=TAKES // 10)
+        run_takes(f"sqlite, {THREADS} threads", ratelimit.SqliteStore(path), THREADS, takes=TAKES // 10)
+        shared_store_check(path)
+
+
+# Search: synthetic label documents added on top of the real ones, filler
+# text drawn from a Zipf-distributed vocabulary with clinical phrases mixed in
+# at the given rates. The cost of a query grows with its number of matches,
+# so the last query, the most common filler word, is the worst case. For
+# /v1/search, synthetic drugs with a generic name each, brand names and
+# ingredients, named from random syllables; the short prefix queries match
+# the most keys.
+EXTRA_LABELS = 100000
+PHRASES = {
+    'gastrointestinal bleeding': 0.03,
+    'kidney damage': 0.02,
+    'hepatotoxicity': 0.01,
+    'serotonin syndrome': 0.005,
+    'qt prolongation': 0.005,
+}
+SEARCH_CALLS = 50
+LABEL_QUERIES = ['bleeding', 'kidney damage', 'hepato*', 'serotonin syndrome', 'qt prolongation', 'w0']
+EXTRA_DRUGS = 30000
+EXTRA_BRANDS = 20000
+EXTRA_INGREDIENTS = 20000
+CATALOG_QUERIES = ['a', 'am', 'amoxicillin', 'cefmi', 'codeine', 'zovaxa']
+
+def add_search_documents(database):
+    rng = random.Random(0)
+    words = [f'w{n}' for n in range(VOCABULARY)]
+    weights = [1 / (n + 1) for n in range(VOCABULARY)]
+
+    def label():
+        text = rng.choices(words, weights, k=rng.randint(15, 60))
+        for phrase, rate in PHRASES.items():
+            if rng.random() < rate:
+                text.insert(rng.randrange(len(text)), phrase)
+        return ' '.join(text).capitalize() + '.'
+
+    def name(words):
+        return ' '.join(''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(words)).title()
+
+    conn = sqlite3.connect(database)
+    drug_ids = [row[0] for row in conn.execute('SELECT id FROM drugs')]
+    conn.executemany(
+        'INSERT INTO drug_warnings (drug_id, text, type) VALUES (?, ?, ?)',
+        ((rng.choice(drug_ids), label(), 'general') for _ in range(EXTRA_LABELS))
+    )
+    conn.executemany('INSERT INTO drugs (name, generic_name) VALUES (?, ?)',
+                     ((name(rng.randint(1, 3)), name(rng.randint(1, 2))) for _ in range(EXTRA_DRUGS)))
+    drug_ids = [row[0] for row in conn.execute('SELECT id FROM drugs')]
+    conn.executemany('INSERT INTO brand_names (drug_id, name) VALUES (?, ?)',
+                     ((rng.choice(drug_ids), name(rng.randint(1, 2))) for _ in range(EXTRA_BRANDS)))
+    conn.executemany('INSERT INTO ingredients (name) VALUES (?)',
+                     ((name(rng.randint(1, 2)),) for _ in range(EXTRA_INGREDIENTS)))
+    conn.commit()
+    rebuild_derived(conn)
+    conn.close()
+
+def like_scan(conn, q):
+    """A substring scan of both tables, the alternative to the FTS index"""
+    return conn.execute('''
+        SELECT id FROM drug_warnings WHERE text LIKE ?
+        UNION ALL
+        SELECT id FROM drug_contraindications WHERE description LIKE ?
+    ''', (f'%{q}%', f'%{q}%')).fetchall()
+
+def bench_search():
+    with database_copy() as database:
+        add_search_documents(database)
+        client = app.create_app({'DATABASE': database}).test_client()
+        conn = sqlite3.connect(database)
+        total = conn.execute('SELECT COUNT(*) FROM label_fts').fetchone()[0]
+        print(f"GET /v1/search/labels over {total} label documents")
+
+        for q in LABEL_QUERIES:
+            matches = conn.execute('SELECT COUNT(*) FROM label_fts WHERE label_fts MATCH ?',
+                                   (app.fts_query(q),)).fetchone()[0]
+            url = f'/v1/search/labels?q={q}'
+            first = client.get(url).json
+            second = f"{url}&cursor={first['pagination']['next_cursor']}" if first['pagination']['next_cursor'] else url
+            print(f"  {q:<20} {matches:>7} matches  first page {per_get(client, url, SEARCH_CALLS) * 1e3:7.2f} ms/req"
+                  f"  second page {per_get(client, second, SEARCH_CALLS) * 1e3:7.2f} ms/req")
+
+        start = time.perf_counter()
+        for _ in range(10):
+            like_scan(conn, 'kidney damage')
+        print(f"  {'LIKE scan only':<20} {(time.perf_counter() - start) / 10 * 1e3:43.2f} ms/req")
+
+        entities = conn.execute('SELECT COUNT(*) FROM search_index WHERE whole = 1').fetchone()[0]
+        print(f"GET /v1/search over {entities} catalog names")
+        for q in CATALOG_QUERIES:
+            url = f'/v1/search?q={q}'
+            facets = client.get(url).json['facets']
+            print(f"  {q:<20} {sum(facets.values()):>7} matches  {per_get(client, url, SEARCH_CALLS) * 1e3:7.2f} ms/req")
+        conn.close()
+
+
+# Serialization: the JSON provider, encoder and fragment cache, per request
+# and for the serialization step alone, with identical bytes from each
+SERIALIZATION_DURATION = 2.0
+# name, JSON provider, encoder, fragments
+CONFIGS = [
+    ("jsonify (before)", DefaultJSONProvider, 'stdlib', False),
+    ("stdlib + fragments", serialization.FastJSONProvider, 'stdlib', True),
+    ("orjson", serialization.FastJSONProvider, 'orjson', False),
+    ("orjson + fragments", serialization.FastJSONProvider, 'orjson', True),
+]
+
+def serialize_cost(api, client, payload):
+    """Time to serialize the response object the view built, excluding the queries"""
+    captured = []
+    jsonify = app.jsonify
+    app.jsonify = lambda obj: captured.append(obj) or jsonify(obj)
+    try:
+        client.post('/v1/batch/check', json=payload)
+    finally:
+        app.jsonify = jsonify
+    obj = captured[0]
+    with api.app_context():
+        return per_call(lambda: api.json.response(obj), SERIALIZATION_DURATION / 4)
+
+def bench_serialization():
+    api = app.create_app()
+    client = api.test_client()
+    check = {"drug": {"name": "Keflex"}, "patient": PATIENT}
+    for size in BATCH_SIZES:
+        payload = batch_payload(size)
+        bodies = set()
+        print(f"POST /v1/batch/check, {size} drugs")
+        baseline = None
+        for label, provider, encoder, fragments in CONFIGS:
+            api.config['JSON_ENCODER'] = encoder
+            serialization.init_app(api)
+            api.json = provider(api)
+            api.extensions['allergy_api'].fragments.enabled = fragments
+            api.extensions['allergy_api'].fragments.clear()
+            elapsed = per_call(lambda: client.post('/v1/batch/check', json=payload), SERIALIZATION_DURATION)
+            serialize = serialize_cost(api, client, payload)
+            baseline = baseline or (elapsed, serialize)
+            bodies.add(client.post('/v1/batch/check', json=payload).data)
+            bodies.add(client.post('/v1/check', json=check).data)
+            print(f"  {label:<22} {elapsed * 1e3:9.2f} ms/req {baseline[0] / elapsed:6.2f}x"
+                  f"   serialize {serialize * 1e6:9.1f} us {baseline[1] / serialize:6.2f}x")
+        # one batch body and one check body across all configurations
+        print(f"  identical output: {'yes' if len(bodies) == 2 else 'NO'}")
+
+
+BENCHMARKS = {
+    'auth': bench_auth,
+    'compression': bench_compression,
+    'logging': bench_logging,
+    'matcher': bench_matcher,
+    'msgpack': bench_msgpack,
+    'ndc': bench_ndc,
+    'pagination': bench_pagination,
+    'ratelimit': bench_ratelimit,
+    'search': bench_search,
+    'serialization': bench_serialization,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the Allergy/Contraindication Checker API.')
+    parser.add_argument('benchmarks', nargs='+', choices=sorted(BENCHMARKS), metavar='benchmark',
+                        help=f"one or more of: {', '.join(sorted(BENCHMARKS))}")
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        print(f"== {name}")
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main()
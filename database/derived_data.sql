@@ -0,0 +1,139 @@
+-- Rebuilds the derived tables from the base tables. Run after loading data:
+--   sqlite3 database/allergy_api.db < database/derived_data.sql
+
+BEGIN;
+
+-- Number the drug class tree: tree_left in pre-order, tree_right the last
+-- tree_left in the subtree. Paths are fixed-width, so sorting them gives
+-- pre-order, and a subtree's paths all sort between its path and path || '0'.
+DROP TABLE IF EXISTS temp.class_tree;
+CREATE TEMP TABLE class_tree AS
+WITH RECURSIVE tree(id, path) AS (
+    SELECT id, printf('%010d', id) FROM drug_classes WHERE parent_id IS NULL
+    UNION ALL
+    SELECT c.id, tree.path || '/' || printf('%010d', c.id)
+    FROM drug_classes c JOIN tree ON c.parent_id = tree.id
+)
+SELECT id, path, ROW_NUMBER() OVER (ORDER BY path) AS position FROM tree;
+CREATE INDEX temp.idx_class_tree_path ON class_tree(path);
+
+UPDATE drug_classes SET
+    tree_left = (SELECT position FROM class_tree t WHERE t.id = drug_classes.id),
+    tree_right = (
+        SELECT t.position + (SELECT COUNT(*) FROM class_tree d WHERE d.path > t.path AND d.path < t.path || '0')
+        FROM class_tree t WHERE t.id = drug_classes.id
+    );
+DROP TABLE temp.class_tree;
+
+DELETE FROM allergy_members;
+DELETE FROM allergy_drugs;
+DELETE FROM allergy_cross_reactivity;
+DELETE FROM allergy_stats;
+
+-- A class allergy's ingredient under several of its classes keeps the strongest evidence
+INSERT INTO allergy_members (allergy_id, ingredient_id, relationship, evidence_level)
+SELECT allergy_id, ingredient_id, relationship, evidence_level
+FROM allergy_ingredients
+UNION ALL
+SELECT ac.allergy_id, ic.ingredient_id, 'exact',
+       CASE MAX(CASE ac.evidence_level WHEN 'high' THEN 3 WHEN 'medium' THEN 2 ELSE 1 END)
+           WHEN 3 THEN 'high' WHEN 2 THEN 'medium' ELSE 'low'
+       END
+FROM allergy_classes ac
+JOIN drug_classes c ON c.id = ac.class_id
+JOIN drug_classes sub ON sub.tree_left BETWEEN c.tree_left AND c.tree_right
+JOIN ingredient_classes ic ON ic.class_id = sub.id
+WHERE NOT EXISTS (
+    SELECT 1 FROM allergy_ingredients ai
+    WHERE ai.allergy_id = ac.allergy_id AND ai.ingredient_id = ic.ingredient_id
+)
+GROUP BY ac.allergy_id, ic.ingredient_id;
+
+-- A drug matching an allergy through several ingredients keeps the strongest relationship
+INSERT INTO allergy_drugs (allergy_id, drug_id, relationship)
+SELECT ai.allergy_id, di.drug_id,
+       MIN(CASE
+               WHEN ai.relationship = 'exact' THEN 'contains'
+               WHEN ai.relationship = 'cross_reactive' THEN 'may_contain'
+               ELSE ai.relationship
+           END)
+FROM allergy_members ai
+JOIN drug_ingredients di ON di.ingredient_id = ai.ingredient_id
+GROUP BY ai.allergy_id, di.drug_id;
+
+INSERT INTO allergy_cross_reactivity (allergy_id, cross_reactivity_id)
+SELECT DISTINCT ai.allergy_id, cr.id
+FROM allergy_members ai
+JOIN cross_reactivity cr ON cr.source_id = ai.ingredient_id;
+
+INSERT INTO allergy_stats (allergy_id, ingredient_count, drug_count, cross_reactivity_count)
+SELECT a.id,
+       (SELECT COUNT(*) FROM allergy_members WHERE allergy_id = a.id),
+       (SELECT COUNT(*) FROM allergy_drugs WHERE allergy_id = a.id),
+       (SELECT COUNT(*) FROM allergy_cross_reactivity WHERE allergy_id = a.id)
+FROM allergies a;
+
+-- Catalog search keys: lowercased, with - / , ( ) as word breaks and runs of
+-- spaces collapsed, as search_key() in the API does. An ingredient resolves
+-- to the drug with the fewest active ingredients that has it as one, and a
+-- generic name equal to the drug name is not indexed twice.
+DELETE FROM search_index;
+INSERT INTO search_index (whole, key, entity_type, entity_id, name, drug_id)
+WITH RECURSIVE
+canonical(ingredient_id, drug_id) AS (
+    SELECT ingredient_id, drug_id FROM (
+        SELECT di.ingredient_id, di.drug_id,
+               ROW_NUMBER() OVER (PARTITION BY di.ingredient_id ORDER BY s.size, di.drug_id) AS n
+        FROM drug_ingredients di
+        JOIN (
+            SELECT drug_id, COUNT(*) AS size FROM drug_ingredients WHERE is_active GROUP BY drug_id
+        ) s ON s.drug_id = di.drug_id
+        WHERE di.is_active
+    ) WHERE n = 1
+),
+names(entity_type, entity_id, name, drug_id) AS (
+    SELECT 'drug', id, name, id FROM drugs
+    UNION ALL
+    SELECT 'generic', id, generic_name, id FROM drugs
+    WHERE generic_name IS NOT NULL AND lower(generic_name) <> lower(name)
+    UNION ALL
+    SELECT 'brand', id, name, drug_id FROM brand_names
+    UNION ALL
+    SELECT 'ingredient', i.id, i.name, c.drug_id FROM ingredients i
+    LEFT JOIN canonical c ON c.ingredient_id = i.id
+),
+words(whole, key, entity_type, entity_id, name, drug_id) AS (
+    SELECT 1,
+           trim(replace(replace(replace(
+               replace(replace(replace(replace(replace(lower(name), '-', ' '), '/', ' '), ',', ' '), '(', ' '), ')', ' '),
+               '  ', ' '), '  ', ' '), '  ', ' ')),
+           entity_type, entity_id, name, drug_id
+    FROM names
+    UNION ALL
+    SELECT 0, substr(key, instr(key, ' ') + 1), entity_type, entity_id, name, drug_id
+    FROM words WHERE instr(key, ' ') > 0
+)
+SELECT whole, key, entity_type, entity_id, name, drug_id FROM words WHERE key <> '';
+
+DELETE FROM search_facets;
+INSERT INTO search_facets (prefix, entity_type, count)
+SELECT prefix, entity_type, COUNT(DISTINCT entity_id) FROM (
+    SELECT substr(key, 1, 1) AS prefix, entity_type, entity_id FROM search_index
+    UNION ALL
+    SELECT substr(key, 1, 2), entity_type, entity_id FROM search_index WHERE length(key) > 1
+)
+GROUP BY prefix, entity_type;
+
+-- Resync the label full-text index (the triggers keep it current between
+-- rebuilds) and merge its segments for faster queries
+DELETE FROM label_fts;
+INSERT INTO label_fts (rowid, body, kind, drug_id)
+SELECT id * 2, text, CASE type WHEN 'contraindication' THEN 'contraindication' ELSE 'warning' END, drug_id
+FROM drug_warnings
+UNION ALL
+SELECT id * 2 + 1, description, 'contraindication', drug_id FROM drug_contraindications;
+INSERT INTO label_fts (label_fts) VALUES ('optimize');
+
+UPDATE knowledge_base_version SET version = version + 1;
+
+COMMIT;
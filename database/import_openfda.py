@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+
+import argparse
+import functools
+import io
+import json
+import multiprocessing
+import os
+import queue
+import re
+import sqlite3
+import sys
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'allergy_api', 'api'))
+import matcher
+import ndc
+import synonyms
+
+# Offline import of the openFDA drug label bulk download (drug-label-*.json.zip
+# from https://open.fda.gov/data/downloads/). Each zip holds one JSON file of
+# the form {"meta": ..., "results": [label, ...]}. A pool of worker processes
+# takes one file each, streams its labels one object at a time and extracts
+# their contraindication and warning sections and identifiers. The main
+# process matches each label to our drugs and writes the sections to
+# drug_warnings with source 'openFDA', a batch of
+# labels per transaction. The same transaction records how many labels of the
+# file are done in import_checkpoints, so --resume picks up after the last
+# committed batch. Sections are stored once per drug and text, however many
+# labels repeat them. A contraindications section is free text about many
+# conditions, not one condition with an evidence level, so it is stored as a
+# warning of type 'contraindication' and drug_contraindications keeps only
+# structured rows.
+#
+# A label is matched to our drugs by its RxCUIs (rxcui_crosswalk), else by
+# its NDCs (ndc_codes), else by brand name, else by generic name. When its
+# RxCUIs, NDCs or brand name lead to exactly one drug, the label's other
+# RxCUIs and NDCs are added to the crosswalk and the NDC index for that drug.
+#
+# The workers also tag each section with the conditions and allergens it
+# mentions, using one Aho-Corasick automaton (matcher.py) compiled from their
+# names and synonyms, so tagging costs one pass over the text however many
+# names there are. The tags are stored in label_mentions. Names are compared
+# by the normalized keys of synonyms.py, as the API compares them.
+#
+#   python database/import_openfda.py downloads/drug-label-*.json.zip
+
+SOURCE = 'openFDA'
+DATABASE = 'database/allergy_api.db'
+DERIVED_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'derived_data.sql')
+BATCH = 500
+CHUNK = 1 << 20
+PROGRESS_SECONDS = 5
+# Section texts whose tags each worker remembers: repackagers' labels repeat the manufacturer's text
+TAG_CACHE = 4096
+
+# Label sections imported, and the warning type each is stored as
+WARNING_SECTIONS = (('contraindications', 'contraindication'), ('boxed_warning', 'specific'),
+                    ('warnings_and_cautions', 'general'), ('warnings', 'general'))
+
+# Section headings labels start their text with, e.g. "4 CONTRAINDICATIONS" or "WARNINGS:"
+HEADING = re.compile(r'^(?:\d+(?:\.\d+)*\s+)?(?:BOXED WARNING|WARNINGS AND (?:PRECAUTIONS|CAUTIONS)|WARNINGS?'
+                     r'|CONTRAINDICATIONS?)\b[\s:.]*')
+
+
+class _Stream:
+    """Text read from a file in chunks, decoded one JSON value at a time"""
+
+    def __init__(self, file):
+        self.file = file
+        self.buffer = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _more(self):
+        chunk = self.file.read(CHUNK)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """The next non-whitespace character, or '' at the end"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._more():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'expected {char!r} at offset {self.pos}')
+        self.pos += 1
+
+    def value(self):
+        """The next JSON value, reading more of the file while it is incomplete"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._more():
+                    raise
+                continue
+            self.pos = end
+            return value
+
+
+def iter_labels(path):
+    """The labels of one bulk file, streamed from the zip one at a time"""
+    with zipfile.ZipFile(path) as archive:
+        for member in archive.namelist():
+            if not member.endswith('.json'):
+                continue
+            with archive.open(member) as raw:
+                stream = _Stream(io.TextIOWrapper(raw, encoding='utf-8'))
+                stream.expect('{')
+                while stream.peek() != '}':
+                    key = stream.value()
+                    stream.expect(':')
+                    if key != 'results':
+                        stream.value()
+                    else:
+                        stream.expect('[')
+                        while stream.peek() != ']':
+                            yield stream.value()
+                            if stream.peek() == ',':
+                                stream.expect(',')
+                        stream.expect(']')
+                    if stream.peek() == ',':
+                        stream.expect(',')
+
+
+def clean(text):
+    """Section text with whitespace collapsed and its heading removed"""
+    return HEADING.sub('', ' '.join(text.split()), count=1)
+
+
+def extract(label, tag):
+    """What the import needs from a label: its identifiers, and its section texts with what they mention"""
+    openfda = label.get('openfda', {})
+    ndcs = set()
+    for code in openfda.get('package_ndc', []) + openfda.get('product_ndc', []):
+        canonical = ndc.canonical(code)
+        if canonical:
+            ndcs.add(canonical)
+    warnings = [(kind, clean(t)) for s, kind in WARNING_SECTIONS for t in label.get(s, [])]
+    return {
+        'rxcuis': sorted(set(openfda.get('rxcui', []))),
+        'ndcs': sorted(ndcs),
+        'brand_names': sorted(set(openfda.get('brand_name', []))),
+        'generic_names': sorted(set(openfda.get('generic_name', []))),
+        'warnings': [(kind, t, tag(t)) for kind, t in warnings if t],
+    }
+
+
+def phrases(conn):
+    """(phrase, (entity type, id)) for every name and synonym of a condition or allergy, singular and plural"""
+    rows = conn.execute('''
+        SELECT 'condition', id, name FROM conditions
+        UNION ALL SELECT 'allergy', id, name FROM allergies
+        UNION ALL SELECT entity_type, entity_id, name FROM synonyms WHERE entity_type IN ('condition', 'allergy')
+    ''').fetchall()
+    for entity_type, entity_id, name in rows:
+        value = (entity_type, entity_id)
+        yield name, value
+        yield (name[:-1], value) if name.endswith('s') else (name + 's', value)
+
+
+# Worker processes: each streams one file and puts batches of extracted labels
+# on the queue as (file, position, labels, done)
+_queue = None
+_tag = None
+
+def _init_worker(results, automaton):
+    global _queue, _tag
+    _queue = results
+    _tag = functools.lru_cache(maxsize=TAG_CACHE)(lambda text: sorted(automaton.values(text)))
+
+def _import_file(task):
+    path, start = task
+    name = os.path.basename(path)
+    batch = []
+    position = 0
+    for position, label in enumerate(iter_labels(path), 1):
+        if position <= start:
+            continue
+        batch.append(extract(label, _tag))
+        if len(batch) == BATCH:
+            _queue.put((name, position, batch, False))
+            batch = []
+    _queue.put((name, max(position, start), batch, True))
+
+
+class Writer:
+    """Matches extracted labels to drugs and writes them, one transaction per batch"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rxcuis = {}
+        for rxcui, drug_id in conn.execute('SELECT rxcui, drug_id FROM rxcui_crosswalk WHERE drug_id IS NOT NULL'):
+            self.rxcuis.setdefault(rxcui, set()).add(drug_id)
+        self.ndcs = dict(conn.execute('SELECT ndc, drug_id FROM ndc_codes'))
+        self.brands = {}
+        self.generics = {}
+        for drug_id, name, generic_name in conn.execute('SELECT id, name, generic_name FROM drugs'):
+            self.brands.setdefault(synonyms.normalize(name), set()).add(drug_id)
+            if generic_name:
+                self.generics.setdefault(synonyms.normalize(generic_name), set()).add(drug_id)
+        for drug_id, name in conn.execute('SELECT drug_id, name FROM brand_names'):
+            self.brands.setdefault(synonyms.normalize(name), set()).add(drug_id)
+        # Sections already stored, so repeats across labels and resumed runs are skipped
+        self.seen = set(conn.execute('SELECT drug_id, type, text FROM drug_warnings WHERE source = ?', (SOURCE,)))
+        self.labels = 0
+        self.matched = 0
+        self.rows = 0
+        self.mentions = 0
+
+    def match(self, label):
+        """The drug ids a label belongs to, and whether they came from a strong match"""
+        tiers = (
+            (True, [self.rxcuis.get(r, set()) for r in label['rxcuis']]),
+            (True, [{self.ndcs[c]} for c in label['ndcs'] if c in self.ndcs]),
+            (True, [self.brands.get(synonyms.normalize(n), set()) for n in label['brand_names']]),
+            (False, [self.generics.get(synonyms.normalize(n), set()) for n in label['generic_names']]),
+        )
+        for strong, found in tiers:
+            drug_ids = set().union(*found)
+            if drug_ids:
+                return drug_ids, strong
+        return set(), False
+
+    def write(self, name, position, labels, done):
+        sections = []
+        rxcuis = []
+        ndcs = []
+        for label in labels:
+            drug_ids, strong = self.match(label)
+            self.labels += 1
+            if not drug_ids:
+                continue
+            self.matched += 1
+            for drug_id in sorted(drug_ids):
+                for kind, text, mentions in label['warnings']:
+                    if (drug_id, kind, text) not in self.seen:
+                        self.seen.add((drug_id, kind, text))
+                        sections.append(((drug_id, kind, text, SOURCE), mentions))
+            if strong and len(drug_ids) == 1:
+                drug_id = next(iter(drug_ids))
+                for rxcui in label['rxcuis']:
+                    if drug_id not in self.rxcuis.setdefault(rxcui, set()):
+                        self.rxcuis[rxcui].add(drug_id)
+                        rxcuis.append((rxcui, drug_id))
+                for code in label['ndcs']:
+                    if code not in self.ndcs:
+                        self.ndcs[code] = drug_id
+                        ndcs.append((code, drug_id, ndc.level(code)))
+
+        with self.conn:
+            for row, mentions in sections:
+                cursor = self.conn.execute(
+                    'INSERT INTO drug_warnings (drug_id, type, text, source) VALUES (?, ?, ?, ?)', row)
+                self.conn.executemany(
+                    'INSERT INTO label_mentions (kind, label_id, entity_type, entity_id) VALUES (?, ?, ?, ?)',
+                    (('warning', cursor.lastrowid, entity_type, entity_id) for entity_type, entity_id in mentions))
+                self.mentions += len(mentions)
+            self.conn.executemany('INSERT OR IGNORE INTO rxcui_crosswalk (rxcui, drug_id) VALUES (?, ?)', rxcuis)
+            self.conn.executemany('INSERT OR IGNORE INTO ndc_codes (ndc, drug_id, level) VALUES (?, ?, ?)', ndcs)
+            self.conn.execute('''
+                INSERT OR REPLACE INTO import_checkpoints (source, file, position, done, updated_at)
+                VALUES (?, ?, ?, ?, datetime('now', 'localtime'))
+            ''', (SOURCE, name, position, done))
+        self.rows += len(sections)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import contraindications and warnings from openFDA drug labels.')
+    parser.add_argument('files', nargs='+', help='drug-label-*.json.zip files of the openFDA bulk download')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from the checkpoints of an interrupted import instead of starting over')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    if args.resume:
+        checkpoints = {file: (position, done) for file, position, done in conn.execute(
+            'SELECT file, position, done FROM import_checkpoints WHERE source = ?', (SOURCE,))}
+    else:
+        with conn:
+            # Structured rows name a condition and are kept; rows without one are label text from older imports
+            conn.execute('DELETE FROM drug_contraindications WHERE source = ? AND condition_id IS NULL', (SOURCE,))
+            conn.execute('DELETE FROM drug_warnings WHERE source = ?', (SOURCE,))
+            conn.execute('DELETE FROM import_checkpoints WHERE source = ?', (SOURCE,))
+        checkpoints = {}
+
+    tasks = []
+    for path in args.files:
+        position, done = checkpoints.get(os.path.basename(path), (0, False))
+        if done:
+            print(f"Skipping {path}: already imported")
+        else:
+            if position:
+                print(f"Resuming {path} after {position} labels")
+            tasks.append((path, position))
+
+    automaton = matcher.Automaton(phrases(conn))
+    writer = Writer(conn)
+    started = time.monotonic()
+    reported = started
+    results = multiprocessing.Queue(maxsize=4 * max(args.workers, 1))
+    with multiprocessing.Pool(min(args.workers, len(tasks)) or 1, _init_worker, (results, automaton)) as pool:
+        pending = pool.map_async(_import_file, tasks)
+        remaining = len(tasks)
+        while remaining:
+            try:
+                name, position, labels, done = results.get(timeout=1)
+            except queue.Empty:
+                if pending.ready():
+                    pending.get()  # a worker failed: raise its error
+                continue
+            writer.write(name, position, labels, done)
+            if done:
+                remaining -= 1
+                print(f"Imported {name}", flush=True)
+            now = time.monotonic()
+            if now - reported >= PROGRESS_SECONDS or not remaining:
+                reported = now
+                print(f"{writer.labels} labels, {writer.matched} matched, {writer.rows} sections stored, "
+                      f"{writer.mentions} mentions tagged, "
+                      f"{writer.labels / (now - started):.0f} labels/s", flush=True)
+        pending.get()
+
+    print("Rebuilding derived tables...")
+    with open(DERIVED_DATA) as derived_file:
+        conn.executescript(derived_file.read())
+    conn.close()
+    print("Import complete.")
+
+if __name__ == "__main__":
+    main()
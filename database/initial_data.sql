@@ -174,27 +174,93 @@ INSERT INTO drug_ingredients (drug_id, ingredient_id, is_active)
 SELECT d.id, i.id, TRUE FROM drugs d, ingredients i 
 WHERE d.name = 'Tylenol with Codeine' AND i.name = 'Codeine';
 
--- Link Allergies to Ingredients
--- Penicillin allergy
-INSERT INTO allergy_ingredients (allergy_id, ingredient_id, relationship, evidence_level)
-SELECT a.id, i.id, 'exact', 'high' FROM allergies a, ingredients i
-WHERE a.name = 'Penicillin' AND i.name IN ('Penicillin G', 'Amoxicillin', 'Ampicillin');
-
--- Cephalosporins allergy
-INSERT INTO allergy_ingredients (allergy_id, ingredient_id, relationship, evidence_level)
-SELECT a.id, i.id, 'exact', 'high' FROM allergies a, ingredients i
-WHERE a.name = 'Cephalosporins' AND i.name IN ('Cephalexin', 'Cefazolin');
-
--- Sulfonamides allergy
-INSERT INTO allergy_ingredients (allergy_id, ingredient_id, relationship, evidence_level)
-SELECT a.id, i.id, 'exact', 'high' FROM allergies a, ingredients i
-WHERE a.name = 'Sulfonamides' AND i.name = 'Sulfamethoxazole';
-
--- NSAIDs allergy
-INSERT INTO allergy_ingredients (allergy_id, ingredient_id, relationship, evidence_level)
-SELECT a.id, i.id, 'exact', 'high' FROM allergies a, ingredients i
-WHERE a.name = 'NSAIDs' AND i.name IN ('Acetylsalicylic acid', 'Ibuprofen', 'Naproxen');
+-- Drug classes (ATC-style; a code's parent is its prefix one level up)
+INSERT INTO drug_classes (code, name) VALUES
+('C', 'Cardiovascular system'),
+('C09', 'Agents acting on the renin-angiotensin system'),
+('C09A', 'ACE inhibitors, plain'),
+('C09AA', 'ACE inhibitors, plain'),
+('J', 'Antiinfectives for systemic use'),
+('J01', 'Antibacterials for systemic use'),
+('J01A', 'Tetracyclines'),
+('J01AA', 'Tetracyclines'),
+('J01C', 'Beta-lactam antibacterials, penicillins'),
+('J01CA', 'Penicillins with extended spectrum'),
+('J01CE', 'Beta-lactamase sensitive penicillins'),
+('J01D', 'Other beta-lactam antibacterials'),
+('J01DB', 'First-generation cephalosporins'),
+('J01DC', 'Second-generation cephalosporins'),
+('J01DD', 'Third-generation cephalosporins'),
+('J01DE', 'Fourth-generation cephalosporins'),
+('J01E', 'Sulfonamides and trimethoprim'),
+('J01EA', 'Trimethoprim and derivatives'),
+('J01EC', 'Intermediate-acting sulfonamides'),
+('J01F', 'Macrolides, lincosamides and streptogramins'),
+('J01FA', 'Macrolides'),
+('J01M', 'Quinolone antibacterials'),
+('J01MA', 'Fluoroquinolones'),
+('M', 'Musculo-skeletal system'),
+('M01', 'Antiinflammatory and antirheumatic products'),
+('M01A', 'Antiinflammatory and antirheumatic products, non-steroids'),
+('M01AE', 'Propionic acid derivatives'),
+('N', 'Nervous system'),
+('N01', 'Anesthetics'),
+('N01B', 'Anesthetics, local'),
+('N01BA', 'Esters of aminobenzoic acid'),
+('N01BB', 'Amides'),
+('N02', 'Analgesics'),
+('N02A', 'Opioids'),
+('N02AA', 'Natural opium alkaloids'),
+('N02B', 'Other analgesics and antipyretics'),
+('N02BA', 'Salicylic acid and derivatives'),
+('N03', 'Antiepileptics'),
+('N03A', 'Antiepileptics'),
+('N03AB', 'Hydantoin derivatives'),
+('N03AF', 'Carboxamide derivatives'),
+('R', 'Respiratory system'),
+('R05', 'Cough and cold preparations'),
+('R05D', 'Cough suppressants, excl. combinations with expectorants'),
+('R05DA', 'Opium alkaloids and derivatives');
+
+UPDATE drug_classes SET parent_id = (
+    SELECT p.id FROM drug_classes p
+    WHERE p.code = substr(drug_classes.code, 1, CASE length(drug_classes.code) WHEN 3 THEN 1 WHEN 4 THEN 3 ELSE 4 END)
+) WHERE length(code) > 1;
+
+-- Place Ingredients in Drug Classes
+INSERT INTO ingredient_classes (ingredient_id, class_id)
+SELECT i.id, c.id FROM ingredients i, drug_classes c
+WHERE (i.name, c.code) IN (VALUES
+    ('Penicillin G', 'J01CE'), ('Amoxicillin', 'J01CA'), ('Ampicillin', 'J01CA'),
+    ('Cephalexin', 'J01DB'), ('Cefazolin', 'J01DB'),
+    ('Sulfamethoxazole', 'J01EC'), ('Trimethoprim', 'J01EA'),
+    ('Acetylsalicylic acid', 'N02BA'), ('Ibuprofen', 'M01AE'), ('Naproxen', 'M01AE'),
+    ('Tetracycline', 'J01AA'), ('Doxycycline', 'J01AA'),
+    ('Ciprofloxacin', 'J01MA'), ('Levofloxacin', 'J01MA'),
+    ('Erythromycin', 'J01FA'), ('Azithromycin', 'J01FA'),
+    ('Lidocaine', 'N01BB'), ('Benzocaine', 'N01BA'),
+    ('Lisinopril', 'C09AA'), ('Enalapril', 'C09AA'),
+    ('Phenytoin', 'N03AB'), ('Carbamazepine', 'N03AF'),
+    ('Codeine', 'R05DA'), ('Morphine', 'N02AA')
+);
+
+-- Link Class Allergies to Drug Classes (members resolve through the hierarchy)
+INSERT INTO allergy_classes (allergy_id, class_id, evidence_level)
+SELECT a.id, c.id, 'high' FROM allergies a, drug_classes c
+WHERE (a.name, c.code) IN (VALUES
+    ('Penicillin', 'J01C'),
+    ('Cephalosporins', 'J01DB'), ('Cephalosporins', 'J01DC'), ('Cephalosporins', 'J01DD'), ('Cephalosporins', 'J01DE'),
+    ('Sulfonamides', 'J01EC'),
+    ('NSAIDs', 'M01A'), ('NSAIDs', 'N02BA'),
+    ('Tetracyclines', 'J01A'),
+    ('Fluoroquinolones', 'J01MA'),
+    ('Macrolides', 'J01FA'),
+    ('Local anesthetics', 'N01B'),
+    ('ACE inhibitors', 'C09A'),
+    ('Anticonvulsants', 'N03A')
+);
 
+-- Link Allergies to Ingredients
 -- Aspirin allergy
 INSERT INTO allergy_ingredients (allergy_id, ingredient_id, relationship, evidence_level)
 SELECT a.id, i.id, 'exact', 'high' FROM allergies a, ingredients i
@@ -205,36 +271,6 @@ INSERT INTO allergy_ingredients (allergy_id, ingredient_id, relationship, eviden
 SELECT a.id, i.id, 'exact', 'high' FROM allergies a, ingredients i
 WHERE a.name = 'Ibuprofen' AND i.name = 'Ibuprofen';
 
--- Tetracyclines allergy
-INSERT INTO allergy_ingredients (allergy_id, ingredient_id, relationship, evidence_level)
-SELECT a.id, i.id, 'exact', 'high' FROM allergies a, ingredients i
-WHERE a.name = 'Tetracyclines' AND i.name IN ('Tetracycline', 'Doxycycline');
-
--- Fluoroquinolones allergy
-INSERT INTO allergy_ingredients (allergy_id, ingredient_id, relationship, evidence_level)
-SELECT a.id, i.id, 'exact', 'high' FROM allergies a, ingredients i
-WHERE a.name = 'Fluoroquinolones' AND i.name IN ('Ciprofloxacin', 'Levofloxacin');
-
--- Macrolides allergy
-INSERT INTO allergy_ingredients (allergy_id, ingredient_id, relationship, evidence_level)
-SELECT a.id, i.id, 'exact', 'high' FROM allergies a, ingredients i
-WHERE a.name = 'Macrolides' AND i.name IN ('Erythromycin', 'Azithromycin');
-
--- Local anesthetics allergy
-INSERT INTO allergy_ingredients (allergy_id, ingredient_id, relationship, evidence_level)
-SELECT a.id, i.id, 'exact', 'high' FROM allergies a, ingredients i
-WHERE a.name = 'Local anesthetics' AND i.name IN ('Lidocaine', 'Benzocaine');
-
--- ACE inhibitors allergy
-INSERT INTO allergy_ingredients (allergy_id, ingredient_id, relationship, evidence_level)
-SELECT a.id, i.id, 'exact', 'high' FROM allergies a, ingredients i
-WHERE a.name = 'ACE inhibitors' AND i.name IN ('Lisinopril', 'Enalapril');
-
--- Anticonvulsants allergy
-INSERT INTO allergy_ingredients (allergy_id, ingredient_id, relationship, evidence_level)
-SELECT a.id, i.id, 'exact', 'high' FROM allergies a, ingredients i
-WHERE a.name = 'Anticonvulsants' AND i.name IN ('Phenytoin', 'Carbamazepine');
-
 -- Codeine allergy
 INSERT INTO allergy_ingredients (allergy_id, ingredient_id, relationship, evidence_level)
 SELECT a.id, i.id, 'exact', 'high' FROM allergies a, ingredients i
@@ -308,3 +344,88 @@ INSERT INTO drug_warnings (drug_id, type, text, source)
 SELECT d.id, 'specific', 'May cause gastrointestinal bleeding. Take with food to minimize risk.', 'openFDA'
 FROM drugs d
 WHERE d.name IN ('Aspirin', 'Advil', 'Aleve');
+
+-- Synonyms and abbreviations
+-- Drugs
+INSERT INTO synonyms (entity_type, entity_id, name)
+SELECT 'drug', id, 'TMP-SMX' FROM drugs WHERE name = 'Bactrim'
+UNION ALL SELECT 'drug', id, 'SMX-TMP' FROM drugs WHERE name = 'Bactrim'
+UNION ALL SELECT 'drug', id, 'Co-trimoxazole' FROM drugs WHERE name = 'Bactrim'
+UNION ALL SELECT 'drug', id, 'Amox-clav' FROM drugs WHERE name = 'Augmentin'
+UNION ALL SELECT 'drug', id, 'Co-amoxiclav' FROM drugs WHERE name = 'Augmentin'
+UNION ALL SELECT 'drug', id, 'ASA' FROM drugs WHERE name = 'Aspirin'
+UNION ALL SELECT 'drug', id, 'Tylenol #3' FROM drugs WHERE name = 'Tylenol with Codeine'
+UNION ALL SELECT 'drug', id, 'APAP/codeine' FROM drugs WHERE name = 'Tylenol with Codeine'
+UNION ALL SELECT 'drug', id, 'Acetaminophen with codeine' FROM drugs WHERE name = 'Tylenol with Codeine';
+
+-- Ingredients
+INSERT INTO synonyms (entity_type, entity_id, name)
+SELECT 'ingredient', id, 'Pen G' FROM ingredients WHERE name = 'Penicillin G'
+UNION ALL SELECT 'ingredient', id, 'Benzylpenicillin' FROM ingredients WHERE name = 'Penicillin G'
+UNION ALL SELECT 'ingredient', id, 'SMX' FROM ingredients WHERE name = 'Sulfamethoxazole'
+UNION ALL SELECT 'ingredient', id, 'TMP' FROM ingredients WHERE name = 'Trimethoprim'
+UNION ALL SELECT 'ingredient', id, 'ASA' FROM ingredients WHERE name = 'Acetylsalicylic acid'
+UNION ALL SELECT 'ingredient', id, 'Lignocaine' FROM ingredients WHERE name = 'Lidocaine'
+UNION ALL SELECT 'ingredient', id, 'Sodium metabisulphite' FROM ingredients WHERE name = 'Sodium metabisulfite';
+
+-- Allergies
+INSERT INTO synonyms (entity_type, entity_id, name)
+SELECT 'allergy', id, 'PCN' FROM allergies WHERE name = 'Penicillin'
+UNION ALL SELECT 'allergy', id, 'Penicillins' FROM allergies WHERE name = 'Penicillin'
+UNION ALL SELECT 'allergy', id, 'Pénicilline' FROM allergies WHERE name = 'Penicillin'
+UNION ALL SELECT 'allergy', id, 'Cephalosporin' FROM allergies WHERE name = 'Cephalosporins'
+UNION ALL SELECT 'allergy', id, 'Cephs' FROM allergies WHERE name = 'Cephalosporins'
+UNION ALL SELECT 'allergy', id, 'Sulfa' FROM allergies WHERE name = 'Sulfonamides'
+UNION ALL SELECT 'allergy', id, 'Sulfa drugs' FROM allergies WHERE name = 'Sulfonamides'
+UNION ALL SELECT 'allergy', id, 'Sulfonamide' FROM allergies WHERE name = 'Sulfonamides'
+UNION ALL SELECT 'allergy', id, 'Sulphonamides' FROM allergies WHERE name = 'Sulfonamides'
+UNION ALL SELECT 'allergy', id, 'TMP-SMX' FROM allergies WHERE name = 'Sulfonamides'
+UNION ALL SELECT 'allergy', id, 'NSAID' FROM allergies WHERE name = 'NSAIDs'
+UNION ALL SELECT 'allergy', id, 'Nonsteroidal anti-inflammatory drugs' FROM allergies WHERE name = 'NSAIDs'
+UNION ALL SELECT 'allergy', id, 'Non-steroidal anti-inflammatory drugs' FROM allergies WHERE name = 'NSAIDs'
+UNION ALL SELECT 'allergy', id, 'ASA' FROM allergies WHERE name = 'Aspirin'
+UNION ALL SELECT 'allergy', id, 'Acetylsalicylic acid' FROM allergies WHERE name = 'Aspirin'
+UNION ALL SELECT 'allergy', id, 'Tetracycline' FROM allergies WHERE name = 'Tetracyclines'
+UNION ALL SELECT 'allergy', id, 'Fluoroquinolone' FROM allergies WHERE name = 'Fluoroquinolones'
+UNION ALL SELECT 'allergy', id, 'Quinolones' FROM allergies WHERE name = 'Fluoroquinolones'
+UNION ALL SELECT 'allergy', id, 'Macrolide' FROM allergies WHERE name = 'Macrolides'
+UNION ALL SELECT 'allergy', id, 'Local anesthetic' FROM allergies WHERE name = 'Local anesthetics'
+UNION ALL SELECT 'allergy', id, 'Local anaesthetics' FROM allergies WHERE name = 'Local anesthetics'
+UNION ALL SELECT 'allergy', id, 'Caines' FROM allergies WHERE name = 'Local anesthetics'
+UNION ALL SELECT 'allergy', id, 'ACE inhibitor' FROM allergies WHERE name = 'ACE inhibitors'
+UNION ALL SELECT 'allergy', id, 'ACEI' FROM allergies WHERE name = 'ACE inhibitors'
+UNION ALL SELECT 'allergy', id, 'ACE-I' FROM allergies WHERE name = 'ACE inhibitors'
+UNION ALL SELECT 'allergy', id, 'Angiotensin-converting enzyme inhibitors' FROM allergies WHERE name = 'ACE inhibitors'
+UNION ALL SELECT 'allergy', id, 'Anticonvulsant' FROM allergies WHERE name = 'Anticonvulsants'
+UNION ALL SELECT 'allergy', id, 'Antiepileptics' FROM allergies WHERE name = 'Anticonvulsants'
+UNION ALL SELECT 'allergy', id, 'AEDs' FROM allergies WHERE name = 'Anticonvulsants'
+UNION ALL SELECT 'allergy', id, 'Sulfite' FROM allergies WHERE name = 'Sulfites'
+UNION ALL SELECT 'allergy', id, 'Sulphites' FROM allergies WHERE name = 'Sulfites';
+
+-- Conditions
+INSERT INTO synonyms (entity_type, entity_id, name)
+SELECT 'condition', id, 'Pregnant' FROM conditions WHERE name = 'Pregnancy'
+UNION ALL SELECT 'condition', id, 'Breast-feeding' FROM conditions WHERE name = 'Breastfeeding'
+UNION ALL SELECT 'condition', id, 'Lactation' FROM conditions WHERE name = 'Breastfeeding'
+UNION ALL SELECT 'condition', id, 'Nursing mothers' FROM conditions WHERE name = 'Breastfeeding'
+UNION ALL SELECT 'condition', id, 'Renal failure' FROM conditions WHERE name = 'Renal impairment'
+UNION ALL SELECT 'condition', id, 'Renal disease' FROM conditions WHERE name = 'Renal impairment'
+UNION ALL SELECT 'condition', id, 'Kidney disease' FROM conditions WHERE name = 'Renal impairment'
+UNION ALL SELECT 'condition', id, 'Kidney impairment' FROM conditions WHERE name = 'Renal impairment'
+UNION ALL SELECT 'condition', id, 'CKD' FROM conditions WHERE name = 'Renal impairment'
+UNION ALL SELECT 'condition', id, 'Hepatic failure' FROM conditions WHERE name = 'Hepatic impairment'
+UNION ALL SELECT 'condition', id, 'Hepatic disease' FROM conditions WHERE name = 'Hepatic impairment'
+UNION ALL SELECT 'condition', id, 'Liver disease' FROM conditions WHERE name = 'Hepatic impairment'
+UNION ALL SELECT 'condition', id, 'Liver impairment' FROM conditions WHERE name = 'Hepatic impairment'
+UNION ALL SELECT 'condition', id, 'Heart disease' FROM conditions WHERE name = 'Cardiovascular disease'
+UNION ALL SELECT 'condition', id, 'Heart failure' FROM conditions WHERE name = 'Cardiovascular disease'
+UNION ALL SELECT 'condition', id, 'Coronary artery disease' FROM conditions WHERE name = 'Cardiovascular disease'
+UNION ALL SELECT 'condition', id, 'CAD' FROM conditions WHERE name = 'Cardiovascular disease'
+UNION ALL SELECT 'condition', id, 'Diabetes mellitus' FROM conditions WHERE name = 'Diabetes'
+UNION ALL SELECT 'condition', id, 'Diabetic' FROM conditions WHERE name = 'Diabetes'
+UNION ALL SELECT 'condition', id, 'Bronchial asthma' FROM conditions WHERE name = 'Asthma'
+UNION ALL SELECT 'condition', id, 'Angle-closure glaucoma' FROM conditions WHERE name = 'Glaucoma'
+UNION ALL SELECT 'condition', id, 'Narrow-angle glaucoma' FROM conditions WHERE name = 'Glaucoma'
+UNION ALL SELECT 'condition', id, 'Thyroid disease' FROM conditions WHERE name = 'Thyroid disorders'
+UNION ALL SELECT 'condition', id, 'Hyperthyroidism' FROM conditions WHERE name = 'Thyroid disorders'
+UNION ALL SELECT 'condition', id, 'Hypothyroidism' FROM conditions WHERE name = 'Thyroid disorders';
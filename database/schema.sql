@@ -17,6 +17,38 @@ CREATE INDEX idx_drugs_name ON drugs(name);
 CREATE INDEX idx_drugs_rxcui ON drugs(rxcui);
 CREATE INDEX idx_drugs_ndc ON drugs(ndc);
 
+-- NDC Codes table: every package-level (11-digit) and product-level (9-digit)
+-- NDC of each drug, in the canonical form of ndc.py, so that a code in any
+-- spelling is found with a primary key probe
+CREATE TABLE ndc_codes (
+    ndc VARCHAR(11) PRIMARY KEY,
+    drug_id INTEGER NOT NULL REFERENCES drugs(id),
+    level VARCHAR(10) NOT NULL, -- package, product
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) WITHOUT ROWID;
+
+CREATE INDEX idx_ndc_codes_drug_id ON ndc_codes(drug_id);
+
+-- RxCUI Crosswalk table: every RxCUI of a drug or ingredient with its RxNorm
+-- term type (SCD, SBD, GPCK, BPCK, IN, PIN, MIN, ...). One RxCUI may map to
+-- several drugs, and a drug has one row per RxCUI it is known by.
+CREATE TABLE rxcui_crosswalk (
+    id SERIAL PRIMARY KEY,
+    rxcui VARCHAR(50) NOT NULL,
+    tty VARCHAR(20),
+    drug_id INTEGER REFERENCES drugs(id),
+    ingredient_id INTEGER REFERENCES ingredients(id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Unique per RxCUI and drug or ingredient; COALESCE since NULLs never collide
+CREATE UNIQUE INDEX idx_rxcui_crosswalk_unique
+    ON rxcui_crosswalk(rxcui, COALESCE(drug_id, 0), COALESCE(ingredient_id, 0));
+CREATE INDEX idx_rxcui_crosswalk_drug_id ON rxcui_crosswalk(drug_id);
+CREATE INDEX idx_rxcui_crosswalk_ingredient_id ON rxcui_crosswalk(ingredient_id);
+
 -- Brand Names table
 CREATE TABLE brand_names (
     id SERIAL PRIMARY KEY,
@@ -97,6 +129,19 @@ CREATE TABLE conditions (
 CREATE INDEX idx_conditions_name ON conditions(name);
 CREATE INDEX idx_conditions_normalized_name ON conditions(normalized_name);
 
+-- Synonyms table: abbreviations and other names of drugs, ingredients,
+-- allergies and conditions (ASA, PCN, TMP-SMX). Name lookups compare them,
+-- like the names themselves, by their normalized key (synonyms.py).
+CREATE TABLE synonyms (
+    id SERIAL PRIMARY KEY,
+    entity_type VARCHAR(20) NOT NULL CHECK (entity_type IN ('drug', 'ingredient', 'allergy', 'condition')),
+    entity_id INTEGER NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(entity_type, entity_id, name)
+);
+
 -- Drug Contraindications table
 CREATE TABLE drug_contraindications (
     id SERIAL PRIMARY KEY,
@@ -117,7 +162,7 @@ CREATE INDEX idx_drug_contraindications_condition_id ON drug_contraindications(c
 CREATE TABLE drug_warnings (
     id SERIAL PRIMARY KEY,
     drug_id INTEGER REFERENCES drugs(id),
-    type VARCHAR(50) CHECK (type IN ('general', 'specific')),
+    type VARCHAR(50) CHECK (type IN ('general', 'specific', 'contraindication')),
     text TEXT NOT NULL,
     source VARCHAR(50) CHECK (source IN ('openFDA', 'custom')),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -140,3 +185,376 @@ CREATE TABLE cross_reactivity (
 
 CREATE INDEX idx_cross_reactivity_source_id ON cross_reactivity(source_id);
 CREATE INDEX idx_cross_reactivity_target_id ON cross_reactivity(target_id);
+
+-- Drug Classes table (ATC-style hierarchy). tree_left is the class's pre-order
+-- number and tree_right the largest pre-order number in its subtree, so class B
+-- is under class A when A.tree_left <= B.tree_left <= A.tree_right. Both are
+-- filled by derived_data.sql.
+CREATE TABLE drug_classes (
+    id SERIAL PRIMARY KEY,
+    code VARCHAR(20) NOT NULL UNIQUE,
+    name VARCHAR(255) NOT NULL,
+    parent_id INTEGER REFERENCES drug_classes(id),
+    tree_left INTEGER,
+    tree_right INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_drug_classes_parent_id ON drug_classes(parent_id);
+CREATE INDEX idx_drug_classes_tree_left ON drug_classes(tree_left);
+
+-- Ingredient Classes table
+CREATE TABLE ingredient_classes (
+    id SERIAL PRIMARY KEY,
+    ingredient_id INTEGER REFERENCES ingredients(id),
+    class_id INTEGER REFERENCES drug_classes(id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(ingredient_id, class_id)
+);
+
+CREATE INDEX idx_ingredient_classes_class_id ON ingredient_classes(class_id);
+
+-- Allergy Classes table: a class allergy covers every ingredient under its classes
+CREATE TABLE allergy_classes (
+    id SERIAL PRIMARY KEY,
+    allergy_id INTEGER REFERENCES allergies(id),
+    class_id INTEGER REFERENCES drug_classes(id),
+    evidence_level VARCHAR(50) CHECK (evidence_level IN ('high', 'medium', 'low')),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(allergy_id, class_id)
+);
+
+-- Full-text index over label text: drug_warnings.text (rowid = id * 2) and
+-- drug_contraindications.description (rowid = id * 2 + 1), kept in sync by
+-- the triggers below. kind is 'contraindication' for both contraindication
+-- descriptions and the contraindications sections of labels (drug_warnings
+-- rows of that type), otherwise 'warning'.
+CREATE VIRTUAL TABLE label_fts USING fts5(
+    body,
+    kind UNINDEXED,
+    drug_id UNINDEXED,
+    tokenize = 'porter unicode61'
+);
+
+CREATE TRIGGER drug_warnings_fts_insert AFTER INSERT ON drug_warnings BEGIN
+    INSERT INTO label_fts (rowid, body, kind, drug_id)
+    VALUES (new.id * 2, new.text, CASE new.type WHEN 'contraindication' THEN 'contraindication' ELSE 'warning' END,
+            new.drug_id);
+END;
+
+CREATE TRIGGER drug_warnings_fts_update AFTER UPDATE OF text, type, drug_id ON drug_warnings BEGIN
+    DELETE FROM label_fts WHERE rowid = old.id * 2;
+    INSERT INTO label_fts (rowid, body, kind, drug_id)
+    VALUES (new.id * 2, new.text, CASE new.type WHEN 'contraindication' THEN 'contraindication' ELSE 'warning' END,
+            new.drug_id);
+END;
+
+CREATE TRIGGER drug_warnings_fts_delete AFTER DELETE ON drug_warnings BEGIN
+    DELETE FROM label_fts WHERE rowid = old.id * 2;
+END;
+
+CREATE TRIGGER drug_contraindications_fts_insert AFTER INSERT ON drug_contraindications BEGIN
+    INSERT INTO label_fts (rowid, body, kind, drug_id)
+    VALUES (new.id * 2 + 1, new.description, 'contraindication', new.drug_id);
+END;
+
+CREATE TRIGGER drug_contraindications_fts_update AFTER UPDATE OF description, drug_id ON drug_contraindications BEGIN
+    DELETE FROM label_fts WHERE rowid = old.id * 2 + 1;
+    INSERT INTO label_fts (rowid, body, kind, drug_id)
+    VALUES (new.id * 2 + 1, new.description, 'contraindication', new.drug_id);
+END;
+
+CREATE TRIGGER drug_contraindications_fts_delete AFTER DELETE ON drug_contraindications BEGIN
+    DELETE FROM label_fts WHERE rowid = old.id * 2 + 1;
+END;
+
+-- Label Mentions table: the conditions and allergens a label section
+-- mentions, tagged by the openFDA import. kind and label_id name the section:
+-- a drug_contraindications or drug_warnings row, whose deletion removes its tags.
+CREATE TABLE label_mentions (
+    kind VARCHAR(20) NOT NULL CHECK (kind IN ('contraindication', 'warning')),
+    label_id INTEGER NOT NULL,
+    entity_type VARCHAR(20) NOT NULL CHECK (entity_type IN ('condition', 'allergy')),
+    entity_id INTEGER NOT NULL,
+    PRIMARY KEY (kind, label_id, entity_type, entity_id)
+) WITHOUT ROWID;
+
+CREATE INDEX idx_label_mentions_entity ON label_mentions(entity_type, entity_id);
+
+CREATE TRIGGER drug_warnings_mentions_delete AFTER DELETE ON drug_warnings BEGIN
+    DELETE FROM label_mentions WHERE kind = 'warning' AND label_id = old.id;
+END;
+
+CREATE TRIGGER drug_contraindications_mentions_delete AFTER DELETE ON drug_contraindications BEGIN
+    DELETE FROM label_mentions WHERE kind = 'contraindication' AND label_id = old.id;
+END;
+
+-- Import Checkpoints table: how many records of each input file an import
+-- has committed, written in the same transaction as the records themselves
+CREATE TABLE import_checkpoints (
+    source VARCHAR(50) NOT NULL,
+    file VARCHAR(255) NOT NULL,
+    position INTEGER NOT NULL,
+    done BOOLEAN DEFAULT FALSE,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (source, file)
+);
+
+-- API Keys table (only a SHA-256 hash of each key is stored)
+CREATE TABLE api_keys (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    key_prefix VARCHAR(16) NOT NULL,
+    key_hash CHAR(64) NOT NULL UNIQUE,
+    tier VARCHAR(50) NOT NULL DEFAULT 'standard',
+    revoked_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Derived tables, filled by derived_data.sql from the tables above. Rebuild
+-- them whenever drugs, brand_names, ingredients, allergy_ingredients, the drug
+-- classes or cross_reactivity change.
+
+-- Every ingredient an allergy covers, in keyset (ingredient_id) order: its own
+-- allergy_ingredients rows, plus the ingredients under its classes (as exact
+-- matches) that have no such row
+CREATE TABLE allergy_members (
+    allergy_id INTEGER REFERENCES allergies(id),
+    ingredient_id INTEGER REFERENCES ingredients(id),
+    relationship VARCHAR(50),
+    evidence_level VARCHAR(50),
+    PRIMARY KEY (allergy_id, ingredient_id)
+) WITHOUT ROWID;
+
+-- Drugs related to each allergy, one row per drug, in keyset (drug_id) order
+CREATE TABLE allergy_drugs (
+    allergy_id INTEGER REFERENCES allergies(id),
+    drug_id INTEGER REFERENCES drugs(id),
+    relationship VARCHAR(50),
+    PRIMARY KEY (allergy_id, drug_id)
+);
+
+-- Cross-reactivity rows whose source ingredient belongs to each allergy
+CREATE TABLE allergy_cross_reactivity (
+    allergy_id INTEGER REFERENCES allergies(id),
+    cross_reactivity_id INTEGER REFERENCES cross_reactivity(id),
+    PRIMARY KEY (allergy_id, cross_reactivity_id)
+);
+
+-- Per-allergy totals for the paginated lists of /v1/allergy
+CREATE TABLE allergy_stats (
+    allergy_id INTEGER PRIMARY KEY REFERENCES allergies(id),
+    ingredient_count INTEGER NOT NULL,
+    drug_count INTEGER NOT NULL,
+    cross_reactivity_count INTEGER NOT NULL
+);
+
+-- Catalog search for /v1/search: drug names, generic names, brand names and
+-- ingredient names, each resolved to its canonical drug. A name has one row
+-- with whole = 1 keyed by the whole normalized name, and one row with
+-- whole = 0 for each later word, keyed by the name from that word on.
+CREATE TABLE search_index (
+    whole INTEGER NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    entity_type VARCHAR(20) NOT NULL,
+    entity_id INTEGER NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    drug_id INTEGER REFERENCES drugs(id),
+    PRIMARY KEY (whole, key, entity_type, entity_id)
+) WITHOUT ROWID;
+
+-- Matching entities per type for catalog searches of one or two characters,
+-- the widest ranges of search_index, so those facets are not counted per request
+CREATE TABLE search_facets (
+    prefix VARCHAR(2) NOT NULL,
+    entity_type VARCHAR(20) NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (prefix, entity_type)
+) WITHOUT ROWID;
+
+
+-- Knowledge base version: a counter the triggers below bump on every insert,
+-- update and delete in the tables above that the API reads, and that
+-- derived_data.sql bumps once per rebuild of the derived tables. The API
+-- rebuilds its in-memory indexes when it changes (versioned.py).
+CREATE TABLE knowledge_base_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+
+INSERT INTO knowledge_base_version (id, version) VALUES (1, 1);
+
+
+CREATE TRIGGER drugs_version_insert AFTER INSERT ON drugs BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER drugs_version_update AFTER UPDATE ON drugs BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER drugs_version_delete AFTER DELETE ON drugs BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+
+CREATE TRIGGER ndc_codes_version_insert AFTER INSERT ON ndc_codes BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER ndc_codes_version_update AFTER UPDATE ON ndc_codes BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER ndc_codes_version_delete AFTER DELETE ON ndc_codes BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+
+CREATE TRIGGER rxcui_crosswalk_version_insert AFTER INSERT ON rxcui_crosswalk BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER rxcui_crosswalk_version_update AFTER UPDATE ON rxcui_crosswalk BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER rxcui_crosswalk_version_delete AFTER DELETE ON rxcui_crosswalk BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+
+CREATE TRIGGER brand_names_version_insert AFTER INSERT ON brand_names BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER brand_names_version_update AFTER UPDATE ON brand_names BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER brand_names_version_delete AFTER DELETE ON brand_names BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+
+CREATE TRIGGER ingredients_version_insert AFTER INSERT ON ingredients BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER ingredients_version_update AFTER UPDATE ON ingredients BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER ingredients_version_delete AFTER DELETE ON ingredients BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+
+CREATE TRIGGER drug_ingredients_version_insert AFTER INSERT ON drug_ingredients BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER drug_ingredients_version_update AFTER UPDATE ON drug_ingredients BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER drug_ingredients_version_delete AFTER DELETE ON drug_ingredients BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+
+CREATE TRIGGER allergies_version_insert AFTER INSERT ON allergies BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER allergies_version_update AFTER UPDATE ON allergies BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER allergies_version_delete AFTER DELETE ON allergies BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+
+CREATE TRIGGER allergy_ingredients_version_insert AFTER INSERT ON allergy_ingredients BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER allergy_ingredients_version_update AFTER UPDATE ON allergy_ingredients BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER allergy_ingredients_version_delete AFTER DELETE ON allergy_ingredients BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+
+CREATE TRIGGER conditions_version_insert AFTER INSERT ON conditions BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER conditions_version_update AFTER UPDATE ON conditions BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER conditions_version_delete AFTER DELETE ON conditions BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+
+CREATE TRIGGER synonyms_version_insert AFTER INSERT ON synonyms BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER synonyms_version_update AFTER UPDATE ON synonyms BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER synonyms_version_delete AFTER DELETE ON synonyms BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+
+CREATE TRIGGER drug_contraindications_version_insert AFTER INSERT ON drug_contraindications BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER drug_contraindications_version_update AFTER UPDATE ON drug_contraindications BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER drug_contraindications_version_delete AFTER DELETE ON drug_contraindications BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+
+CREATE TRIGGER drug_warnings_version_insert AFTER INSERT ON drug_warnings BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER drug_warnings_version_update AFTER UPDATE ON drug_warnings BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER drug_warnings_version_delete AFTER DELETE ON drug_warnings BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+
+CREATE TRIGGER cross_reactivity_version_insert AFTER INSERT ON cross_reactivity BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER cross_reactivity_version_update AFTER UPDATE ON cross_reactivity BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER cross_reactivity_version_delete AFTER DELETE ON cross_reactivity BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+
+CREATE TRIGGER drug_classes_version_insert AFTER INSERT ON drug_classes BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER drug_classes_version_update AFTER UPDATE ON drug_classes BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER drug_classes_version_delete AFTER DELETE ON drug_classes BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+
+CREATE TRIGGER ingredient_classes_version_insert AFTER INSERT ON ingredient_classes BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER ingredient_classes_version_update AFTER UPDATE ON ingredient_classes BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER ingredient_classes_version_delete AFTER DELETE ON ingredient_classes BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+
+CREATE TRIGGER allergy_classes_version_insert AFTER INSERT ON allergy_classes BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER allergy_classes_version_update AFTER UPDATE ON allergy_classes BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER allergy_classes_version_delete AFTER DELETE ON allergy_classes BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+
+CREATE TRIGGER label_mentions_version_insert AFTER INSERT ON label_mentions BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER label_mentions_version_update AFTER UPDATE ON label_mentions BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
+CREATE TRIGGER label_mentions_version_delete AFTER DELETE ON label_mentions BEGIN
+    UPDATE knowledge_base_version SET version = version + 1;
+END;
@@ -4,6 +4,9 @@ import sqlite3
 import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'allergy_api', 'api'))
+import ndc
+
 # Create database directory if it doesn't exist
 os.makedirs(os.path.dirname('database/allergy_api.db'), exist_ok=True)
 
@@ -44,6 +47,39 @@ with open('database/initial_data.sql', 'r') as data_file:
         conn.rollback()
         sys.exit(1)
 
+print("Indexing NDCs...")
+
+# Index each drug's NDC in canonical form, and the product NDC it belongs to;
+# codes that are not NDCs, or are bare 10-digit codes that could be more than
+# one, are left out
+for drug_id, code in cursor.execute('SELECT id, ndc FROM drugs WHERE ndc IS NOT NULL').fetchall():
+    canonical = ndc.canonical(code)
+    if canonical is None:
+        print(f"Skipping NDC {code!r} of drug {drug_id}: not a hyphenated or 11-digit NDC")
+        continue
+    for indexed in (canonical, ndc.product(canonical)):
+        cursor.execute('INSERT OR IGNORE INTO ndc_codes (ndc, drug_id, level) VALUES (?, ?, ?)',
+                       (indexed, drug_id, ndc.level(indexed)))
+
+print("Building RxCUI crosswalk...")
+
+# The RxCUI of each drug and ingredient; importers add the other RxCUIs they know
+cursor.execute('''
+    INSERT OR IGNORE INTO rxcui_crosswalk (rxcui, drug_id)
+    SELECT rxcui, id FROM drugs WHERE rxcui IS NOT NULL
+''')
+cursor.execute('''
+    INSERT OR IGNORE INTO rxcui_crosswalk (rxcui, ingredient_id)
+    SELECT rxcui, id FROM ingredients WHERE rxcui IS NOT NULL
+''')
+
+print("Building derived tables...")
+
+# Read derived data SQL file
+with open('database/derived_data.sql', 'r') as derived_file:
+    conn.commit()
+    cursor.executescript(derived_file.read())
+
 # Commit changes and close connection
 conn.commit()
 conn.close()